@@ -3,6 +3,9 @@ import json
 from typing import List, Dict, Any
 import os
 from dotenv import load_dotenv
+from services.upstream import DeadlineExceeded, check_deadline
+from services.cassette import cassette
+from services.cancellation import RequestCancelled, check_cancelled, wasted_work
 
 # Load environment variables
 load_dotenv()
@@ -16,10 +19,29 @@ class ImageGenerator:
 
     def _on_queue_update(self, update):
         """Handle queue updates during image generation"""
+        # Raising here stops polling past the request deadline or after the client left
+        check_deadline()
+        check_cancelled()
         if isinstance(update, fal_client.InProgress):
             for log in update.logs:
                 print(f"Progress: {log['message']}")
 
+    def _run(self, application: str, arguments: Dict[str, Any]) -> Dict[str, Any]:
+        """fal_client.subscribe, but the queued request is cancelled when we stop waiting for it"""
+        handle = fal_client.submit(application, arguments=arguments)
+        try:
+            for update in handle.iter_events(with_logs=True):
+                self._on_queue_update(update)
+        except (DeadlineExceeded, RequestCancelled):
+            try:
+                handle.cancel()
+                wasted_work["fal_queue_cancelled"] += 1
+            except Exception as e:
+                # Already running or finished; FAL will complete it regardless
+                print(f"Could not cancel FAL request {handle.request_id}: {str(e)}")
+            raise
+        return handle.get()
+
     def generate_images_from_prompts(self, prompts_json: str, image_size: str = "landscape_16_9") -> List[Dict[str, Any]]:
         """
         Generate images from a JSON string containing prompts
@@ -55,17 +77,16 @@ class ImageGenerator:
 
                     print(f"\nProcessing prompt for Fal:\n{background_prompt}\n")
 
-                    result = fal_client.subscribe(
-                        "fal-ai/flux-pro/v1.1",
-                        arguments={
-                            "prompt": background_prompt,
-                            "image_size": image_size,
-                            "num_images": 1,
-                            "enable_safety_checker": True,
-                            "safety_tolerance": "4"
-                        },
-                        with_logs=True,
-                        on_queue_update=self._on_queue_update,
+                    arguments = {
+                        "prompt": background_prompt,
+                        "image_size": image_size,
+                        "num_images": 1,
+                        "enable_safety_checker": True,
+                        "safety_tolerance": "4"
+                    }
+                    result = cassette.call(
+                        "fal.subscribe", {"application": "fal-ai/flux-pro/v1.1", "arguments": arguments},
+                        lambda: self._run("fal-ai/flux-pro/v1.1", arguments)
                     )
 
                     # Add debug logging
@@ -82,6 +103,8 @@ class ImageGenerator:
                     else:
                         print(f"Warning: No valid image generated for prompt: {background_prompt[:100]}...")
 
+                except (DeadlineExceeded, RequestCancelled):
+                    raise
                 except Exception as e:
                     print(f"Error generating image for prompt: {str(e)}")
                     continue
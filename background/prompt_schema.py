@@ -0,0 +1,84 @@
+from services.structured_output import Freeform, ListOf, Nested, Record, Text
+
+
+def _texts(*names):
+    return {name: Text() for name in names}
+
+
+class Composition(Record):
+    FIELDS = _texts("primary_negative_space", "element_placement", "depth_arrangement", "transitions")
+    __slots__ = tuple(FIELDS)
+
+
+class StyleColors(Record):
+    FIELDS = _texts("primary", "secondary", "accent", "background")
+    __slots__ = tuple(FIELDS)
+
+
+class Style(Record):
+    FIELDS = {"colors": Nested(StyleColors), **_texts("texture", "lighting", "mood")}
+    __slots__ = tuple(FIELDS)
+
+
+class Technical(Record):
+    FIELDS = _texts("resolution", "elements", "margins", "grid")
+    __slots__ = tuple(FIELDS)
+
+
+class Background(Record):
+    FIELDS = {
+        "main_premise": Text(),
+        "composition": Nested(Composition),
+        "style": Nested(Style),
+        "technical": Nested(Technical),
+    }
+    __slots__ = tuple(FIELDS)
+
+
+class TextContent(Record):
+    FIELDS = _texts("headline", "subheading", "cta")
+    __slots__ = tuple(FIELDS)
+
+
+class Typography(Record):
+    FIELDS = _texts("primary", "secondary", "cta")
+    __slots__ = tuple(FIELDS)
+
+
+class TextColors(Record):
+    FIELDS = _texts("primary_text", "secondary_text", "cta_text")
+    __slots__ = tuple(FIELDS)
+
+
+class TextLayout(Record):
+    FIELDS = _texts("headline_position", "subheading_position", "cta_position")
+    __slots__ = tuple(FIELDS)
+
+
+class TextSpecifications(Record):
+    FIELDS = {
+        "content": Nested(TextContent),
+        "typography": Nested(Typography),
+        "colors": Nested(TextColors),
+        "layout": Nested(TextLayout),
+    }
+    __slots__ = tuple(FIELDS)
+
+
+class BannerPrompt(Record):
+    FIELDS = {"background": Nested(Background), "text_specifications": Nested(TextSpecifications)}
+    __slots__ = tuple(FIELDS)
+
+
+class PromptSet(Record):
+    """The prompt generator's reply: the structure PROMPT_GENERATOR_INSTRUCTIONS spells out"""
+
+    FIELDS = {"prompts": ListOf(Nested(BannerPrompt))}
+    __slots__ = tuple(FIELDS)
+
+
+class GuidelinesSummary(Record):
+    """The guidelines analysis GUIDELINES_ANALYSIS_REQUEST asks for; each key's content is up to the model"""
+
+    FIELDS = {name: Freeform() for name in ("colors", "typography", "visual_elements", "layout_principles")}
+    __slots__ = tuple(FIELDS)
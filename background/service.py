@@ -2,11 +2,19 @@ from dotenv import load_dotenv
 import os
 import json
 import time
+import hashlib
+from types import SimpleNamespace
 from openai import OpenAI
 from typing_extensions import override
 from openai import AssistantEventHandler
 from .image_generator import ImageGenerator
+from .prompt_schema import GuidelinesSummary, PromptSet
 from typing import List, Dict, Any
+from services.upstream import remaining_budget
+from services.cassette import cassette
+from services.cancellation import check_cancelled
+from services.disk_cache import DiskLRUCache
+from services.structured_output import StructuredOutputError, complete_structured, response_format
 
 # Load environment variables from .env file
 load_dotenv()
@@ -14,11 +22,30 @@ load_dotenv()
 # Initialize the OpenAI client
 client = OpenAI()
 
+# Guidelines analyses keyed by the SHA-256 of the uploaded file
+GUIDELINES_CACHE_DIR = os.getenv("GUIDELINES_CACHE_DIR", "guidelines_cache")
+GUIDELINES_CACHE_MAX_BYTES = int(os.getenv("GUIDELINES_CACHE_MAX_BYTES", str(50 * 1024 * 1024)))
+guidelines_cache = DiskLRUCache(GUIDELINES_CACHE_DIR, GUIDELINES_CACHE_MAX_BYTES, ".json")
+
+# Model for the guidelines assistant and prompt generation; it must support json_schema response_format
+PROMPT_GENERATOR_MODEL = os.getenv("PROMPT_GENERATOR_MODEL", "gpt-4o")
+PROMPT_SET_RESPONSE_FORMAT = response_format(PromptSet)
+
+def _api():
+    """The shared client, with its timeout capped by the request deadline if one is set"""
+    remaining = remaining_budget()
+    return client if remaining is None else client.with_options(timeout=remaining)
+
 class FileReaderEventHandler(AssistantEventHandler):
     def __init__(self):
         super().__init__()
         self.client = OpenAI()
 
+    @override
+    def on_event(self, event) -> None:
+        # Raising here ends the stream, so an abandoned request stops consuming the run
+        check_cancelled()
+
     @override
     def on_text_created(self, text) -> None:
         print(f"\nassistant > ", end="", flush=True)
@@ -32,100 +59,127 @@ class FileReaderEventHandler(AssistantEventHandler):
         print(f"\nassistant > {tool_call.type}\n", flush=True)
 
 class PromptCollectorEventHandler(FileReaderEventHandler):
+    """Prints the prompt generation run and keeps its reply for validation"""
+
     def __init__(self):
         super().__init__()
-        self.current_response = ""
-        self.json_started = False
-        self.background_json = {"prompts": []}
-        self.text_specs_json = {"prompts": []}
-        self.image_prompts = []
-        self.text_specs = []
-        self.client = OpenAI()
+        self.text = ""
 
     @override
     def on_text_delta(self, delta, snapshot) -> None:
-        # Only start collecting when we see the opening brace
-        if "{" in delta.value and not self.json_started:
-            self.json_started = True
-            self.current_response = "{"
-        elif self.json_started:
-            self.current_response += delta.value
+        # The run is constrained to PromptSet's schema, so the whole reply is the JSON
+        self.text += delta.value
         print(delta.value, end="", flush=True)
 
-    @override
-    def on_message_done(self, message) -> None:
-        if self.current_response:
-            try:
-                # Clean up the JSON string
-                json_str = self.current_response.strip()
-
-                # Find the last closing brace
-                last_brace_index = json_str.rindex('}')
-                json_str = json_str[:last_brace_index + 1]
-
-                print(f"\nAttempting to parse JSON...")
-
-                # Parse the response as JSON
-                response_data = json.loads(json_str)
-
-                # Split the JSON into background and text specifications
-                self.split_json_response(response_data)
+class GuidelinesSummaryEventHandler(FileReaderEventHandler):
+    """Prints the guidelines analysis like FileReaderEventHandler and keeps the text"""
 
-            except json.JSONDecodeError as e:
-                print(f"Error parsing JSON response: {e}")
-                print(f"Problematic JSON string: {self.current_response[:200]}...")
-            except Exception as e:
-                print(f"Unexpected error: {str(e)}")
+    def __init__(self):
+        super().__init__()
+        self.text = ""
 
-            self.current_response = ""
-            self.json_started = False
+    @override
+    def on_text_delta(self, delta, snapshot) -> None:
+        self.text += delta.value
+        print(delta.value, end="", flush=True)
 
-    def split_json_response(self, data):
-        """Split the JSON response into background and text specifications"""
+    def summary(self):
+        """The analysis as a dict, or None if it isn't valid JSON even after one repair"""
         try:
-            # Clear existing data
-            self.background_json["prompts"] = []
-            self.text_specs_json["prompts"] = []
-            self.image_prompts = []
-            self.text_specs = []
-
-            for prompt in data.get("prompts", []):
-                if "background" in prompt:
-                    # Store the complete background object as is
-                    self.background_json["prompts"].append(prompt["background"])
-                    # Add to image_prompts without formatting
-                    self.image_prompts.append(prompt["background"])
-
-                if "text_specifications" in prompt:
-                    self.text_specs_json["prompts"].append(prompt["text_specifications"])
-                    self.text_specs = self.text_specs_json["prompts"]
-
-            print(f"\nSplit JSON into {len(self.background_json['prompts'])} backgrounds "
-                  f"and {len(self.text_specs_json['prompts'])} text specifications")
-
-            # Save to files for debugging
-            with open('backgrounds.json', 'w') as f:
-                json.dump(self.background_json, f, indent=2)
-
-            with open('text_specs.json', 'w') as f:
-                json.dump(self.text_specs_json, f, indent=2)
-
-            # Debug output
-            if self.background_json["prompts"]:
-                print("\nBackground JSON sample:")
-                print(json.dumps(self.background_json["prompts"][0], indent=2)[:200])
-
-            if self.text_specs_json["prompts"]:
-                print("\nText Specs JSON sample:")
-                print(json.dumps(self.text_specs_json["prompts"][0], indent=2)[:200])
-
-        except Exception as e:
-            print(f"Error splitting JSON: {str(e)}")
-            raise
-
-    def _format_background_prompt(self, background: Dict[str, Any]) -> Dict[str, Any]:
-        """Return the background object as is"""
-        return background
+            return complete_structured(
+                GuidelinesSummary, [{"role": "system", "content": GUIDELINES_SUMMARY_REPAIR}], _chat_json,
+                content=self.text
+            ).to_dict()
+        except StructuredOutputError:
+            return None
+
+def _split_prompt_response(data):
+    """Split a prompt generation response into background and text specification JSON"""
+    background_json = {"prompts": []}
+    text_specs_json = {"prompts": []}
+
+    for prompt in data.get("prompts", []):
+        if "background" in prompt:
+            # Store the complete background object as is
+            background_json["prompts"].append(prompt["background"])
+
+        if "text_specifications" in prompt:
+            text_specs_json["prompts"].append(prompt["text_specifications"])
+
+    print(f"\nSplit JSON into {len(background_json['prompts'])} backgrounds "
+          f"and {len(text_specs_json['prompts'])} text specifications")
+
+    # Save to files for debugging
+    with open('backgrounds.json', 'w') as f:
+        json.dump(background_json, f, indent=2)
+
+    with open('text_specs.json', 'w') as f:
+        json.dump(text_specs_json, f, indent=2)
+
+    # Debug output
+    if background_json["prompts"]:
+        print("\nBackground JSON sample:")
+        print(json.dumps(background_json["prompts"][0], indent=2)[:200])
+
+    if text_specs_json["prompts"]:
+        print("\nText Specs JSON sample:")
+        print(json.dumps(text_specs_json["prompts"][0], indent=2)[:200])
+
+    return background_json, text_specs_json
+
+def guidelines_sha256(guidelines_file) -> str:
+    """Hash a guidelines path or binary file object, leaving file objects rewound"""
+    hasher = hashlib.sha256()
+    if isinstance(guidelines_file, (str, os.PathLike)):
+        with open(guidelines_file, "rb") as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b""):
+                hasher.update(chunk)
+    else:
+        for chunk in iter(lambda: guidelines_file.read(1024 * 1024), b""):
+            hasher.update(chunk)
+        guidelines_file.seek(0)
+    return hasher.hexdigest()
+
+def _cached_summary(guidelines_hash):
+    data = guidelines_cache.get(guidelines_hash)
+    return json.loads(data) if data is not None else None
+
+def _chat_prompt_set(messages):
+    """One schema-constrained chat completion for the prompt generator"""
+    request = dict(model=PROMPT_GENERATOR_MODEL, response_format=PROMPT_SET_RESPONSE_FORMAT, messages=messages)
+    return cassette.call(
+        "openai.chat", request,
+        lambda: _api().chat.completions.create(**request).choices[0].message.content
+    )
+
+def _chat_json(messages):
+    """One JSON-mode chat completion, for replies whose record can't be a strict schema"""
+    request = dict(model=PROMPT_GENERATOR_MODEL, response_format={"type": "json_object"}, messages=messages)
+    return cassette.call(
+        "openai.chat", request,
+        lambda: _api().chat.completions.create(**request).choices[0].message.content
+    )
+
+def _prompts_from_summary(summary, company_context, event_context):
+    """Generate prompts from a cached guidelines summary with one chat completion, no assistant run"""
+    prompt_set = complete_structured(
+        PromptSet,
+        [
+            {"role": "system", "content": PROMPT_GENERATOR_INSTRUCTIONS},
+            {"role": "user", "content": f"""Brand guidelines analysis:
+            {json.dumps(summary, indent=2)}
+
+            Using the brand guidelines analysis above, generate four unique banner background prompts for:
+            Event Context: {event_context}
+            Company Context: {company_context}
+
+            Follow the brand guidelines strictly.
+            Output must be in the specified JSON format with both background and text specifications for each prompt.
+            Each prompt must include all required fields as specified in the JSON structure."""},
+        ],
+        _chat_prompt_set
+    )
+    return _split_prompt_response(prompt_set.to_dict())
 
 def _extract_text_specs(text_specs_json):
     """Extract text specifications from JSON format"""
@@ -170,13 +224,19 @@ def _format_prompt_to_paragraph(prompt: Dict[str, Any]) -> str:
         print(f"Error formatting prompt: Missing key {e}")
         return str(prompt)
 
-def generate_background(guidelines_file_path, company_context, event_context):
-    """Generate banner images based on guidelines and context"""
-    try:
-        # Create assistant with modified instructions to enforce JSON structure
-        assistant = client.beta.assistants.create(
-            name="Image Prompt Generator",
-            instructions="""You are a brand-focused image prompt generator. Your output must be ONLY valid JSON with no additional text, following this exact structure:
+GUIDELINES_ANALYSIS_REQUEST = """Analyze the brand guidelines document and provide a structured summary.
+Reply with ONLY a JSON object with these keys:
+1. "colors": hex codes and usage rules
+2. "typography": fonts, weights, sizes
+3. "visual_elements": patterns, textures, icons
+4. "layout_principles": spacing, alignment, composition"""
+
+# The repair turn only sees the analysis text, not the document, so it must not invent one
+GUIDELINES_SUMMARY_REPAIR = """You reformat a brand guidelines analysis as a JSON object with the keys
+"colors", "typography", "visual_elements" and "layout_principles". Use only what the analysis says.
+If it contains no analysis of brand guidelines, reply with {}."""
+
+PROMPT_GENERATOR_INSTRUCTIONS = """You are a brand-focused image prompt generator. Your output must be ONLY valid JSON with no additional text, following this exact structure:
 
 {
     "prompts": [
@@ -294,92 +354,180 @@ Important: Output ONLY the JSON structure above with no additional text or expla
    - Define texture and pattern density
    - Include quality parameters for resolution and detail
 
-""",  # Add your full instructions here
-            model="gpt-4o",
+"""
+
+def _ids_only(obj):
+    """What the cassette keeps of a created assistant/file/thread: just its id"""
+    return {"id": obj.id}
+
+def _stream_run(thread_id, assistant_id, handler, **run_options):
+    with _api().beta.threads.runs.stream(
+        thread_id=thread_id,
+        assistant_id=assistant_id,
+        event_handler=handler,
+        **run_options
+    ) as stream:
+        stream.until_done()
+
+def _upload_guidelines(guidelines_file, guidelines_filename):
+    if isinstance(guidelines_file, (str, os.PathLike)):
+        with open(guidelines_file, "rb") as file:
+            return _api().files.create(file=file, purpose="assistants")
+    return _api().files.create(
+        file=(guidelines_filename or "guidelines.pdf", guidelines_file),
+        purpose="assistants"
+    )
+
+def _prompts_from_assistant(guidelines_file, guidelines_filename, guidelines_hash, company_context, event_context):
+    """Upload the guidelines, analyze them with the assistant and generate prompts on the same thread"""
+    # Create assistant with modified instructions to enforce JSON structure
+    assistant = cassette.call(
+        "openai.assistant", {"instructions": PROMPT_GENERATOR_INSTRUCTIONS, "model": PROMPT_GENERATOR_MODEL},
+        lambda: _api().beta.assistants.create(
+            name="Image Prompt Generator",
+            instructions=PROMPT_GENERATOR_INSTRUCTIONS,
+            model=PROMPT_GENERATOR_MODEL,
             tools=[{"type": "file_search"}]
-        )
-
-        # Upload guidelines file
-        with open(guidelines_file_path, "rb") as file:
-            uploaded_file = client.files.create(file=file, purpose="assistants")
-
-        # Create thread for the entire conversation
-        thread = client.beta.threads.create(
+        ),
+        encode=_ids_only, decode=lambda data: SimpleNamespace(**data)
+    )
+
+    # Upload guidelines file
+    uploaded_file = cassette.call(
+        "openai.file", {"guidelines": guidelines_hash},
+        lambda: _upload_guidelines(guidelines_file, guidelines_filename),
+        encode=_ids_only, decode=lambda data: SimpleNamespace(**data)
+    )
+
+    # Create thread for the entire conversation
+    thread = cassette.call(
+        "openai.thread", {"guidelines": guidelines_hash, "request": GUIDELINES_ANALYSIS_REQUEST},
+        lambda: _api().beta.threads.create(
             messages=[{
                 "role": "user",
-                "content": """Analyze the brand guidelines document and provide a structured summary with:
-                1. COLORS (hex codes, usage rules)
-                2. TYPOGRAPHY (fonts, weights, sizes)
-                3. VISUAL ELEMENTS (patterns, textures, icons)
-                4. LAYOUT PRINCIPLES (spacing, alignment, composition)""",
+                "content": GUIDELINES_ANALYSIS_REQUEST,
                 "attachments": [{"file_id": uploaded_file.id, "tools": [{"type": "file_search"}]}]
             }]
-        )
-
-        # Run guidelines analysis
-        print("\n=== Analyzing Brand Guidelines ===\n")
-        with client.beta.threads.runs.stream(
-            thread_id=thread.id,
-            assistant_id=assistant.id,
-            event_handler=FileReaderEventHandler()
-        ) as stream:
-            stream.until_done()
-
-        # Generate prompts using the same thread
-        client.beta.threads.messages.create(
-            thread_id=thread.id,
-            role="user",
-            content=f"""Using the brand guidelines analysis above, generate four unique banner background prompts for:
-            Event Context: {event_context}
-            Company Context: {company_context}
+        ),
+        encode=_ids_only, decode=lambda data: SimpleNamespace(**data)
+    )
+
+    # Run guidelines analysis
+    print("\n=== Analyzing Brand Guidelines ===\n")
+    analysis_handler = GuidelinesSummaryEventHandler()
+    cassette.stream(
+        "openai.run", {"stage": "analysis", "guidelines": guidelines_hash}, analysis_handler,
+        lambda: _stream_run(thread.id, assistant.id, analysis_handler)
+    )
+
+    summary = analysis_handler.summary()
+    if summary is not None:
+        guidelines_cache.put(guidelines_hash, json.dumps(summary).encode())
+    else:
+        print("\nGuidelines analysis was not valid JSON; not caching it")
+
+    # Generate prompts using the same thread
+    content = f"""Using the brand guidelines analysis above, generate four unique banner background prompts for:
+        Event Context: {event_context}
+        Company Context: {company_context}
+
+        Follow the brand guidelines strictly.
+        Output must be in the specified JSON format with both background and text specifications for each prompt.
+        Each prompt must include all required fields as specified in the JSON structure."""
+    cassette.call(
+        "openai.message", {"guidelines": guidelines_hash, "content": content},
+        lambda: _api().beta.threads.messages.create(thread_id=thread.id, role="user", content=content),
+        encode=_ids_only
+    )
+
+    # Stream prompt generation. json_schema output only works without file_search, and the
+    # analysis is already on the thread, so this run drops the assistant's tools
+    prompt_handler = PromptCollectorEventHandler()
+    cassette.stream(
+        "openai.run",
+        {"stage": "prompts", "guidelines": guidelines_hash, "content": content, "response_format": "PromptSet"},
+        prompt_handler,
+        lambda: _stream_run(thread.id, assistant.id, prompt_handler,
+                            response_format=PROMPT_SET_RESPONSE_FORMAT, tools=[])
+    )
+
+    # A reply that fails validation gets one repair through chat completions
+    prompt_set = complete_structured(
+        PromptSet, [{"role": "system", "content": PROMPT_GENERATOR_INSTRUCTIONS}], _chat_prompt_set,
+        content=prompt_handler.text
+    )
+    background_json, text_specs_json = _split_prompt_response(prompt_set.to_dict())
+    return background_json["prompts"], text_specs_json["prompts"]
+
+def generate_background_prompts(guidelines_file, company_context, event_context, guidelines_filename=None,
+                                guidelines_hash=None):
+    """
+    (image prompts, text specs) for the guidelines and context; the OpenAI half of generate_background
+
+    The guidelines analysis is cached by the file's SHA-256 (guidelines_hash,
+    computed here when not given), so a repeated file skips the assistant
+    run and the upload entirely.
+    """
+    guidelines_hash = guidelines_hash or guidelines_sha256(guidelines_file)
+    summary = _cached_summary(guidelines_hash)
+    if summary is not None:
+        print(f"\n=== Using cached brand guidelines analysis ({guidelines_hash[:12]}) ===\n")
+        background_json, text_specs_json = _prompts_from_summary(summary, company_context, event_context)
+        return background_json["prompts"], text_specs_json["prompts"]
+    return _prompts_from_assistant(
+        guidelines_file, guidelines_filename, guidelines_hash, company_context, event_context
+    )
+
+def generate_background_images(image_prompts, text_specs):
+    """One banner per image prompt, rendered with FAL; the FAL half of generate_background"""
+    # After collecting prompts, convert them to paragraphs
+    image_prompts_paragraphs = []
+    for prompt in image_prompts:
+        paragraph = _format_prompt_to_paragraph(prompt)
+        image_prompts_paragraphs.append(paragraph)
+
+    # Generate images using paragraphs
+    image_generator = ImageGenerator()
+    generated_images = []
+
+    for paragraph in image_prompts_paragraphs:
+        check_cancelled()
+        prompt_data = {
+            "prompts": [{"background": paragraph}]
+        }
+        result = image_generator.generate_images_from_prompts(prompt_data)
+        if result:
+            generated_images.extend(result)
+
+    # Combine results as before
+    complete_banners = []
+    for i, image_data in enumerate(generated_images):
+        if i < len(image_prompts):
+            banner_data = {
+                "image": {
+                    "images": image_data["images"],
+                    "seed": image_data.get("seed")
+                },
+                "background_prompt": image_prompts[i],
+                "text_specifications": _extract_text_specs(text_specs[i])
+            }
+            complete_banners.append(banner_data)
 
-            Follow the brand guidelines strictly.
-            Output must be in the specified JSON format with both background and text specifications for each prompt.
-            Each prompt must include all required fields as specified in the JSON structure."""
-        )
+    return complete_banners
 
-        # Stream prompt generation
-        prompt_handler = PromptCollectorEventHandler()
-        with client.beta.threads.runs.stream(
-            thread_id=thread.id,
-            assistant_id=assistant.id,
-            event_handler=prompt_handler
-        ) as stream:
-            stream.until_done()
-
-        # After collecting prompts, convert them to paragraphs
-        image_prompts_paragraphs = []
-        for prompt in prompt_handler.image_prompts:
-            paragraph = _format_prompt_to_paragraph(prompt)
-            image_prompts_paragraphs.append(paragraph)
-
-        # Generate images using paragraphs
-        image_generator = ImageGenerator()
-        generated_images = []
-
-        for paragraph in image_prompts_paragraphs:
-            prompt_data = {
-                "prompts": [{"background": paragraph}]
-            }
-            result = image_generator.generate_images_from_prompts(prompt_data)
-            if result:
-                generated_images.extend(result)
-
-        # Combine results as before
-        complete_banners = []
-        for i, image_data in enumerate(generated_images):
-            if i < len(prompt_handler.image_prompts):
-                banner_data = {
-                    "image": {
-                        "images": image_data["images"],
-                        "seed": image_data.get("seed")
-                    },
-                    "background_prompt": prompt_handler.image_prompts[i],
-                    "text_specifications": _extract_text_specs(prompt_handler.text_specs[i])
-                }
-                complete_banners.append(banner_data)
+def generate_background(guidelines_file, company_context, event_context, guidelines_filename=None,
+                        guidelines_hash=None):
+    """
+    Generate banner images based on guidelines and context
 
-        return complete_banners
+    guidelines_file is either a path or an open binary file object; for file
+    objects pass guidelines_filename so OpenAI can detect the file type.
+    """
+    try:
+        image_prompts, text_specs = generate_background_prompts(
+            guidelines_file, company_context, event_context, guidelines_filename, guidelines_hash
+        )
+        return generate_background_images(image_prompts, text_specs)
 
     except Exception as e:
         print(f"Error in generate_banner: {str(e)}")
@@ -390,7 +538,7 @@ if __name__ == "__main__":
     company_context = "a free tool that shows how frequently a search term is entered into Google's search engine"
     event_context = "AI agent competition"
 
-    generated_banners = generate_banner(guidelines_file, company_context, event_context)
+    generated_banners = generate_background(guidelines_file, company_context, event_context)
 
     for banner in generated_banners:
         print(f"\nPrompt: {banner['background_prompt']}")
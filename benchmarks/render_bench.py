@@ -0,0 +1,320 @@
+"""
+Offline rendering micro-benchmarks: no network, no API keys.
+
+Times the text layer rendering (create_text_image and its effects,
+calculate_position) and the compositing/PNG encoding generate_banner does,
+over a matrix of canvas sizes, font sizes, effects and text lengths. The
+soft_shadow_bbox / soft_shadow_full_canvas pairs compare the bbox-bounded
+blur against blurring the whole canvas.
+
+    python -m benchmarks.render_bench                  # compare against the baseline
+    python -m benchmarks.render_bench --save-baseline  # record a new baseline
+    python -m benchmarks.render_bench --filter 2048x2048
+
+Exits with status 1 when a case is slower (or allocates more) than the
+baseline by more than the regression threshold. Baselines are machine
+specific; record them on the machine that runs the comparison.
+"""
+import argparse
+import ctypes
+import ctypes.util
+import gc
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+import logging
+from typing import Callable, Dict, List, Optional
+
+import PIL
+from PIL import Image, ImageDraw, ImageFilter
+from services.text_generation_service import create_text_image, text_layer
+from services.text_layer_cache import text_layer_cache
+from services.fonts import load_font
+from services.text_layout import EDGE_MARGIN, PLACEMENTS, calculate_position, fit_text
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+DEFAULT_THRESHOLD = float(os.getenv("BENCH_REGRESSION_THRESHOLD", "0.25"))
+# Differences below these are noise, whatever the ratio
+MIN_SECONDS_DELTA = 0.0005
+MIN_BYTES_DELTA = 64 * 1024
+MIN_RSS_DELTA = 1024 * 1024
+
+CANVASES = [(800, 600), (1024, 768), (2100, 600), (2048, 2048)]
+FONT_SIZES = [24, 72, 160]
+TEXTS = {
+    "short": "SALE",
+    "medium": "summer sale bonanza 50% off",
+    "long": "End of season clearance: every jacket, boot and backpack in the store is "
+            "now up to 70% off, this weekend only, while stocks last",
+}
+EFFECTS = {
+    "plain": None,
+    "outline": {"outline": {"color": "#000000", "width": 2}},
+    "shadow": {"shadow": {"color": "#00000080", "offset": [4, 4]}},
+    "gradient": {"gradient": {"colors": ["#FF0000", "#FFFF00"], "direction": "vertical"}},
+    "outline+shadow": {
+        "outline": {"color": "#000000", "width": 2},
+        "shadow": {"color": "#00000080", "offset": [4, 4]},
+    },
+    "soft_shadow": {"shadow": {"color": "#00000080", "offset": [4, 4], "blur": 8}},
+    "glow": {"glow": {"color": "#FFD70099", "radius": 12, "spread": 2}},
+}
+# Blur radii for the bbox-bounded vs. full-canvas blur comparison
+BLUR_RADII = [4, 16, 48]
+
+
+def _properties(font_size: int, effects: Optional[dict]) -> dict:
+    properties = {"placement": "center", "size": font_size, "color": "#FFFFFF", "font": "impact"}
+    if effects:
+        properties["effects"] = effects
+    return properties
+
+
+def _background(size) -> Image.Image:
+    """A deterministic photographic-ish canvas, so PNG encoding does real work"""
+    gradient = Image.linear_gradient("L").resize(size)
+    noise = Image.effect_noise(size, 48)
+    return Image.merge("RGB", (gradient, noise, gradient.transpose(Image.FLIP_LEFT_RIGHT)))
+
+
+def _naive_soft_shadow(text, font_size, radius, size):
+    """The straightforward soft shadow: draw on a full-canvas mask and blur all of it"""
+    properties = _properties(font_size, None)
+    font_size, lines = fit_text(text, "impact", size[0] - 2 * EDGE_MARGIN, size[1] - 2 * EDGE_MARGIN, font_size)
+    text = "\n".join(lines)
+    font = load_font("impact", font_size)
+    layer = Image.new("RGBA", size, (255, 255, 255, 0))
+    draw = ImageDraw.Draw(layer)
+    bbox = draw.textbbox((0, 0), text, font=font)
+    position = calculate_position("center", size, bbox[2] - bbox[0], bbox[3] - bbox[1])
+    mask = Image.new("L", size, 0)
+    ImageDraw.Draw(mask).text((position[0] + 4, position[1] + 4), text, font=font, fill=128)
+    mask = mask.filter(ImageFilter.GaussianBlur(radius))
+    shadow = Image.new("RGBA", size, (0, 0, 0, 255))
+    shadow.putalpha(mask)
+    layer.alpha_composite(shadow)
+    draw.text(position, text, font=font, fill=properties["color"])
+    return layer
+
+
+def _uncached_text_image(text, properties, size):
+    """create_text_image as a cache miss, so the rasterization is what gets timed"""
+    text_layer_cache.clear()
+    return create_text_image(text, properties, size)
+
+
+def build_cases() -> Dict[str, Callable[[], object]]:
+    cases = {}
+    for width, height in CANVASES:
+        canvas = f"{width}x{height}"
+        for font_size in FONT_SIZES:
+            for effect_name, effects in EFFECTS.items():
+                for text_name, text in TEXTS.items():
+                    properties = _properties(font_size, effects)
+                    cases[f"text_image/{canvas}/{font_size}px/{effect_name}/{text_name}"] = (
+                        lambda text=text, properties=properties, size=(width, height):
+                        _uncached_text_image(text, properties, size)
+                    )
+
+        background = _background((width, height))
+        layer = text_layer(TEXTS["medium"], _properties(72, EFFECTS["outline"]), (width, height))
+
+        def composite(background=background, layer=layer):
+            canvas_copy = background.copy()
+            layer.paste_onto(canvas_copy)
+            return canvas_copy
+
+        def encode(background=background):
+            buffered = io.BytesIO()
+            background.save(buffered, format="PNG")
+            return buffered.getvalue()
+
+        for radius in BLUR_RADII:
+            shadow_properties = _properties(72, {"shadow": {"color": "#00000080", "offset": [4, 4], "blur": radius}})
+            cases[f"soft_shadow_bbox/{canvas}/r{radius}"] = (
+                lambda properties=shadow_properties, size=(width, height):
+                (text_layer_cache.clear(), text_layer(TEXTS["medium"], properties, size))
+            )
+            cases[f"soft_shadow_full_canvas/{canvas}/r{radius}"] = (
+                lambda radius=radius, size=(width, height):
+                _naive_soft_shadow(TEXTS["medium"], 72, radius, size)
+            )
+
+        cached_properties = _properties(72, EFFECTS["outline+shadow"])
+        cases[f"text_layer_cached/{canvas}"] = (
+            lambda properties=cached_properties, size=(width, height):
+            text_layer(TEXTS["medium"], properties, size)
+        )
+        cases[f"composite/{canvas}"] = composite
+        cases[f"encode_png/{canvas}"] = encode
+
+    def positions():
+        for placement in PLACEMENTS:
+            for _ in range(200):
+                calculate_position(placement, (2100, 600), 640, 120)
+
+    cases["calculate_position/x1800"] = positions
+    return cases
+
+
+def _read_rss_kb(field: str) -> Optional[int]:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+def _release_free_memory():
+    """Hand freed heap pages back to the OS (glibc), so a case's allocations show up as new RSS"""
+    try:
+        ctypes.CDLL(ctypes.util.find_library("c")).malloc_trim(0)
+    except (OSError, AttributeError, TypeError):
+        pass
+
+
+def _reset_rss_peak() -> bool:
+    """Reset the kernel's RSS high-water mark (Linux only) so VmHWM covers one case"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def measure(func: Callable[[], object], repeat: int) -> dict:
+    func()  # Warm font and glyph caches
+    timings = []
+    gc.collect()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - started)
+    finally:
+        gc.enable()
+
+    # Memory on a separate run, since tracing slows the code down.
+    # tracemalloc sees Python buffers (PNG bytes, base64); Pillow's pixel
+    # buffers only show up in the RSS high-water mark.
+    gc.collect()
+    _release_free_memory()
+    rss_tracked = _reset_rss_peak()
+    rss_before = _read_rss_kb("VmRSS:")
+    tracemalloc.start()
+    func()
+    _, py_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    result = {
+        "seconds": statistics.median(timings),
+        "min_seconds": min(timings),
+        "py_peak_bytes": py_peak,
+    }
+    if rss_tracked and rss_before is not None:
+        result["rss_peak_bytes"] = max(0, (_read_rss_kb("VmHWM:") - rss_before) * 1024)
+    return result
+
+
+def environment() -> dict:
+    return {
+        "python": platform.python_version(),
+        "pillow": PIL.__version__,
+        "machine": platform.machine(),
+        "platform": platform.platform(),
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> List[str]:
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get("cases", {}).get(name)
+        if previous is None:
+            continue
+        for metric, min_delta in (("seconds", MIN_SECONDS_DELTA), ("py_peak_bytes", MIN_BYTES_DELTA),
+                                  ("rss_peak_bytes", MIN_RSS_DELTA)):
+            before, after = previous.get(metric), current.get(metric)
+            if before is None or after is None:
+                continue
+            if after > before * (1 + threshold) and after - before > min_delta:
+                regressions.append(f"{name}: {metric} {before:.6g} -> {after:.6g} "
+                                   f"(+{(after / before - 1) * 100 if before else float('inf'):.0f}%)")
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline JSON file")
+    parser.add_argument("--save-baseline", action="store_true", help="Write the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Allowed slowdown/growth as a fraction (default %(default)s)")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per case; the median is kept")
+    parser.add_argument("--filter", action="append", default=[],
+                        help="Only run cases whose name contains this (repeatable)")
+    parser.add_argument("--output", help="Also write this run's results to a JSON file")
+    args = parser.parse_args(argv)
+
+    # The services configure DEBUG logging on import; keep the report readable
+    logging.getLogger().setLevel(logging.WARNING)
+
+    cases = build_cases()
+    if args.filter:
+        cases = {name: func for name, func in cases.items() if any(part in name for part in args.filter)}
+    if not cases:
+        print("No benchmark cases match the filter")
+        return 2
+
+    results = {}
+    for name, func in cases.items():
+        results[name] = measure(func, args.repeat)
+        result = results[name]
+        rss = f"{result['rss_peak_bytes'] / 1e6:8.1f}MB" if "rss_peak_bytes" in result else "       n/a"
+        print(f"{name:<55} {result['seconds'] * 1000:9.2f}ms  py {result['py_peak_bytes'] / 1e6:7.2f}MB  rss {rss}")
+
+    run = {"environment": environment(), "cases": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(run, f, indent=2, sort_keys=True)
+
+    if args.save_baseline:
+        baseline = {"environment": environment(), "cases": {}}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+            baseline["environment"] = environment()
+        # Merge, so a filtered run only refreshes the cases it ran
+        baseline.setdefault("cases", {}).update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"\nSaved {len(results)} cases to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"\nNo baseline at {args.baseline}; run with --save-baseline first")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get("environment") != environment():
+        print(f"\nWarning: baseline was recorded on {baseline.get('environment')}, this is {environment()}")
+
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) over {args.threshold:.0%}:")
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+    print(f"\nNo regressions over {args.threshold:.0%} against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
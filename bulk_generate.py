@@ -0,0 +1,319 @@
+"""
+Offline bulk banner generation with resumable checkpoints.
+
+    python bulk_generate.py products.csv --output-dir bulk_runs/refresh
+    python bulk_generate.py items.jsonl --concurrency 16 --defaults '{"theme": "Diwali sale"}'
+
+Each input row (a CSV row or a JSONL object) is a /generate-ad payload, or a
+/generate-background job when it has guidelines_file (a path),
+company_context and event_context. Rows are identified by their "id" field,
+or else their row number.
+
+Every finished item is appended to manifest.jsonl in the output directory,
+with the saved banner paths, catalog ids and any errors, and renditions are
+written next to it. Rerunning with the same output directory skips items
+already recorded as ok and retries the rest, so an interrupted run picks up
+where it stopped; a partial item only regenerates the banner types that
+failed and keeps the ones it already has. Upstream calls of both kinds of
+item go through the same per-upstream limits as /generate-campaign
+(BATCH_OPENAI_CONCURRENCY, BATCH_FAL_CONCURRENCY).
+"""
+import argparse
+import asyncio
+import csv
+import dataclasses
+import json
+import os
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+import aiohttp
+from services.banner_pipeline import AdRequest, generate_campaign_item
+from background.service import generate_background_images, generate_background_prompts
+from services.batch_scheduler import BATCH_UPSTREAM_CONCURRENCY, BatchPlan
+from services.upstream import DeadlineExceeded, deadline_scope, remaining_budget
+
+MANIFEST_NAME = "manifest.jsonl"
+# Items that don't need to run again on resume; a partial item reruns to fill in its failed banners
+DONE_STATUSES = ("ok",)
+PROGRESS_INTERVAL_SECONDS = 10
+# AdRequest fields read from CSV as-is; everything else is parsed as JSON when it can be
+STRING_FIELDS = {field.name for field in dataclasses.fields(AdRequest) if field.type is str}
+STRING_FIELDS |= {"id", "guidelines_file", "company_context", "event_context"}
+
+
+def _coerce_csv_row(row: Dict[str, str]) -> dict:
+    """CSV cells are all strings; turn numbers, booleans and lists into what AdRequest expects"""
+    item = {}
+    for name, value in row.items():
+        if name is None or value is None:
+            continue
+        if name in STRING_FIELDS:
+            item[name] = value
+            continue
+        if value.strip() == "":
+            # Leave it to the field's default
+            continue
+        try:
+            item[name] = json.loads(value)
+        except ValueError:
+            item[name] = value
+    return item
+
+
+def read_items(path: str) -> List[Tuple[str, dict]]:
+    """(item id, payload) for every row of a .csv or .jsonl file"""
+    items = []
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.lower().endswith(".csv"):
+            rows = (_coerce_csv_row(row) for row in csv.DictReader(f))
+        else:
+            rows = (json.loads(line) for line in f if line.strip())
+        for number, row in enumerate(rows, start=1):
+            if not isinstance(row, dict):
+                raise ValueError(f"Row {number} of {path} is not an object")
+            items.append((str(row.pop("id", f"row-{number}")), row))
+    ids = [item_id for item_id, _ in items]
+    if len(set(ids)) != len(ids):
+        raise ValueError(f"Item ids in {path} must be unique")
+    return items
+
+
+def load_manifest(path: str) -> Dict[str, dict]:
+    """The last recorded entry of each item; a line cut off by a crash is ignored"""
+    entries = {}
+    if not os.path.exists(path):
+        return entries
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            entries[entry["id"]] = entry
+    return entries
+
+
+class Manifest:
+    def __init__(self, path: str):
+        self._file = open(path, "a", encoding="utf-8")
+
+    def append(self, entry: dict):
+        self._file.write(json.dumps(entry) + "\n")
+        # The manifest is the checkpoint; make sure a finished item survives a crash
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+class Progress:
+    def __init__(self, total: int, already_done: int):
+        self.total = total
+        self.done = already_done
+        self.counts = {"ok": 0, "partial": 0, "error": 0}
+        self.started = time.monotonic()
+        self.finished_this_run = 0
+        self.last_report = 0.0
+
+    def add(self, status: str):
+        self.done += 1
+        self.finished_this_run += 1
+        self.counts[status] = self.counts.get(status, 0) + 1
+        if time.monotonic() - self.last_report >= PROGRESS_INTERVAL_SECONDS:
+            self.report()
+
+    def report(self):
+        self.last_report = time.monotonic()
+        elapsed = self.last_report - self.started
+        rate = self.finished_this_run / elapsed if elapsed else 0.0
+        remaining = self.total - self.done
+        eta = f"{remaining / rate / 60:.1f} min" if rate else "unknown"
+        print(f"[{self.done}/{self.total}] ok={self.counts['ok']} partial={self.counts['partial']} "
+              f"failed={self.counts['error']} | {rate * 60:.1f} items/min | ETA {eta}", flush=True)
+
+
+def _write_renditions(output_dir: str, item_id: str, banner_type: str, renditions) -> List[dict]:
+    written = []
+    for rendition in renditions or []:
+        if "image" not in rendition:
+            written.append({"size": rendition["size"], "error": rendition.get("error")})
+            continue
+        path = os.path.join(output_dir, f"{item_id}_{banner_type}_{rendition['size']}.png")
+        with open(path, "wb") as f:
+            f.write(rendition["image"].data)
+        written.append({"size": rendition["size"], "path": path})
+    return written
+
+
+def _item_status(banners: List[dict]) -> str:
+    failed = sum(1 for banner in banners if "error" in banner)
+    if not failed:
+        return "ok"
+    return "error" if failed == len(banners) else "partial"
+
+
+async def _run_ad_item(session, plan, index: int, item_id: str, item: dict, defaults: dict, output_dir: str,
+                       previous: Optional[dict] = None) -> dict:
+    banner_types = {**defaults, **item}.get("banner_types", ["default"])
+    # Banners a previous partial run already saved are kept; each one generated again is paid for again
+    kept = {}
+    if previous is not None and previous.get("kind") == "ad":
+        kept = {banner["banner_type"]: banner for banner in previous.get("banners", [])
+                if "error" not in banner and banner.get("banner_type") in banner_types}
+    missing = [banner_type for banner_type in banner_types if banner_type not in kept]
+    if kept:
+        print(f"Item {item_id}: keeping {', '.join(kept)}, retrying {', '.join(missing)}", flush=True)
+
+    result = {"banners": []}
+    if missing:
+        result = await generate_campaign_item(session, plan, index, defaults, {**item, "banner_types": missing})
+    generated = {}
+    for banner_type, banner in zip(missing, result.get("banners", [])):
+        if "error" in banner:
+            generated[banner_type] = {"banner_type": banner_type, "error": banner["error"]}
+            continue
+        generated[banner_type] = {
+            "banner_type": banner_type,
+            "banner_id": banner["banner_id"],
+            "path": banner["saved_image_path"],
+            "quality_tier": banner.get("quality_tier"),
+            "renditions": await asyncio.to_thread(
+                _write_renditions, output_dir, item_id, banner_type, banner.get("renditions")
+            ),
+        }
+
+    entry = {"id": item_id, "kind": "ad"}
+    if "error" in result:
+        # The request itself was rejected, so none of the missing banners exist
+        entry["error"] = result["error"]
+        for banner_type in missing:
+            generated.setdefault(banner_type, {"banner_type": banner_type, "error": result["error"]})
+    entry["banners"] = [kept.get(banner_type) or generated[banner_type] for banner_type in banner_types]
+    entry["status"] = _item_status(entry["banners"])
+    return entry
+
+
+async def _run_background_item(plan, index: int, item_id: str, item: dict) -> dict:
+    # The Assistants and FAL clients block, so keep them off the event loop; each half
+    # holds a slot of its own upstream, like the ad items' calls do
+    image_prompts, text_specs = await plan.run(
+        "guidelines_prompts", item_id, "openai", index,
+        lambda: asyncio.to_thread(
+            generate_background_prompts,
+            guidelines_file=item["guidelines_file"],
+            company_context=item.get("company_context", ""),
+            event_context=item.get("event_context", ""),
+        )
+    )
+    banners = await plan.run(
+        "guidelines_backgrounds", item_id, "fal", index,
+        lambda: asyncio.to_thread(generate_background_images, image_prompts, text_specs)
+    )
+    return {
+        "id": item_id,
+        "kind": "background",
+        "status": "ok" if banners else "error",
+        "banners": [
+            {"prompt": banner["background_prompt"], "urls": [image.get("url") for image in banner["image"]["images"]]}
+            for banner in banners
+        ],
+    }
+
+
+async def run_item(session, plan, index: int, item_id: str, item: dict, defaults: dict, output_dir: str,
+                   item_timeout: Optional[float], previous: Optional[dict] = None) -> dict:
+    started = time.monotonic()
+    try:
+        with deadline_scope(item_timeout * 1000 if item_timeout else None):
+            if "guidelines_file" in item:
+                work = _run_background_item(plan, index, item_id, item)
+            else:
+                work = _run_ad_item(session, plan, index, item_id, item, defaults, output_dir, previous)
+            entry = await asyncio.wait_for(work, timeout=remaining_budget())
+    except (DeadlineExceeded, asyncio.TimeoutError):
+        entry = {"id": item_id, "status": "error", "error": "Item timed out"}
+    except Exception as e:
+        entry = {"id": item_id, "status": "error", "error": str(e)}
+    entry["seconds"] = round(time.monotonic() - started, 2)
+    entry["finished_at"] = time.time()
+    return entry
+
+
+async def run(items: List[Tuple[str, dict]], defaults: dict, output_dir: str, concurrency: int,
+              item_timeout: Optional[float], upstream_concurrency: Dict[str, int]) -> Progress:
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    previous = load_manifest(manifest_path)
+    finished = {item_id for item_id, entry in previous.items() if entry.get("status") in DONE_STATUSES}
+    pending = [(index, item_id, item) for index, (item_id, item) in enumerate(items) if item_id not in finished]
+    progress = Progress(len(items), len(items) - len(pending))
+    if finished:
+        print(f"Resuming: {len(items) - len(pending)} of {len(items)} items already done", flush=True)
+
+    manifest = Manifest(manifest_path)
+    # Shares concurrent duplicate prompts/backgrounds and applies the upstream limits; keeps nothing
+    plan = BatchPlan(upstream_concurrency, retain_results=False)
+    queue: "asyncio.Queue[Tuple[int, str, dict]]" = asyncio.Queue()
+    for work in pending:
+        queue.put_nowait(work)
+
+    async def worker():
+        while True:
+            try:
+                index, item_id, item = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            entry = await run_item(session, plan, index, item_id, item, defaults, output_dir, item_timeout,
+                                   previous=previous.get(item_id))
+            manifest.append(entry)
+            progress.add(entry["status"])
+            if entry["status"] == "error":
+                print(f"Item {item_id} failed: {entry.get('error')}", flush=True)
+
+    try:
+        async with aiohttp.ClientSession() as session:
+            await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    finally:
+        plan.cancel()
+        manifest.close()
+    return progress
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="CSV or JSONL file of items")
+    parser.add_argument("--output-dir", help="where the manifest and renditions go (default: bulk_runs/<input name>)")
+    parser.add_argument("--concurrency", type=int, default=8, help="items in flight at once")
+    parser.add_argument("--defaults", default="{}", help="JSON object merged under every ad item")
+    parser.add_argument("--item-timeout", type=float, default=None, help="seconds before an item is given up")
+    parser.add_argument("--openai-concurrency", type=int, default=BATCH_UPSTREAM_CONCURRENCY["openai"])
+    parser.add_argument("--fal-concurrency", type=int, default=BATCH_UPSTREAM_CONCURRENCY["fal"])
+    args = parser.parse_args(argv)
+
+    try:
+        defaults = json.loads(args.defaults)
+        if not isinstance(defaults, dict):
+            raise ValueError("--defaults must be a JSON object")
+        items = read_items(args.input)
+    except (OSError, ValueError) as e:
+        print(f"Error: {str(e)}", file=sys.stderr)
+        return 2
+
+    output_dir = args.output_dir or os.path.join("bulk_runs", os.path.splitext(os.path.basename(args.input))[0])
+    upstream_concurrency = {"openai": args.openai_concurrency, "fal": args.fal_concurrency}
+    try:
+        progress = asyncio.run(run(items, defaults, output_dir, args.concurrency, args.item_timeout,
+                                   upstream_concurrency))
+    except KeyboardInterrupt:
+        print(f"\nInterrupted; rerun with --output-dir {output_dir} to resume", file=sys.stderr)
+        return 130
+    progress.report()
+    print(f"Manifest: {os.path.join(output_dir, MANIFEST_NAME)}")
+    return 1 if progress.counts["error"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
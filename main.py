@@ -1,55 +1,76 @@
-from flask import Flask, request, jsonify, Request
-from dataclasses import dataclass, field
-from typing import List, Optional, Literal
+from fastapi import FastAPI, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
+from contextlib import asynccontextmanager
+from typing import Optional
 from services.gpt_service import generate_image_prompt
-from services.gpt_background_service import generate_background_prompt
-from services.fal_service import generate_image
-from flask_cors import CORS
+from services.fal_service import generate_image, image_cache
+from services.fal_dispatch import fal_dispatcher
+from services.product_models import product_models
 import os
 from pprint import pprint
 import asyncio
 import aiohttp
-from services.text_generation_service import generate_text_overlay
+from services.text_generation_service import generate_text_overlay, text_properties_cache_stats
+from services.text_layer_cache import text_layer_cache
+from services.theme_index import theme_index
+from services.prewarm import prewarmer
+from services.cancellation import ClientDisconnected, cancellation_stats, until_disconnected
+from services.rendition_service import validate_renditions
+from services.model_router import router_stats
+from services.upload_service import MalformedUpload, UploadTooLarge, read_multipart_upload
+from services.response_service import negotiated_response
+from services.banner_catalog import banner_catalog
+from services.cassette import cassette
+from services.structured_output import structured_output_stats
+from services.variant_service import DEFAULT_QUALITY, get_variant, variant_cache_stats
+from services.idempotency import MAX_KEY_LENGTH, IdempotencyKeyReused, idempotency_store, request_fingerprint
+from services.memory_budget import MemoryBudgetExceeded, memory_stats
+from services.batch_scheduler import BATCH_MAX_ITEMS, BatchPlan, batch_stats
+from services.banner_pipeline import (
+    async_generate_ad,
+    generate_campaign_item,
+    missing_banner_inputs,
+    prewarm_banner_inputs,
+)
+from services.upstream import (
+    DeadlineExceeded,
+    deadline_scope,
+    parse_deadline_header,
+    remaining_budget,
+    upstream_stats,
+)
 import json
-from PIL import Image
-import io
-import base64
-import time
-from werkzeug.utils import secure_filename
-from background.service import generate_background
-
-app = Flask(__name__)
-CORS(app)
-
-# Configure upload folder for temporary file storage
-UPLOAD_FOLDER = 'temp_uploads'
-if not os.path.exists(UPLOAD_FOLDER):
-    os.makedirs(UPLOAD_FOLDER)
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+from datetime import datetime, timezone
+from starlette.concurrency import run_in_threadpool
+from background.service import generate_background, guidelines_cache
+import uvicorn
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One client session for the whole process, shared by every request on the event loop
+    app.state.http_session = aiohttp.ClientSession()
+    prewarm_task = prewarmer.start(app.state.http_session, prewarm_banner_inputs, missing_banner_inputs)
+    try:
+        yield
+    finally:
+        if prewarm_task is not None:
+            prewarm_task.cancel()
+        await app.state.http_session.close()
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
 
 # add hello world route
-@app.route("/")
-def hello_world():
+@app.get("/", response_class=PlainTextResponse)
+async def hello_world():
     return "Hello, World!"
 
-@dataclass
-class AdRequest:
-    product_name: str
-    theme: str
-    extra_input: str
-    promotional_offer: str
-    image_size: str = "landscape_4_3"  # Changed default to an accepted value
-    num_inference_steps: int = 28
-    seed: Optional[int] = None
-    loras: Optional[List[dict]] = None
-    guidance_scale: float = 3.5
-    enable_safety_checker: bool = True
-    output_format: str = "jpeg"
-    num_images: int = field(default=1)
-    flow_type: Literal["product_marketing", "banner_creation"] = "product_marketing"
-    banner_types: List[str] = field(default_factory=lambda: ['default'])
-    text_overlay: str = "summer sale bonanza 50% off"  # Default text for testing
-
 async def generate_product_marketing(ad_request, layout_type, session):
     prompt = await generate_image_prompt(
         ad_request.product_name,
@@ -80,119 +101,237 @@ async def generate_product_marketing(ad_request, layout_type, session):
         "content_type": result['images'][0]['content_type'],
     }
 
-async def generate_banner(session, ad_request, product_name, banner_type):
+async def run_generate_ad(session, data, deadline_ms):
+    """(content, status_code) for a generate-ad payload"""
     try:
-        # Generate background prompt
-        background_prompt = await generate_background_prompt(session, ad_request.theme)
-        print(f"Generated background prompt: {background_prompt}")
-
-        # Generate background image
-        background_result = await generate_image(
-            session,
-            product_name=ad_request.product_name,
-            prompt=background_prompt,
-            image_size=ad_request.image_size,
-            num_inference_steps=ad_request.num_inference_steps,
-            seed=ad_request.seed,
-            guidance_scale=ad_request.guidance_scale,
-            num_images=1,
-            enable_safety_checker=ad_request.enable_safety_checker,
-            output_format=ad_request.output_format
-        )
-        print(f"Full background result: {background_result}")
-
-        if 'error' in background_result:
-            raise ValueError(f"Error in image generation: {background_result['error']}")
+        with deadline_scope(deadline_ms), prewarmer.busy():
+            results = await asyncio.wait_for(
+                async_generate_ad(session, data),
+                timeout=remaining_budget()
+            )
+        return results, 200
+    except (DeadlineExceeded, asyncio.TimeoutError):
+        return {"error": "Request deadline exceeded"}, 504
+    except MemoryBudgetExceeded as e:
+        return {"error": str(e)}, 503
+    except Exception as e:
+        print(f"Error in generate_ad: {str(e)}")
+        return {"error": str(e)}, 500
 
-        if 'images' not in background_result or not background_result['images']:
-            raise ValueError(f"No images generated. Full response: {background_result}")
+async def run_idempotent(request, scope, fingerprint, factory):
+    """Run factory() once per Idempotency-Key when the client sent one; returns a response"""
+    key = request.headers.get('Idempotency-Key')
+    if key is not None and not 0 < len(key) <= MAX_KEY_LENGTH:
+        return JSONResponse({"error": f"Idempotency-Key must be 1-{MAX_KEY_LENGTH} characters"}, status_code=400)
 
-        background_image_base64 = background_result['images'][0]['content']
+    replayed = False
+    try:
+        if key is None:
+            content, status_code = await until_disconnected(request, factory)
+        else:
+            # Keyed work keeps running if this client leaves: its retry will attach to it
+            content, status_code, replayed = await idempotency_store.run(scope, key, fingerprint, factory)
+    except ClientDisconnected:
+        # Nobody is left to read this
+        return Response(status_code=499)
+    except IdempotencyKeyReused as e:
+        return JSONResponse({"error": str(e)}, status_code=422)
+    except Exception as e:
+        print(f"Error in {scope}: {str(e)}")
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+    if status_code == 200:
+        response = negotiated_response(request.headers.get('accept', ''), content)
+    else:
+        response = JSONResponse(content, status_code=status_code)
+    if status_code == 503:
+        response.headers["Retry-After"] = "5"
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return response
+
+@app.post("/generate-ad")
+async def generate_ad(request: Request):
+    try:
+        deadline_ms = parse_deadline_header(request.headers.get('X-Deadline-Ms'))
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
 
-        try:
-            # Decode the base64 image
-            background_image_data = base64.b64decode(background_image_base64)
-            background_image = Image.open(io.BytesIO(background_image_data))
-            print(f"Background image decoded successfully. Size: {background_image.size}, Mode: {background_image.mode}")
-        except Exception as e:
-            print(f"Error decoding background image: {str(e)}")
-            return {"error": f"Error decoding background image: {str(e)}"}
-
-        # Generate text overlay
-        text_overlay, text_properties = await generate_text_overlay(
-            session,
-            background_prompt,  # Use the background prompt as the image description
-            ad_request.text_overlay,
-            background_image.size
-        )
+    try:
+        data = await request.json()
+    except Exception as e:
+        print(f"Error in generate_ad: {str(e)}")
+        return JSONResponse({"error": str(e)}, status_code=500)
+    if 'text_overlay' not in data:
+        data['text_overlay'] = "summer sale bonanza 50% off"  # Default text if not provided
+    try:
+        validate_renditions(data.get('renditions'))
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
 
-        try:
-            # Create text overlay image
-            text_overlay_image = Image.open(io.BytesIO(base64.b64decode(text_overlay)))
-            print("Text overlay image created successfully")
-        except Exception as e:
-            print(f"Error creating text overlay image: {str(e)}")
-            raise
+    return await run_idempotent(
+        request, "generate-ad", request_fingerprint(data),
+        lambda: run_generate_ad(request.app.state.http_session, data, deadline_ms)
+    )
 
-        try:
-            # Overlay text on background
-            background_image.paste(text_overlay_image, (0, 0), text_overlay_image)
-            print("Text overlaid on background successfully")
-        except Exception as e:
-            print(f"Error overlaying text on background: {str(e)}")
-            raise
+def campaign_item_result(index, task):
+    """An item's result, or an error entry if it was cut off or crashed"""
+    if task.cancelled():
+        return {"index": index, "status": "error", "error": "Request deadline exceeded"}
+    error = task.exception()
+    if isinstance(error, DeadlineExceeded):
+        return {"index": index, "status": "error", "error": "Request deadline exceeded"}
+    if error is not None:
+        print(f"Error in campaign item {index}: {str(error)}")
+        return {"index": index, "status": "error", "error": str(error)}
+    return task.result()
+
+@app.post("/generate-campaign")
+async def generate_campaign(request: Request):
+    """
+    Generate a whole campaign in one request.
+
+    Body: {"items": [<generate-ad payload>, ...], "defaults": {...}}, where
+    defaults are merged under every item. Identical prompts, backgrounds and
+    text layers are generated once for the batch, upstream calls are capped
+    per upstream across all items, and each item reports its own status so
+    one failure (or the deadline) doesn't discard the rest.
+    """
+    try:
+        deadline_ms = parse_deadline_header(request.headers.get('X-Deadline-Ms'))
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
 
+    try:
+        data = await request.json()
+    except ValueError:
+        return JSONResponse({"error": "Invalid JSON body"}, status_code=400)
+    if not isinstance(data, dict):
+        return JSONResponse({"error": "Expected a JSON object"}, status_code=400)
+    items = data.get('items')
+    defaults = data.get('defaults') or {}
+    if not isinstance(items, list) or not items:
+        return JSONResponse({"error": "Expected a non-empty 'items' list"}, status_code=400)
+    if len(items) > BATCH_MAX_ITEMS:
+        return JSONResponse({"error": f"A campaign can have at most {BATCH_MAX_ITEMS} items"}, status_code=400)
+    if not isinstance(defaults, dict) or not all(isinstance(item, dict) for item in items):
+        return JSONResponse({"error": "'defaults' and every item must be JSON objects"}, status_code=400)
+
+    batch_stats["batches"] += 1
+    batch_stats["items"] += len(items)
+    plan = BatchPlan()
+    session = request.app.state.http_session
+    disconnected = False
+    with deadline_scope(deadline_ms), prewarmer.busy():
+        tasks = [
+            asyncio.ensure_future(generate_campaign_item(session, plan, index, defaults, item))
+            for index, item in enumerate(items)
+        ]
         try:
-            # Save the combined image to a file
-            output_dir = "generated_banners"
-            os.makedirs(output_dir, exist_ok=True)
-            file_name = f"banner_{product_name}_{int(time.time())}.png"
-            file_path = os.path.join(output_dir, file_name)
-            background_image.save(file_path, format="PNG")
-            print(f"Combined image saved successfully to {file_path}")
-
-            # Also create the base64 string
-            buffered = io.BytesIO()
-            background_image.save(buffered, format="PNG")
-            combined_image_base64 = base64.b64encode(buffered.getvalue()).decode()
-        except Exception as e:
-            print(f"Error saving combined image: {str(e)}")
-            raise
-
-        return {
-            "prompt": background_prompt,
-            "background_image": background_image_base64,
-            "text_overlay_properties": text_properties,
-            "combined_image": combined_image_base64,
-            "saved_image_path": file_path
-        }
-
-    except Exception as e:
-        print(f"Error in generate_banner: {str(e)}")
-        return {"error": str(e)}
-
-async def async_generate_ad(data):
-    async with aiohttp.ClientSession() as session:
-        tasks = []
-        # Check if 'banner_types' exists in the data, if not, use a default value
-        banner_types = data.get('banner_types', ['default'])
-        for banner_type in banner_types:
-            ad_request = AdRequest(**data)
-            tasks.append(generate_banner(session, ad_request, ad_request.product_name, banner_type))
-        results = await asyncio.gather(*tasks)
-    return results
-
-@app.route("/generate-ad", methods=["POST"])
-def generate_ad():
+            await until_disconnected(request, lambda: asyncio.wait(tasks, timeout=remaining_budget()))
+        except DeadlineExceeded:
+            pass
+        except ClientDisconnected:
+            disconnected = True
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+            plan.cancel()
+        # Let cancelled items unwind before reading their state
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    if disconnected:
+        return Response(status_code=499)
+
+    results = [campaign_item_result(index, task) for index, task in enumerate(tasks)]
+    statuses = [result["status"] for result in results]
+    return negotiated_response(request.headers.get('accept', ''), {
+        "results": results,
+        "summary": {
+            "items": len(results),
+            "succeeded": statuses.count("ok"),
+            "partial": statuses.count("partial"),
+            "failed": statuses.count("error"),
+            "shared_work": plan.summary(),
+        },
+    })
+
+def parse_time_param(value):
+    """Unix seconds or an ISO 8601 timestamp (UTC unless it carries an offset)"""
+    if value is None:
+        return None
     try:
-        data = request.json
-        if 'text_overlay' not in data:
-            data['text_overlay'] = "summer sale bonanza 50% off"  # Default text if not provided
-        results = asyncio.run(async_generate_ad(data))
-        return jsonify(results)
-    except Exception as e:
-        print(f"Error in generate_ad: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"Invalid time '{value}'; use unix seconds or ISO 8601")
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+@app.get("/banners")
+async def list_banners(product: Optional[str] = None, theme: Optional[str] = None, since: Optional[str] = None,
+                       until: Optional[str] = None, limit: int = 50, cursor: Optional[str] = None):
+    """Generated banners, newest first; pass next_cursor back as cursor for the next page"""
+    try:
+        return await asyncio.to_thread(
+            banner_catalog.query,
+            product_name=product,
+            theme=theme,
+            since=parse_time_param(since),
+            until=parse_time_param(until),
+            limit=limit,
+            cursor=cursor
+        )
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+@app.get("/banners/{banner_id}/variant")
+async def banner_variant(request: Request, banner_id: int, width: Optional[int] = None, format: str = "webp",
+                         quality: int = DEFAULT_QUALITY):
+    """A downscaled/re-encoded copy of a stored banner, e.g. ?width=320&format=webp for gallery thumbnails"""
+    banner = await asyncio.to_thread(banner_catalog.get, banner_id)
+    if banner is None or not os.path.exists(banner['path']):
+        return JSONResponse({"error": f"Banner {banner_id} not found"}, status_code=404)
+    try:
+        data, content_type, key = await get_variant(banner, width, format.lower(), quality)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    except MemoryBudgetExceeded as e:
+        return JSONResponse({"error": str(e)}, status_code=503, headers={"Retry-After": "5"})
+
+    # A banner's content never changes, so neither does any variant of it
+    headers = {"ETag": f'"{key}"', "Cache-Control": "public, max-age=31536000, immutable"}
+    if request.headers.get("if-none-match") in (f'"{key}"', f'W/"{key}"', "*"):
+        return Response(status_code=304, headers=headers)
+    return Response(content=data, media_type=content_type, headers=headers)
+
+@app.get("/stats")
+async def stats():
+    return {
+        "theme_index": theme_index.stats(),
+        "image_cache": image_cache.stats(),
+        "guidelines_cache": guidelines_cache.stats(),
+        "upstreams": upstream_stats(),
+        "model_breakers": router_stats(),
+        "batches": dict(batch_stats),
+        "memory": memory_stats(),
+        "text_layer_cache": text_layer_cache.stats(),
+        "idempotency": idempotency_store.stats(),
+        "banner_catalog": banner_catalog.stats(),
+        "variant_cache": variant_cache_stats(),
+        "cassette": cassette.stats(),
+        "prewarm": prewarmer.stats(),
+        "text_properties_cache": text_properties_cache_stats(),
+        "cancellation": cancellation_stats(),
+        "product_models": product_models.stats(),
+        "fal_dispatch": fal_dispatcher.stats(),
+        "structured_output": structured_output_stats()
+    }
 
 @app.post("/test-text-overlay")
 async def test_text_overlay(request: Request):
@@ -201,81 +340,115 @@ async def test_text_overlay(request: Request):
     image_description = data.get("image_description", "A blank canvas")
     image_size = tuple(map(int, data.get("image_size", "800x600").split("x")))
 
-    async with aiohttp.ClientSession() as session:
-        text_overlay = await generate_text_overlay(session, image_description, text_content, image_size)
+    session = request.app.state.http_session
+    text_overlay = await generate_text_overlay(session, image_description, text_content, image_size)
 
     return {"text_overlay": text_overlay}
 
 
-@app.route('/generate-background', methods=['POST'])
-def generate_banner_api():
+async def run_generate_background(uploads, company_context, event_context, deadline_ms):
+    """(content, status_code) for a validated generate-background request; closes the uploads"""
+    guidelines = uploads['guidelines_file']
     try:
-        # Check if guidelines file is included in request
-        if 'guidelines_file' not in request.files:
-            return jsonify({"error": "Guidelines file is required"}), 400
+        with deadline_scope(deadline_ms), prewarmer.busy():
+            # The Assistants and FAL clients block, so keep them off the event loop
+            generated_banners = await asyncio.wait_for(
+                run_in_threadpool(
+                    generate_background,
+                    guidelines_file=guidelines.file,
+                    guidelines_filename=guidelines.filename,
+                    guidelines_hash=guidelines.sha256,
+                    company_context=company_context,
+                    event_context=event_context
+                ),
+                timeout=remaining_budget()
+            )
+    except (DeadlineExceeded, asyncio.TimeoutError):
+        return {"error": "Request deadline exceeded"}, 504
+    except Exception as e:
+        print(f"Error in generate_banner_api: {str(e)}")  # Add logging
+        return {"error": str(e)}, 500
+    finally:
+        for upload in uploads.values():
+            upload.close()
+
+    # Extract URLs and format response
+    banner_urls = []
+    top_urls = []
+    for banner in generated_banners:
+        if 'image' in banner and 'images' in banner['image']:
+            banner_urls.append({
+                "prompt": banner['background_prompt'],
+                "urls": [img['url'] for img in banner['image']['images'] if 'url' in img],
+                "text_specifications": banner.get('text_specifications', {
+                    "content": {},
+                    "typography": {},
+                    "colors": {},
+                    "layout": {}
+                })
+            })
+            #pick the last urls from the banner_urls
+            top_urls.append(banner_urls[-1]['urls'][-1])
+
+    if not banner_urls:
+        return {"error": "No valid images were generated"}, 500
 
-        # Get form data
-        company_context = request.form.get('company_context')
-        event_context = request.form.get('event_context')
+    return {
+        "banners": banner_urls,
+        "status": "success",
+        "count": len(banner_urls),
+        "urls": top_urls,
+        "guidelines_sha256": guidelines.sha256
+    }, 200
+
+@app.post('/generate-background')
+async def generate_banner_api(request: Request):
+    try:
+        deadline_ms = parse_deadline_header(request.headers.get('X-Deadline-Ms'))
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
 
-        if not company_context or not event_context:
-            return jsonify({"error": "Both company_context and event_context are required"}), 400
+    try:
+        fields, uploads = await read_multipart_upload(request)
+    except UploadTooLarge as e:
+        return JSONResponse({"error": str(e)}, status_code=413)
+    except MalformedUpload as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    except ValueError:
+        return JSONResponse({"error": "Guidelines file is required"}, status_code=400)
+    except Exception as e:
+        print(f"Error in generate_banner_api: {str(e)}")
+        return JSONResponse({"error": str(e)}, status_code=500)
 
-        # Save the uploaded file temporarily
-        file = request.files['guidelines_file']
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
+    # Once started, the run owns the uploads and closes them, even if this client goes away.
+    # A request that attaches to or replays another's run never starts one, so it closes its own
+    started = False
 
-        try:
-            # Generate banner using the existing function
-            generated_banners = generate_background(
-                guidelines_file_path=filepath,
-                company_context=company_context,
-                event_context=event_context
-            )
+    def start_run():
+        nonlocal started
+        started = True
+        return run_generate_background(uploads, company_context, event_context, deadline_ms)
+
+    try:
+        # Check if guidelines file is included in request
+        if 'guidelines_file' not in uploads:
+            return JSONResponse({"error": "Guidelines file is required"}, status_code=400)
 
-            # Clean up the temporary file
-            os.remove(filepath)
-
-            # Extract URLs and format response
-            banner_urls = []
-            top_urls = []
-            for banner in generated_banners:
-                if 'image' in banner and 'images' in banner['image']:
-                    banner_urls.append({
-                        "prompt": banner['background_prompt'],
-                        "urls": [img['url'] for img in banner['image']['images'] if 'url' in img],
-                        "text_specifications": banner.get('text_specifications', {
-                            "content": {},
-                            "typography": {},
-                            "colors": {},
-                            "layout": {}
-                        })
-                    })
-                    #pick the last urls from the banner_urls
-                    top_urls.append(banner_urls[-1]['urls'][-1])
-
-            if not banner_urls:
-                return jsonify({"error": "No valid images were generated"}), 500
-
-            return jsonify({
-                "banners": banner_urls,
-                "status": "success",
-                "count": len(banner_urls),
-                "urls": top_urls
-            }), 200
-
-        except Exception as e:
-            # Clean up the temporary file in case of error
-            if os.path.exists(filepath):
-                os.remove(filepath)
-            raise e
+        # Get form data
+        company_context = fields.get('company_context')
+        event_context = fields.get('event_context')
 
-    except Exception as e:
-        print(f"Error in generate_banner_api: {str(e)}")  # Add logging
-        return jsonify({"error": str(e)}), 500
+        if not company_context or not event_context:
+            return JSONResponse({"error": "Both company_context and event_context are required"}, status_code=400)
+
+        # The upload is handed over straight from memory; it never round-trips through disk
+        fingerprint = request_fingerprint(company_context, event_context, uploads['guidelines_file'].sha256)
+        return await run_idempotent(request, "generate-background", fingerprint, start_run)
+    finally:
+        if not started:
+            for upload in uploads.values():
+                upload.close()
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=8000, debug=True)
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
 
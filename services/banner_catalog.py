@@ -0,0 +1,175 @@
+import os
+import json
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Optional, Tuple
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+BANNER_OUTPUT_DIR = os.getenv("BANNER_OUTPUT_DIR", "generated_banners")
+BANNER_CATALOG_DB = os.getenv("BANNER_CATALOG_DB", "banner_catalog.db")
+MAX_PAGE_SIZE = 200
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS banners (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    path TEXT NOT NULL UNIQUE,
+    product_name TEXT NOT NULL COLLATE NOCASE,
+    theme TEXT COLLATE NOCASE,
+    banner_type TEXT,
+    background_prompt TEXT,
+    text_overlay TEXT,
+    seed INTEGER,
+    model TEXT,
+    quality_tier TEXT,
+    width INTEGER,
+    height INTEGER,
+    bytes INTEGER,
+    content_sha256 TEXT,
+    timings TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS banners_product_created ON banners (product_name, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS banners_theme_created ON banners (theme, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS banners_created ON banners (created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS banners_sha256 ON banners (content_sha256);
+"""
+
+COLUMNS = (
+    "id", "path", "product_name", "theme", "banner_type", "background_prompt", "text_overlay", "seed", "model",
+    "quality_tier", "width", "height", "bytes", "content_sha256", "timings", "created_at",
+)
+
+
+def banner_file_name(product_name: str, created_at: float) -> str:
+    """A name that can't collide, even for one product twice in the same second"""
+    safe_product = re.sub(r"[^\w\- ]", "_", product_name).strip() or "banner"
+    return f"banner_{safe_product}_{int(created_at)}_{uuid.uuid4().hex[:8]}.png"
+
+
+def _encode_cursor(created_at: float, banner_id: int) -> str:
+    return f"{created_at!r}:{banner_id}"
+
+
+def _decode_cursor(cursor: str) -> Tuple[float, int]:
+    try:
+        created_at, banner_id = cursor.rsplit(":", 1)
+        return float(created_at), int(banner_id)
+    except ValueError:
+        raise ValueError(f"Invalid cursor '{cursor}'")
+
+
+class BannerCatalog:
+    """
+    SQLite index of the banners written to BANNER_OUTPUT_DIR.
+
+    Listing is keyset-paginated on (created_at, id), newest first, so a page
+    deep into a busy product's history costs the same as the first one.
+    """
+
+    def __init__(self, db_path: str = BANNER_CATALOG_DB, output_dir: str = BANNER_OUTPUT_DIR):
+        self.db_path = db_path
+        self.output_dir = output_dir
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(db_path, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.executescript(SCHEMA)
+
+    def save(self, png_bytes: bytes, product_name: str, **metadata) -> dict:
+        """
+        Write the banner to a fresh file and record it.
+
+        metadata holds the remaining catalog columns (theme, prompts, seed,
+        model, size, content_sha256, timings, ...). Returns the stored row.
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        created_at = time.time()
+        path = os.path.join(self.output_dir, banner_file_name(product_name, created_at))
+        # "x" refuses to overwrite, so a collision can only fail loudly
+        with open(path, "xb") as f:
+            f.write(png_bytes)
+
+        row = {
+            "path": path,
+            "product_name": product_name,
+            "bytes": len(png_bytes),
+            "created_at": created_at,
+            **metadata,
+        }
+        if isinstance(row.get("timings"), dict):
+            row["timings"] = json.dumps(row["timings"])
+        unknown = set(row) - set(COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown catalog fields: {', '.join(sorted(unknown))}")
+
+        names = ", ".join(row)
+        placeholders = ", ".join("?" for _ in row)
+        with self._lock, self._connection:
+            cursor = self._connection.execute(
+                f"INSERT INTO banners ({names}) VALUES ({placeholders})", tuple(row.values())
+            )
+        row["id"] = cursor.lastrowid
+        return self._public(row)
+
+    def query(self, product_name: Optional[str] = None, theme: Optional[str] = None,
+              since: Optional[float] = None, until: Optional[float] = None,
+              limit: int = 50, cursor: Optional[str] = None) -> dict:
+        """One page of banners, newest first, plus the cursor of the next page"""
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        clauses, params = [], []
+        if product_name is not None:
+            clauses.append("product_name = ?")
+            params.append(product_name)
+        if theme is not None:
+            clauses.append("theme = ?")
+            params.append(theme)
+        if since is not None:
+            clauses.append("created_at >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("created_at < ?")
+            params.append(until)
+        if cursor is not None:
+            created_at, banner_id = _decode_cursor(cursor)
+            clauses.append("(created_at < ? OR (created_at = ? AND id < ?))")
+            params.extend([created_at, created_at, banner_id])
+
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        sql = f"SELECT {', '.join(COLUMNS)} FROM banners {where} ORDER BY created_at DESC, id DESC LIMIT ?"
+        with self._lock:
+            rows = self._connection.execute(sql, (*params, limit + 1)).fetchall()
+
+        banners = [self._public(dict(row)) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last = rows[limit - 1]
+            next_cursor = _encode_cursor(last["created_at"], last["id"])
+        return {"banners": banners, "next_cursor": next_cursor}
+
+    def get(self, banner_id: int) -> Optional[dict]:
+        with self._lock:
+            row = self._connection.execute(
+                f"SELECT {', '.join(COLUMNS)} FROM banners WHERE id = ?", (banner_id,)
+            ).fetchone()
+        return self._public(dict(row)) if row is not None else None
+
+    @staticmethod
+    def _public(row: dict) -> dict:
+        if isinstance(row.get("timings"), str):
+            row["timings"] = json.loads(row["timings"])
+        return row
+
+    def stats(self) -> dict:
+        with self._lock:
+            count = self._connection.execute("SELECT COUNT(*) FROM banners").fetchone()[0]
+        return {"banners": count, "db_path": self.db_path}
+
+
+banner_catalog = BannerCatalog()
@@ -0,0 +1,363 @@
+import asyncio
+import base64
+import hashlib
+import io
+import time
+from dataclasses import dataclass, field
+from typing import List, Literal, Optional
+from PIL import Image
+from services.gpt_background_service import generate_background_prompt
+from services.fal_service import cached_image, generate_image, image_cache
+from services.text_generation_service import (
+    TEXT_PROPERTIES_CACHE_SIZE,
+    cached_text_properties,
+    generate_text_overlay,
+    has_cached_text_properties,
+)
+from services.theme_index import theme_index
+from services.prewarm import prewarmer
+from services.cancellation import gather_or_cancel, wasted_work
+from services.rendition_service import render_renditions, validate_renditions
+from services.response_service import ImagePart
+from services.banner_catalog import banner_catalog
+from services.memory_budget import MemoryBudgetExceeded, admission, estimate_request_bytes, memory_stage
+from services.batch_scheduler import run_shared
+from services.upstream import DeadlineExceeded
+
+@dataclass
+class AdRequest:
+    product_name: str
+    theme: str
+    extra_input: str
+    promotional_offer: str
+    image_size: str = "landscape_4_3"  # Changed default to an accepted value
+    num_inference_steps: int = 28
+    seed: Optional[int] = None
+    loras: Optional[List[dict]] = None
+    guidance_scale: float = 3.5
+    enable_safety_checker: bool = True
+    output_format: str = "jpeg"
+    num_images: int = field(default=1)
+    flow_type: Literal["product_marketing", "banner_creation"] = "product_marketing"
+    banner_types: List[str] = field(default_factory=lambda: ['default'])
+    text_overlay: str = "summer sale bonanza 50% off"  # Default text for testing
+    reuse_similar_theme: bool = False  # Reuse the prompt (and, for seeded requests, the background) of a near-duplicate theme
+    text_properties_mode: Literal["llm", "local"] = "llm"  # "local" analyzes the background instead of calling gpt-4
+    quality_tier: Optional[Literal["draft", "standard", "premium"]] = None  # Overrides steps/guidance with the tier's settings
+    renditions: Optional[List[str]] = None  # Extra sizes cropped from the same background, e.g. ["square_hd", "strip_2100x600"]
+
+def background_cache_key(ad_request):
+    """Backgrounds are only interchangeable when generated with the same settings"""
+    return "|".join(str(value) for value in (
+        ad_request.product_name,
+        ad_request.image_size,
+        ad_request.num_inference_steps,
+        ad_request.guidance_scale,
+        ad_request.seed,
+        ad_request.enable_safety_checker,
+        ad_request.output_format,
+        ad_request.quality_tier,
+    ))
+
+def reusable_background_key(ad_request):
+    """
+    The theme index key a background is stored and reused under, or None.
+
+    Only seeded requests ask for a reproducible image; an unseeded one (a
+    retry, a "regenerate") expects a fresh background, so it may reuse a
+    similar theme's prompt but never its stored image.
+    """
+    return background_cache_key(ad_request) if ad_request.seed is not None else None
+
+def generate_background_image(session, ad_request, background_prompt):
+    return generate_image(
+        session,
+        product_name=ad_request.product_name,
+        prompt=background_prompt,
+        image_size=ad_request.image_size,
+        num_inference_steps=ad_request.num_inference_steps,
+        seed=ad_request.seed,
+        guidance_scale=ad_request.guidance_scale,
+        num_images=1,
+        enable_safety_checker=ad_request.enable_safety_checker,
+        output_format=ad_request.output_format,
+        quality_tier=ad_request.quality_tier
+    )
+
+def missing_banner_inputs(ad_request):
+    """Which of the prompt, background and text properties a request like this one would still generate"""
+    missing = []
+    background_prompt = theme_index.prompt_for(ad_request.theme)
+    if background_prompt is None:
+        missing.append("prompt")
+    background_key = reusable_background_key(ad_request)
+    # Unseeded requests always generate a fresh background, so there is none to warm for them
+    if background_key is not None:
+        background_ref = theme_index.background_ref(ad_request.theme, background_key)
+        # The image cache may have evicted the bytes since the index recorded them
+        if background_ref is None or background_ref not in image_cache:
+            missing.append("background")
+    if (ad_request.text_properties_mode == "llm" and TEXT_PROPERTIES_CACHE_SIZE
+            and (background_prompt is None
+                 or not has_cached_text_properties(background_prompt, ad_request.text_overlay))):
+        missing.append("text_properties")
+    return missing
+
+async def prewarm_banner_inputs(session, ad_request, missing):
+    """Generate and cache the missing inputs (see missing_banner_inputs) generate_banner would need"""
+    background_prompt = theme_index.prompt_for(ad_request.theme)
+    if background_prompt is None:
+        background_prompt = await generate_background_prompt(session, ad_request.theme)
+    background_result = None
+    if "background" in missing:
+        background_result = await generate_background_image(session, ad_request, background_prompt)
+        if 'error' in background_result or not background_result.get('images'):
+            raise ValueError(f"Error in image generation: {background_result.get('error', 'no images')}")
+        if background_result.get('cache_key') is None:
+            raise ValueError("Generated background could not be stored in the image cache")
+    if "prompt" in missing or background_result is not None:
+        background_ref = background_result['cache_key'] if background_result is not None else None
+        theme_index.add(ad_request.theme, background_prompt, reusable_background_key(ad_request), background_ref)
+    if "text_properties" in missing:
+        await cached_text_properties(session, background_prompt, ad_request.text_overlay)
+
+def decode_background(image_base64):
+    """The background's compressed bytes and its loaded image; CPU-bound, so run it in a thread"""
+    image_data = base64.b64decode(image_base64)
+    image = Image.open(io.BytesIO(image_data))
+    image.load()
+    return image_data, image
+
+def compose_banner_png(background_image, text_overlay_layer):
+    """(PNG bytes, their SHA-256) of the background with the text pasted on; closes the canvas"""
+    text_overlay_layer.paste_onto(background_image)
+    print("Text overlaid on background successfully")
+    # Encode once; the same PNG bytes go to disk and into the response
+    buffered = io.BytesIO()
+    background_image.save(buffered, format="PNG")
+    # The decoded canvas is the largest copy; drop it as soon as it's encoded
+    background_image.close()
+    png = buffered.getvalue()
+    return png, hashlib.sha256(png).hexdigest()
+
+async def generate_banner(session, ad_request, product_name, banner_type, plan=None, priority=0):
+    try:
+        # Wall time of each stage, recorded in the banner catalog
+        timings = {}
+        stage_started = time.perf_counter()
+
+        def lap(stage):
+            nonlocal stage_started
+            now = time.perf_counter()
+            timings[f"{stage}_ms"] = round((now - stage_started) * 1000, 1)
+            stage_started = now
+
+        background_key = background_cache_key(ad_request)
+        prewarmer.record(ad_request, background_key)
+        theme_match = None
+        background_result = None
+        if ad_request.reuse_similar_theme:
+            theme_match = theme_index.lookup(ad_request.theme, reusable_background_key(ad_request))
+
+        if theme_match:
+            background_prompt = theme_match['prompt']
+            if theme_match['background_ref'] is not None:
+                background_result = await asyncio.to_thread(cached_image, theme_match['background_ref'])
+                if background_result is None:
+                    # Evicted from the image cache since; generate it again below
+                    theme_index.discard_background(theme_match['matched_theme'], reusable_background_key(ad_request))
+                else:
+                    prewarmer.served(theme_match['matched_theme'], background_key)
+            print(f"Reusing prompt of similar theme '{theme_match['matched_theme']}' "
+                  f"(similarity {theme_match['similarity']})")
+        else:
+            # Generate background prompt
+            background_prompt = await run_shared(
+                plan, "prompt", ad_request.theme, "openai", priority,
+                lambda: generate_background_prompt(session, ad_request.theme)
+            )
+            print(f"Generated background prompt: {background_prompt}")
+        lap("prompt")
+
+        reused_background = background_result is not None
+        if background_result is None:
+            # Generate background image
+            background_result = await run_shared(
+                plan, "background", (background_prompt, background_key), "fal", priority,
+                lambda: generate_background_image(session, ad_request, background_prompt)
+            )
+            print(f"Full background result: {background_result}")
+        lap("background")
+
+        if 'error' in background_result:
+            raise ValueError(f"Error in image generation: {background_result['error']}")
+
+        if 'images' not in background_result or not background_result['images']:
+            raise ValueError(f"No images generated. Full response: {background_result}")
+
+        theme_index.add(ad_request.theme, background_prompt, reusable_background_key(ad_request),
+                        background_result.get('cache_key'))
+
+        background_image_base64 = background_result['images'][0]['content']
+        background_content_type = background_result['images'][0].get('content_type', 'image/jpeg')
+
+        # LLM properties only need the prompt and the text, so their round trip happens
+        # before any memory is reserved; local ones analyze the decoded image below
+        text_properties = None
+        if ad_request.text_properties_mode == "llm":
+            text_properties = await run_shared(
+                plan, "text_properties", (background_prompt, ad_request.text_overlay), "openai", priority,
+                lambda: cached_text_properties(session, background_prompt, ad_request.text_overlay)
+            )
+        lap("text_properties")
+
+        # Everything below holds full-size copies of the image; wait for room in the memory budget
+        async with admission.reserve(estimate_request_bytes(ad_request.image_size, ad_request.renditions)):
+            try:
+                with memory_stage("decode"):
+                    # Decoding takes long enough to stall every other request if done on the event loop
+                    background_image_data, background_image = await asyncio.to_thread(
+                        decode_background, background_image_base64
+                    )
+                    del background_image_base64
+                print(f"Background image decoded successfully. Size: {background_image.size}, Mode: {background_image.mode}")
+            except Exception as e:
+                print(f"Error decoding background image: {str(e)}")
+                return {"error": f"Error decoding background image: {str(e)}"}
+
+            # Generate text overlay
+            with memory_stage("text_layer"):
+                text_overlay_layer, text_properties = await run_shared(
+                    plan, "text_layer",
+                    (background_prompt, background_key, ad_request.text_overlay, ad_request.text_properties_mode),
+                    None, priority,
+                    lambda: generate_text_overlay(
+                        session,
+                        background_prompt,  # Use the background prompt as the image description
+                        ad_request.text_overlay,
+                        background_image.size,
+                        mode=ad_request.text_properties_mode,
+                        image=background_image,
+                        as_image=True,
+                        properties=text_properties
+                    )
+                )
+            print("Text overlay image created successfully")
+            lap("text_layer")
+
+            try:
+                width, height = background_image.size
+                with memory_stage("compose"):
+                    combined_image_png, combined_sha256 = await asyncio.to_thread(
+                        compose_banner_png, background_image, text_overlay_layer
+                    )
+                    del background_image, text_overlay_layer
+            except Exception as e:
+                print(f"Error composing banner: {str(e)}")
+                raise
+
+            try:
+                lap("compose")
+                # Save the combined image to a file and index it in the catalog
+                catalog_entry = await asyncio.to_thread(
+                    banner_catalog.save,
+                    combined_image_png,
+                    product_name,
+                    theme=ad_request.theme,
+                    banner_type=banner_type,
+                    background_prompt=background_prompt,
+                    text_overlay=ad_request.text_overlay,
+                    seed=background_result.get('seed', ad_request.seed),
+                    model=background_result.get('model'),
+                    quality_tier=background_result.get('quality_tier'),
+                    width=width,
+                    height=height,
+                    content_sha256=combined_sha256,
+                    timings=timings
+                )
+                file_path = catalog_entry['path']
+                print(f"Combined image saved successfully to {file_path}")
+            except Exception as e:
+                print(f"Error saving combined image: {str(e)}")
+                raise
+
+            renditions = None
+            if ad_request.renditions:
+                # All sizes come from this one generation, cropped and re-laid-out locally
+                with memory_stage("renditions"):
+                    renditions = await asyncio.to_thread(
+                        render_renditions,
+                        background_image_data,
+                        ad_request.text_overlay,
+                        text_properties,
+                        ad_request.renditions,
+                        ad_request.text_properties_mode
+                    )
+
+        return {
+            "prompt": background_prompt,
+            "background_image": ImagePart(background_image_data, background_content_type),
+            "text_overlay_properties": text_properties,
+            "combined_image": ImagePart(combined_image_png, "image/png"),
+            "saved_image_path": file_path,
+            "banner_id": catalog_entry['id'],
+            "renditions": renditions,
+            "quality_tier": background_result.get('quality_tier'),
+            "theme_match": {
+                "matched_theme": theme_match['matched_theme'],
+                "similarity": theme_match['similarity'],
+                "reused_prompt": True,
+                "reused_background": reused_background
+            } if theme_match else None
+        }
+
+    except (DeadlineExceeded, MemoryBudgetExceeded):
+        # The whole request is out of time or memory, not just this banner
+        raise
+    except asyncio.CancelledError:
+        wasted_work["cancelled_banners"] += 1
+        raise
+    except Exception as e:
+        print(f"Error in generate_banner: {str(e)}")
+        return {"error": str(e)}
+
+async def async_generate_ad(session, data):
+    tasks = []
+    # Check if 'banner_types' exists in the data, if not, use a default value
+    banner_types = data.get('banner_types', ['default'])
+    # All banners of the request run at once; turn away what could never fit in memory
+    admission.check(estimate_request_bytes(data.get('image_size', "landscape_4_3"), data.get('renditions'),
+                                           len(banner_types)))
+    for banner_type in banner_types:
+        ad_request = AdRequest(**data)
+        tasks.append(generate_banner(session, ad_request, ad_request.product_name, banner_type))
+    # Once one banner runs out of time or memory the request fails; don't finish the others
+    return await gather_or_cancel(*tasks)
+
+async def generate_campaign_item(session, plan, index, defaults, item):
+    try:
+        data = {'text_overlay': "summer sale bonanza 50% off", **defaults, **item}
+        ad_request = AdRequest(**data)
+        validate_renditions(ad_request.renditions)
+    except (TypeError, ValueError) as e:
+        return {"index": index, "status": "error", "error": f"Invalid ad request: {str(e)}"}
+
+    try:
+        admission.check(estimate_request_bytes(ad_request.image_size, ad_request.renditions,
+                                               len(ad_request.banner_types)))
+    except MemoryBudgetExceeded as e:
+        return {"index": index, "product_name": ad_request.product_name, "status": "error", "error": str(e)}
+
+    banners = await gather_or_cancel(*(
+        generate_banner(session, ad_request, ad_request.product_name, banner_type, plan=plan, priority=index)
+        for banner_type in ad_request.banner_types
+    ))
+    failed = sum(1 for banner in banners if 'error' in banner)
+    if not failed:
+        status = "ok"
+    elif failed == len(banners):
+        status = "error"
+    else:
+        status = "partial"
+    return {"index": index, "product_name": ad_request.product_name, "status": status, "banners": banners}
+
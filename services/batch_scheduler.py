@@ -0,0 +1,124 @@
+import os
+import asyncio
+import heapq
+import itertools
+from collections import Counter
+from typing import Awaitable, Callable, Dict, Hashable, Optional
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Concurrent calls a single batch may have in flight per upstream
+BATCH_UPSTREAM_CONCURRENCY = {
+    "openai": int(os.getenv("BATCH_OPENAI_CONCURRENCY", "8")),
+    "fal": int(os.getenv("BATCH_FAL_CONCURRENCY", "4")),
+}
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "100"))
+
+batch_stats = Counter()
+
+
+class PriorityLimiter:
+    """
+    A semaphore that hands free slots to the lowest priority value first.
+
+    Batches pass the item index, so when an upstream is saturated the earliest
+    items get their calls through first and finish in order, instead of every
+    item advancing a stage at a time and all of them finishing at the end.
+    """
+
+    def __init__(self, limit: int):
+        self.available = limit
+        self._waiters = []
+        self._counter = itertools.count()
+
+    async def acquire(self, priority: int):
+        if self.available > 0 and not self._waiters:
+            self.available -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just as we were cancelled; pass it on
+                self.release()
+            raise
+
+    def release(self):
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.available += 1
+
+
+class BatchPlan:
+    """
+    Shared-work memo and upstream scheduling for one batch.
+
+    Sub-work is identified by a key; the first item to ask for a key starts
+    it and every later item awaits the same task, so identical prompts,
+    backgrounds and text layers are produced once per batch. Upstream calls
+    queue on per-upstream limiters ordered by the index of the item that
+    started them. With retain_results=False finished work is forgotten, so
+    only items running at the same time share it; long runs use this to
+    keep memory flat.
+    """
+
+    def __init__(self, concurrency: Optional[Dict[str, int]] = None, retain_results: bool = True):
+        concurrency = concurrency or BATCH_UPSTREAM_CONCURRENCY
+        self.retain_results = retain_results
+        self.limiters = {name: PriorityLimiter(limit) for name, limit in concurrency.items()}
+        self.tasks: Dict[Hashable, asyncio.Task] = {}
+        self.started = Counter()
+        self.shared = Counter()
+
+    async def run(self, kind: str, key: Hashable, upstream: Optional[str], priority: int,
+                  factory: Callable[[], Awaitable]):
+        """Run factory() once per (kind, key), holding an upstream slot if one is named"""
+        memo_key = (kind, key)
+        task = self.tasks.get(memo_key)
+        if task is None:
+            self.started[kind] += 1
+            task = asyncio.ensure_future(self._limited(upstream, priority, factory))
+            self.tasks[memo_key] = task
+            if not self.retain_results:
+                task.add_done_callback(lambda _: self.tasks.pop(memo_key, None))
+        else:
+            self.shared[kind] += 1
+            batch_stats[f"{kind}_deduplicated"] += 1
+        # Shielded so one item giving up doesn't cancel work other items are waiting on
+        return await asyncio.shield(task)
+
+    async def _limited(self, upstream, priority, factory):
+        limiter = self.limiters.get(upstream)
+        if limiter is None:
+            return await factory()
+        await limiter.acquire(priority)
+        try:
+            return await factory()
+        finally:
+            limiter.release()
+
+    def cancel(self):
+        for task in self.tasks.values():
+            if not task.done():
+                task.cancel()
+
+    def summary(self) -> dict:
+        return {
+            kind: {"computed": self.started[kind], "deduplicated": self.shared[kind]}
+            for kind in sorted(set(self.started) | set(self.shared))
+        }
+
+
+async def run_shared(plan: Optional[BatchPlan], kind: str, key: Hashable, upstream: Optional[str],
+                     priority: int, factory: Callable[[], Awaitable]):
+    """plan.run when part of a batch, otherwise just factory()"""
+    if plan is None:
+        return await factory()
+    return await plan.run(kind, key, upstream, priority, factory)
@@ -0,0 +1,95 @@
+import os
+import asyncio
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Optional
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# How often a running request checks whether its client is still connected
+DISCONNECT_POLL_SECONDS = float(os.getenv("DISCONNECT_POLL_SECONDS", "0.5"))
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+class RequestCancelled(Exception):
+    """Raised inside blocking (threadpool) work once its request was abandoned"""
+
+
+# Set when the request is abandoned; threads can't be cancelled like tasks, so they poll this
+current_cancel_event: ContextVar[Optional[threading.Event]] = ContextVar("current_cancel_event", default=None)
+
+wasted_work = Counter()
+
+
+def check_cancelled():
+    event = current_cancel_event.get()
+    if event is not None and event.is_set():
+        wasted_work["stopped_in_thread"] += 1
+        raise RequestCancelled("Request was abandoned by its client")
+
+
+async def until_disconnected(request, factory: Callable[[], Awaitable[object]]):
+    """
+    Await factory() unless the client disconnects first.
+
+    The work runs as its own task while the request's connection is polled
+    every DISCONNECT_POLL_SECONDS. On disconnect the task is cancelled, which
+    aborts its pending upstream HTTP calls and lets it release its buffers,
+    and blocking work started from it is told to stop through
+    check_cancelled(). Raises ClientDisconnected.
+    """
+    event = threading.Event()
+    token = current_cancel_event.set(event)
+    try:
+        # The task copies the context here, so everything it starts sees this event
+        task = asyncio.ensure_future(factory())
+    finally:
+        current_cancel_event.reset(token)
+
+    started = time.monotonic()
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_SECONDS)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                break
+    finally:
+        if not task.done():
+            event.set()
+            task.cancel()
+            # Let it unwind (closing images, releasing reservations) before the request ends
+            await asyncio.gather(task, return_exceptions=True)
+
+    wasted_work["disconnects"] += 1
+    wasted_work["cancelled_work_ms"] += round((time.monotonic() - started) * 1000)
+    raise ClientDisconnected("Client disconnected before the response was ready")
+
+
+async def gather_or_cancel(*aws):
+    """
+    asyncio.gather that cancels the rest once one awaitable raises.
+
+    Plain gather leaves the siblings running, still holding memory
+    reservations and upstream slots, for a result nobody will read.
+    """
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+def cancellation_stats() -> dict:
+    return {name: wasted_work[name] for name in
+            ("disconnects", "cancelled_work_ms", "cancelled_banners", "fal_queue_cancelled", "stopped_in_thread")}
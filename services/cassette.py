@@ -0,0 +1,182 @@
+import os
+import asyncio
+import gzip
+import hashlib
+import json
+import threading
+import time
+from collections import Counter, defaultdict
+from types import SimpleNamespace
+from typing import Awaitable, Callable
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# off, record or replay
+UPSTREAM_CASSETTE_MODE = os.getenv("UPSTREAM_CASSETTE_MODE", "off").lower()
+UPSTREAM_CASSETTE_PATH = os.getenv("UPSTREAM_CASSETTE_PATH", "cassettes/upstream.jsonl.gz")
+# How replayed exchanges are paced: original, scaled (by UPSTREAM_REPLAY_TIME_SCALE) or none
+UPSTREAM_REPLAY_TIMING = os.getenv("UPSTREAM_REPLAY_TIMING", "original").lower()
+UPSTREAM_REPLAY_TIME_SCALE = float(os.getenv("UPSTREAM_REPLAY_TIME_SCALE", "1.0"))
+
+CASSETTE_MODES = ("off", "record", "replay")
+REPLAY_TIMINGS = ("original", "scaled", "none")
+# Assistant stream callbacks captured and replayed, in the order the SDK fires them
+STREAM_EVENTS = ("on_text_created", "on_text_delta", "on_message_done")
+
+
+class CassetteMiss(Exception):
+    """Replay was asked for an exchange the cassette doesn't contain"""
+
+
+def exchange_key(kind: str, request) -> str:
+    """Requests match on their content; credentials live in headers and are never part of it"""
+    return hashlib.sha256(json.dumps([kind, request], sort_keys=True, default=str).encode()).hexdigest()
+
+
+class Cassette:
+    """
+    Records upstream exchanges to a gzipped JSONL file, or serves them back.
+
+    Each line holds one exchange: its kind, the hash of its request, how
+    long it took and the response (or, for Assistants streams, the text
+    events with their offsets). Replay matches on kind and request; when
+    the same request was recorded several times the responses are served
+    in recorded order, then cycle. A request that was never recorded raises
+    CassetteMiss rather than reaching the network.
+    """
+
+    def __init__(self, mode: str = "off", path: str = UPSTREAM_CASSETTE_PATH, timing: str = "original",
+                 time_scale: float = 1.0):
+        if mode not in CASSETTE_MODES:
+            raise ValueError(f"UPSTREAM_CASSETTE_MODE must be one of {', '.join(CASSETTE_MODES)}")
+        if timing not in REPLAY_TIMINGS:
+            raise ValueError(f"UPSTREAM_REPLAY_TIMING must be one of {', '.join(REPLAY_TIMINGS)}")
+        self.mode = mode
+        self.path = path
+        self.delay_factor = {"original": 1.0, "scaled": time_scale, "none": 0.0}[timing]
+        self._lock = threading.Lock()
+        self._exchanges = defaultdict(list)
+        self._replay_positions = Counter()
+        self.counts = Counter()
+        if mode == "replay":
+            self._load()
+        elif mode == "record" and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off"
+
+    def _load(self):
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    exchange = json.loads(line)
+                    self._exchanges[exchange["key"]].append(exchange)
+
+    def _append(self, exchange: dict):
+        line = json.dumps(exchange, separators=(",", ":")) + "\n"
+        with self._lock:
+            # Each append is its own gzip member; readers see one continuous stream
+            with gzip.open(self.path, "at", encoding="utf-8") as f:
+                f.write(line)
+            self.counts["recorded"] += 1
+
+    def _next(self, key: str, kind: str) -> dict:
+        with self._lock:
+            recorded = self._exchanges.get(key)
+            if not recorded:
+                self.counts["misses"] += 1
+                raise CassetteMiss(f"No recorded {kind} exchange matches this request")
+            position = self._replay_positions[key]
+            self._replay_positions[key] += 1
+            self.counts["replayed"] += 1
+            return recorded[position % len(recorded)]
+
+    def call(self, kind: str, request, factory: Callable[[], object],
+             encode: Callable = lambda value: value, decode: Callable = lambda data: data):
+        """
+        Blocking upstream call through the cassette.
+
+        encode turns the result into JSON for recording (SDK objects need
+        this); decode rebuilds what callers expect from the recorded JSON.
+        """
+        key = exchange_key(kind, request)
+        if self.mode == "replay":
+            exchange = self._next(key, kind)
+            time.sleep(exchange["elapsed"] * self.delay_factor)
+            return decode(exchange["response"])
+
+        started = time.monotonic()
+        result = factory()
+        if self.mode == "record":
+            self._append({"kind": kind, "key": key, "elapsed": round(time.monotonic() - started, 4),
+                          "response": encode(result)})
+        return result
+
+    async def call_async(self, kind: str, request, factory: Callable[[], Awaitable[object]]):
+        key = exchange_key(kind, request)
+        if self.mode == "replay":
+            exchange = self._next(key, kind)
+            await asyncio.sleep(exchange["elapsed"] * self.delay_factor)
+            return exchange["response"]
+
+        started = time.monotonic()
+        result = await factory()
+        if self.mode == "record":
+            self._append({"kind": kind, "key": key, "elapsed": round(time.monotonic() - started, 4),
+                          "response": result})
+        return result
+
+    def stream(self, kind: str, request, handler, run: Callable[[], None]):
+        """
+        Run an Assistants stream into handler, capturing or replaying its text events.
+
+        Replay calls the handler's on_text_created / on_text_delta /
+        on_message_done in the recorded order and rhythm, so the handler's
+        own parsing runs exactly as it would live.
+        """
+        key = exchange_key(kind, request)
+        if self.mode == "replay":
+            exchange = self._next(key, kind)
+            previous = 0.0
+            for offset, event, value in exchange["events"]:
+                time.sleep((offset - previous) * self.delay_factor)
+                previous = offset
+                if event == "on_text_delta":
+                    handler.on_text_delta(SimpleNamespace(value=value), None)
+                else:
+                    # The handlers here don't look at the text/message objects these carry
+                    getattr(handler, event)(None)
+            return
+
+        if self.mode != "record":
+            run()
+            return
+
+        started = time.monotonic()
+        events = []
+        for event in STREAM_EVENTS:
+            original = getattr(handler, event)
+
+            def capture(*args, _event=event, _original=original):
+                value = args[0].value if _event == "on_text_delta" else None
+                events.append([round(time.monotonic() - started, 4), _event, value])
+                return _original(*args)
+
+            # The SDK dispatches through the instance, so shadowing the bound method is enough
+            setattr(handler, event, capture)
+        run()
+        self._append({"kind": kind, "key": key, "elapsed": round(time.monotonic() - started, 4), "events": events})
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "path": self.path if self.enabled else None,
+            **{name: self.counts[name] for name in ("recorded", "replayed", "misses")},
+        }
+
+
+cassette = Cassette(UPSTREAM_CASSETTE_MODE, UPSTREAM_CASSETTE_PATH, UPSTREAM_REPLAY_TIMING, UPSTREAM_REPLAY_TIME_SCALE)
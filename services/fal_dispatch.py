@@ -0,0 +1,117 @@
+import os
+import asyncio
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+from typing import Hashable, List, Optional
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# FAL generations in flight at once across the process; 0 disables dispatching
+FAL_DISPATCH_CONCURRENCY = int(os.getenv("FAL_DISPATCH_CONCURRENCY", "8"))
+# Longest a queued generation waits while other adapters' requests are preferred
+FAL_AFFINITY_WINDOW_MS = float(os.getenv("FAL_AFFINITY_WINDOW_MS", "2000"))
+
+
+def affinity_key(model: str, loras: Optional[list]) -> tuple:
+    """(base model, LoRA set): generations sharing it run without an adapter swap"""
+    return model, tuple(sorted(lora["path"] for lora in loras or []))
+
+
+class _Waiter:
+    __slots__ = ("key", "future", "enqueued_at")
+
+    def __init__(self, key: Hashable, future: asyncio.Future):
+        self.key = key
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+
+class AffinityDispatcher:
+    """
+    Concurrency limit for FAL calls that groups queued work by adapter.
+
+    A call starts at once while a slot is free. Once calls queue, each
+    freed slot goes to the oldest waiter with the same affinity key as the
+    last dispatched call, so same-adapter work runs back to back instead of
+    interleaving. Starvation is bounded: once the oldest waiter has queued
+    for FAL_AFFINITY_WINDOW_MS it goes next, whatever its key.
+    """
+
+    def __init__(self, concurrency: int = FAL_DISPATCH_CONCURRENCY, window_ms: float = FAL_AFFINITY_WINDOW_MS):
+        self.concurrency = concurrency
+        self.window = window_ms / 1000
+        self.active = 0
+        self.current_key: Optional[Hashable] = None
+        self._queue: List[_Waiter] = []
+        self.counts = Counter()
+        self.max_wait = 0.0
+
+    @asynccontextmanager
+    async def slot(self, key: Hashable):
+        if not self.concurrency:
+            yield
+            return
+        if self.active < self.concurrency and not self._queue:
+            self._start(key, 0.0)
+        else:
+            waiter = _Waiter(key, asyncio.get_running_loop().create_future())
+            self._queue.append(waiter)
+            try:
+                await waiter.future
+            except asyncio.CancelledError:
+                if waiter in self._queue:
+                    self._queue.remove(waiter)
+                elif waiter.future.done() and not waiter.future.cancelled():
+                    # Granted a slot just as we were cancelled; hand it on
+                    self._release()
+                raise
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _start(self, key: Hashable, waited: float):
+        self.active += 1
+        self.counts["dispatched"] += 1
+        if self.current_key is not None and key != self.current_key:
+            self.counts["adapter_switches"] += 1
+        self.current_key = key
+        self.max_wait = max(self.max_wait, waited)
+
+    def _pick(self) -> _Waiter:
+        oldest = self._queue[0]
+        same_key = next((waiter for waiter in self._queue if waiter.key == self.current_key), None)
+        if same_key is None or same_key is oldest:
+            return oldest
+        if time.monotonic() - oldest.enqueued_at >= self.window:
+            self.counts["starvation_overrides"] += 1
+            return oldest
+        self.counts["affinity_reorders"] += 1
+        return same_key
+
+    def _release(self):
+        self.active -= 1
+        while self.active < self.concurrency and self._queue:
+            waiter = self._pick()
+            self._queue.remove(waiter)
+            if waiter.future.done():
+                # Cancelled while queued; its task hasn't resumed to remove it yet
+                continue
+            self._start(waiter.key, time.monotonic() - waiter.enqueued_at)
+            waiter.future.set_result(None)
+
+    def stats(self) -> dict:
+        return {
+            "concurrency": self.concurrency,
+            "active": self.active,
+            "queued": len(self._queue),
+            "max_wait_ms": round(self.max_wait * 1000, 1),
+            **{name: self.counts[name] for name in
+               ("dispatched", "adapter_switches", "affinity_reorders", "starvation_overrides")},
+        }
+
+
+fal_dispatcher = AffinityDispatcher()
@@ -1,7 +1,17 @@
 import os
+import asyncio
+import base64
+import hashlib
+import json
+import time
 from dotenv import load_dotenv
 from typing import List, Optional
 import aiohttp
+from services.disk_cache import DiskLRUCache
+from services.upstream import DeadlineExceeded, post_json
+from services.model_router import breaker_for, route
+from services.fal_dispatch import affinity_key, fal_dispatcher
+from services.product_models import product_models
 
 # Load environment variables from .env file
 load_dotenv()
@@ -9,31 +19,63 @@ load_dotenv()
 # Get the FAL API key from environment variables
 FAL_KEY = os.getenv("FAL_KEY")
 
-# Add this dictionary at the beginning of the file, after the imports and environment variable loading
-
-PRODUCT_MODELS = {
-    "Coca Cola": {
-        "base_model": "fal-ai/flux/dev",
-        "loras": None
-    },
-    "Nike": {
-        "base_model": "fal-ai/flux/dev",
-        "loras": None
-    },
-    "Cadbury": {
-        "base_model": "fal-ai/flux/dev",
-        "loras": None
-    },
-    "MyWoodCup": {
-        "base_model": "fal-ai/flux-lora",
-        "loras": [
-            {
-                "path": "https://storage.googleapis.com/fal-flux-lora/e9bc640224d24ceeb577d4c356ee5b22_lora.safetensors",
-                "scale": 1
-            }
-        ]
+# Seeded generations are deterministic, so their results are cached on disk
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", "image_cache")
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+image_cache = DiskLRUCache(IMAGE_CACHE_DIR, IMAGE_CACHE_MAX_BYTES, suffix=".img")
+
+def _image_cache_key(model_name: str, arguments: dict) -> str:
+    key_fields = {
+        "model": model_name,
+        "loras": arguments.get("loras"),
+        "prompt": arguments["prompt"],
+        "image_size": arguments["image_size"],
+        "num_inference_steps": arguments["num_inference_steps"],
+        "guidance_scale": arguments["guidance_scale"],
+        "seed": arguments["seed"],
+        # These change the returned bytes, so they are part of the key too
+        "num_images": arguments["num_images"],
+        "output_format": arguments["output_format"],
+        "enable_safety_checker": arguments["enable_safety_checker"],
     }
-}
+    return hashlib.sha256(json.dumps(key_fields, sort_keys=True).encode()).hexdigest()
+
+def _pack_result(result: dict) -> bytes:
+    """Store image bytes raw after a JSON header instead of as base64 text"""
+    blobs = []
+    images = []
+    for image in result['images']:
+        raw = base64.b64decode(image['content'])
+        meta = {k: v for k, v in image.items() if k not in ('content', 'url')}
+        meta['length'] = len(raw)
+        meta['data_uri'] = image.get('url', '').startswith('data:image/')
+        if not meta['data_uri'] and 'url' in image:
+            meta['url'] = image['url']
+        images.append(meta)
+        blobs.append(raw)
+    header = dict(result, images=images)
+    return json.dumps(header).encode() + b"\n" + b"".join(blobs)
+
+def _unpack_result(data: bytes) -> dict:
+    header_bytes, _, body = data.partition(b"\n")
+    result = json.loads(header_bytes)
+    offset = 0
+    for image in result['images']:
+        length = image.pop('length')
+        content = base64.b64encode(body[offset:offset + length]).decode()
+        offset += length
+        image['content'] = content
+        if image.pop('data_uri'):
+            image['url'] = f"data:{image.get('content_type', 'image/jpeg')};base64,{content}"
+    result['cache_hit'] = True
+    return result
+
+def cached_image(cache_key: str) -> Optional[dict]:
+    """A stored generation by the cache_key generate_image returned, or None once evicted; reads disk, so run it in a thread"""
+    data = image_cache.get(cache_key)
+    if data is None:
+        return None
+    return dict(_unpack_result(data), cache_key=cache_key)
 
 async def generate_image(
     session: aiohttp.ClientSession,
@@ -45,7 +87,8 @@ async def generate_image(
     guidance_scale: float = 3.5,
     num_images: int = 1,
     enable_safety_checker: bool = True,
-    output_format: str = "jpeg"
+    output_format: str = "jpeg",
+    quality_tier: Optional[str] = None
 ) -> dict:
     # Map custom sizes to FAL API accepted values
     size_mapping = {
@@ -69,46 +112,102 @@ async def generate_image(
         "sync_mode": True
     }
 
-    product_config = PRODUCT_MODELS.get(product_name, {
-        "base_model": "fal-ai/flux-lora",
-        "loras": None
-    })
+    product_config = product_models.get(product_name)
+
+    # Pick the model for the requested quality tier, degrading past tripped breakers
+    routed = route(
+        quality_tier,
+        bool(product_config["loras"]),
+        product_config["base_model"],
+        num_inference_steps,
+        guidance_scale
+    )
+    if routed is None:
+        return {"error": "All image models for this quality tier are currently unavailable"}
+    tier_used, modelName, arguments["num_inference_steps"], arguments["guidance_scale"] = routed
+    if tier_used != (quality_tier or "standard"):
+        print(f"Quality tier degraded from {quality_tier or 'standard'} to {tier_used}")
 
-    modelName = product_config["base_model"]
     if seed is not None:
         arguments["seed"] = seed
     if product_config["loras"]:
         arguments["loras"] = product_config["loras"]
 
+    breaker = breaker_for(modelName)
+    # route() just let this call through; while half-open that means it holds the breaker's only probe
+    holds_probe = breaker.state == "half_open"
+    recorded = False
+    try:
+        cache_key = None
+        if seed is not None:
+            cache_key = _image_cache_key(modelName, arguments)
+            cached = await asyncio.to_thread(image_cache.get, cache_key)
+            if cached is not None:
+                print(f"Image cache hit for seed {seed}")
+                return dict(_unpack_result(cached), cache_key=cache_key, quality_tier=tier_used, model=modelName)
+
+        started = time.monotonic()
+        try:
+            # Queued behind other generations, same-adapter ones first
+            async with fal_dispatcher.slot(affinity_key(modelName, arguments.get("loras"))):
+                started = time.monotonic()
+                status, result = await post_json(
+                    session,
+                    "fal",
+                    f"https://fal.run/{modelName}",
+                    headers={"Authorization": f"Key {FAL_KEY}"},
+                    json_body=arguments
+                )
+        except DeadlineExceeded:
+            # Our own budget ran out; that says nothing about the model's health
+            raise
+        except Exception as e:
+            breaker.record(False, time.monotonic() - started)
+            recorded = True
+            print(f"Error in generate_image: {str(e)}")
+            return {"error": str(e)}
+
+        breaker.record(status == 200, time.monotonic() - started)
+        recorded = True
+        print(f"FAL API response status: {status}")
+    finally:
+        if holds_probe and not recorded:
+            # A cache hit, our own deadline or a cancelled request never tested the model;
+            # free the probe so the next call can, instead of leaving the breaker half-open
+            breaker.release()
+
     try:
-        async with session.post(
-            f"https://fal.run/{modelName}",
-            headers={"Authorization": f"Key {FAL_KEY}"},
-            json=arguments
-        ) as response:
-            result = await response.json()
-            print(f"FAL API response status: {response.status}")
-
-            if response.status != 200:
-                error_message = result.get('detail', 'Unknown error occurred')
-                return {"error": f"FAL API returned status {response.status}: {error_message}"}
-
-            # Check the structure of the result
-            if 'images' not in result:
-                return {"error": f"FAL API response does not contain 'images' key. Full response: {result}"}
-
-            if not result['images']:
-                return {"error": f"FAL API returned empty 'images' list. Full response: {result}"}
-
-            image_data = result['images'][0].get('url', '')
-            if image_data.startswith('data:image/'):
-                # Extract the base64 part from the data URI
-                base64_data = image_data.split(',', 1)[1]
-                result['images'][0]['content'] = base64_data
-            elif 'content' not in result['images'][0]:
-                return {"error": f"FAL API response does not contain valid image data. Full response: {result}"}
-
-            return result
+        if status != 200:
+            error_message = result.get('detail', 'Unknown error occurred')
+            return {"error": f"FAL API returned status {status}: {error_message}"}
+
+        # Check the structure of the result
+        if 'images' not in result:
+            return {"error": f"FAL API response does not contain 'images' key. Full response: {result}"}
+
+        if not result['images']:
+            return {"error": f"FAL API returned empty 'images' list. Full response: {result}"}
+
+        image_data = result['images'][0].get('url', '')
+        if image_data.startswith('data:image/'):
+            # Extract the base64 part from the data URI
+            base64_data = image_data.split(',', 1)[1]
+            result['images'][0]['content'] = base64_data
+        elif 'content' not in result['images'][0]:
+            return {"error": f"FAL API response does not contain valid image data. Full response: {result}"}
+
+        if cache_key is not None and all('content' in image for image in result['images']):
+            try:
+                await asyncio.to_thread(image_cache.put, cache_key, _pack_result(result))
+                # Lets callers keep a reference to the stored result instead of the bytes
+                result['cache_key'] = cache_key
+            except Exception as e:
+                # The generation succeeded and is paid for; a cache miss later is the only cost
+                print(f"Error writing image cache entry: {str(e)}")
+
+        result['quality_tier'] = tier_used
+        result['model'] = modelName
+        return result
     except Exception as e:
         print(f"Error in generate_image: {str(e)}")
         return {"error": str(e)}
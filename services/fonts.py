@@ -0,0 +1,39 @@
+from functools import lru_cache
+from PIL import ImageFont
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Expanded font options
+FONT_PATHS = {
+    'arial': "arial.ttf",
+    'arial bold': "arialbd.ttf",
+    'times': "times.ttf",
+    'times new roman': "times.ttf",
+    'verdana': "verdana.ttf",
+    'comic': "comic.ttf",
+    'impact': "impact.ttf",
+    'georgia': "georgia.ttf",
+}
+
+DEFAULT_FONT_PATH = "arial.ttf"
+
+
+def resolve_font_path(font_name: str) -> str:
+    return FONT_PATHS.get(font_name.lower(), DEFAULT_FONT_PATH)
+
+
+@lru_cache(maxsize=256)
+def load_font(font_name: str, font_size: int):
+    """Load a TrueType font by its friendly name, falling back like create_text_image always has"""
+    try:
+        return ImageFont.truetype(resolve_font_path(font_name), font_size)
+    except IOError:
+        logger.warning(f"Font {font_name} not found. Using default font.")
+        try:
+            # Try to use a default TrueType font
+            return ImageFont.truetype(DEFAULT_FONT_PATH, font_size)
+        except IOError:
+            # If that fails, use Pillow's bundled font at the requested size
+            logger.warning("Default TrueType font not found. Using Pillow's default font.")
+            return ImageFont.load_default(font_size)
@@ -1,6 +1,7 @@
 import os
 from dotenv import load_dotenv
 import aiohttp
+from services.upstream import post_json
 
 # Load environment variables from .env file
 load_dotenv()
@@ -35,17 +36,19 @@ Theme or purpose of the image: {theme}
 
 Create a concise prompt that incorporates the theme in a minimalist style, suitable for a marketing banner background. Remember, do not include any text elements in the prompt."""
 
-    async with session.post(
+    _, result = await post_json(
+        session,
+        "openai",
         "https://api.openai.com/v1/chat/completions",
         headers={"Authorization": f"Bearer {openai_api_key}"},
-        json={
+        json_body={
             "model": "gpt-4o",
             "messages": [
                 {"role": "system", "content": system_message},
                 {"role": "user", "content": user_message}
             ]
-        }
-    ) as response:
-        result = await response.json()
-        print(result)
-        return result['choices'][0]['message']['content']
+        },
+        hedge=True
+    )
+    print(result)
+    return result['choices'][0]['message']['content']
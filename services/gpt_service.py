@@ -2,6 +2,7 @@ import os
 from dotenv import load_dotenv
 from typing import Literal
 import aiohttp
+from services.upstream import post_json
 
 # Load environment variables from .env file
 load_dotenv()
@@ -46,16 +47,18 @@ async def generate_image_prompt(
 
     Now, create a detailed prompt based on the provided inputs and specified layout, ensuring a strong emphasis on text display and graphic design elements."""
 
-    async with session.post(
+    _, result = await post_json(
+        session,
+        "openai",
         "https://api.openai.com/v1/chat/completions",
         headers={"Authorization": f"Bearer {openai_api_key}"},
-        json={
+        json_body={
             "model": "gpt-4o",
             "messages": [
                 {"role": "system", "content": system_message},
                 {"role": "user", "content": user_message}
             ]
-        }
-    ) as response:
-        result = await response.json()
-        return result['choices'][0]['message']['content']
+        },
+        hedge=True
+    )
+    return result['choices'][0]['message']['content']
@@ -0,0 +1,136 @@
+import os
+import asyncio
+import hashlib
+import json
+import time
+from collections import Counter, OrderedDict
+from typing import Awaitable, Callable, Tuple
+from dotenv import load_dotenv
+from services.response_service import ImagePart
+
+# Load environment variables from .env file
+load_dotenv()
+
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "3600"))
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "1000"))
+# Stored results hold the generated images, so bound them by size as well
+IDEMPOTENCY_MAX_BYTES = int(os.getenv("IDEMPOTENCY_MAX_BYTES", str(256 * 1024 * 1024)))
+MAX_KEY_LENGTH = 255
+
+
+class IdempotencyKeyReused(Exception):
+    """The key was already used for a request with a different body"""
+
+
+def request_fingerprint(*parts) -> str:
+    """Stable hash of the parts of a request that decide its result"""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _content_size(value) -> int:
+    if isinstance(value, ImagePart):
+        return len(value.data)
+    if isinstance(value, dict):
+        return sum(_content_size(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(_content_size(item) for item in value)
+    if isinstance(value, str):
+        return len(value)
+    return 8
+
+
+class _Entry:
+    __slots__ = ("fingerprint", "task", "content", "status_code", "size", "expires_at")
+
+    def __init__(self, fingerprint: str, task: asyncio.Task):
+        self.fingerprint = fingerprint
+        self.task = task
+        self.content = None
+        self.status_code = None
+        self.size = 0
+        self.expires_at = None
+
+
+class IdempotencyStore:
+    """
+    Runs each (scope, Idempotency-Key) once and remembers the outcome.
+
+    The first request starts the work as its own task, so it keeps running
+    if that client disconnects. Duplicates that arrive while it runs wait on
+    the same task, and those that arrive later (within the TTL) get the
+    stored result. Only results below 500 are stored; after a server error
+    or timeout the next retry runs the work again.
+    """
+
+    def __init__(self, ttl_seconds: float = IDEMPOTENCY_TTL_SECONDS, max_entries: int = IDEMPOTENCY_MAX_ENTRIES,
+                 max_bytes: int = IDEMPOTENCY_MAX_BYTES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[tuple, _Entry]" = OrderedDict()
+        self._bytes = 0
+        self.counts = Counter()
+
+    async def run(self, scope: str, key: str, fingerprint: str,
+                  factory: Callable[[], Awaitable[Tuple[object, int]]]) -> Tuple[object, int, bool]:
+        """(content, status_code, replayed) for the keyed request"""
+        self._expire()
+        entry_key = (scope, key)
+        entry = self._entries.get(entry_key)
+
+        if entry is not None:
+            if entry.fingerprint != fingerprint:
+                self.counts["mismatched"] += 1
+                raise IdempotencyKeyReused("Idempotency-Key was already used with a different request")
+            self._entries.move_to_end(entry_key)
+            if entry.task is None:
+                self.counts["replayed"] += 1
+                return entry.content, entry.status_code, True
+            self.counts["attached"] += 1
+            content, status_code = await asyncio.shield(entry.task)
+            return content, status_code, True
+
+        self.counts["executed"] += 1
+        entry = _Entry(fingerprint, asyncio.ensure_future(factory()))
+        self._entries[entry_key] = entry
+        entry.task.add_done_callback(lambda task: self._finish(entry_key, entry, task))
+        content, status_code = await asyncio.shield(entry.task)
+        return content, status_code, False
+
+    def _finish(self, entry_key, entry: _Entry, task: asyncio.Task):
+        if self._entries.get(entry_key) is not entry:
+            return
+        if task.cancelled() or task.exception() is not None or task.result()[1] >= 500:
+            del self._entries[entry_key]
+            return
+        entry.content, entry.status_code = task.result()
+        entry.task = None
+        entry.size = _content_size(entry.content)
+        entry.expires_at = time.monotonic() + self.ttl_seconds
+        self._bytes += entry.size
+        self._evict()
+
+    def _expire(self):
+        now = time.monotonic()
+        for entry_key in [k for k, e in self._entries.items() if e.expires_at is not None and e.expires_at <= now]:
+            self._bytes -= self._entries.pop(entry_key).size
+
+    def _evict(self):
+        """Drop the least recently used stored results; in-flight entries are never evicted"""
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            victim = next((k for k, e in self._entries.items() if e.task is None), None)
+            if victim is None:
+                return
+            self._bytes -= self._entries.pop(victim).size
+            self.counts["evicted"] += 1
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "in_flight": sum(1 for entry in self._entries.values() if entry.task is not None),
+            "bytes": self._bytes,
+            **{name: self.counts[name] for name in ("executed", "attached", "replayed", "mismatched", "evicted")},
+        }
+
+
+idempotency_store = IdempotencyStore()
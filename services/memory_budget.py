@@ -0,0 +1,195 @@
+import os
+import asyncio
+import time
+import tracemalloc
+from collections import Counter, deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Iterable, Optional, Tuple
+from dotenv import load_dotenv
+from services.upstream import remaining_budget
+from services.rendition_service import parse_rendition_size
+import logging
+
+# Load environment variables from .env file
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Image memory all in-flight banners may hold at once; 0 disables admission control
+MEMORY_BUDGET_BYTES = int(os.getenv("MEMORY_BUDGET_BYTES", str(1024 * 1024 * 1024)))
+# How long work may queue for memory before it's rejected
+MEMORY_ADMISSION_WAIT_SECONDS = float(os.getenv("MEMORY_ADMISSION_WAIT_SECONDS", "10"))
+# Per-stage allocation reporting via tracemalloc; slows everything down, so diagnostics only
+MEMORY_PROFILING = os.getenv("MEMORY_PROFILING", "false").lower() in ("1", "true", "yes")
+
+# Bytes held per background pixel at a banner's peak: the decoded RGB canvas (3),
+# the RGBA text layer (4), the compressed background and its base64 form,
+# and the composite PNG buffer (~5 together for photographic content)
+BANNER_BYTES_PER_PIXEL = 12
+# A rendition holds its crop, resized canvas, text layer and PNG
+RENDITION_BYTES_PER_PIXEL = 14
+# Used when the size isn't one we can resolve to pixels
+FALLBACK_IMAGE_SIZE = (1024, 1024)
+
+if MEMORY_PROFILING:
+    tracemalloc.start()
+
+
+class MemoryBudgetExceeded(Exception):
+    pass
+
+
+def estimate_banner_bytes(image_size: Tuple[int, int], rendition_sizes: Iterable[Tuple[int, int]] = ()) -> int:
+    """Peak memory of one generate_banner call"""
+    estimate = image_size[0] * image_size[1] * BANNER_BYTES_PER_PIXEL
+    for width, height in rendition_sizes:
+        estimate += width * height * RENDITION_BYTES_PER_PIXEL
+    return estimate
+
+
+def _pixels_of(size_name: str) -> Tuple[int, int]:
+    try:
+        return parse_rendition_size(size_name)
+    except ValueError:
+        return FALLBACK_IMAGE_SIZE
+
+
+def estimate_request_bytes(image_size: str, renditions: Optional[Iterable[str]] = None, banner_count: int = 1) -> int:
+    """Peak memory of banner_count banners of a request's sizes, all in flight at once"""
+    per_banner = estimate_banner_bytes(_pixels_of(image_size), [_pixels_of(name) for name in renditions or []])
+    return per_banner * banner_count
+
+
+class MemoryAdmission:
+    """
+    Reserve estimated memory before starting work, within a global budget.
+
+    Reservations that fit start immediately; others wait in a FIFO queue
+    until enough is released (a later, smaller reservation never jumps a
+    queued larger one), and give up with MemoryBudgetExceeded after
+    MEMORY_ADMISSION_WAIT_SECONDS (or when the request deadline runs out).
+    A reservation larger than the whole budget is rejected straight away.
+    """
+
+    def __init__(self, budget_bytes: int):
+        self.budget_bytes = budget_bytes
+        self.reserved = 0
+        self.peak_reserved = 0
+        # (nbytes, future) per queued reservation, oldest first
+        self._waiters = deque()
+        self.counts = Counter()
+
+    @asynccontextmanager
+    async def reserve(self, nbytes: int):
+        if not self.budget_bytes:
+            yield
+            return
+        self.check(nbytes)
+
+        if not self._waiters and self.reserved + nbytes <= self.budget_bytes:
+            self._admit(nbytes)
+        else:
+            # Queue even if it would fit, so a large reservation isn't starved by smaller later ones
+            self.counts["queued"] += 1
+            waiter = (nbytes, asyncio.get_running_loop().create_future())
+            self._waiters.append(waiter)
+            wait = MEMORY_ADMISSION_WAIT_SECONDS
+            remaining = remaining_budget()
+            if remaining is not None:
+                wait = min(wait, remaining)
+            try:
+                await asyncio.wait_for(waiter[1], timeout=wait)
+            except BaseException as e:
+                if waiter[1].done() and not waiter[1].cancelled():
+                    # Admitted just as we gave up; hand the bytes back
+                    self._release(nbytes)
+                else:
+                    self._waiters.remove(waiter)
+                    # Whoever queued behind us may fit now
+                    self._admit_waiters()
+                if isinstance(e, asyncio.TimeoutError):
+                    self.counts["rejected"] += 1
+                    raise MemoryBudgetExceeded("Server is at its memory budget; try again shortly")
+                raise
+
+        try:
+            yield
+        finally:
+            self._release(nbytes)
+
+    def _admit(self, nbytes: int):
+        self.reserved += nbytes
+        self.peak_reserved = max(self.peak_reserved, self.reserved)
+        self.counts["admitted"] += 1
+
+    def _admit_waiters(self):
+        while self._waiters and self.reserved + self._waiters[0][0] <= self.budget_bytes:
+            nbytes, future = self._waiters.popleft()
+            self._admit(nbytes)
+            future.set_result(None)
+
+    def _release(self, nbytes: int):
+        self.reserved -= nbytes
+        self._admit_waiters()
+
+    def check(self, nbytes: int):
+        """Reject up front work that could never fit, before any upstream calls are spent on it"""
+        if self.budget_bytes and nbytes > self.budget_bytes:
+            self.counts["rejected"] += 1
+            raise MemoryBudgetExceeded(
+                f"Request needs an estimated {nbytes} bytes, more than the {self.budget_bytes} byte memory budget"
+            )
+
+    def stats(self) -> dict:
+        return {
+            "budget_bytes": self.budget_bytes,
+            "reserved_bytes": self.reserved,
+            "peak_reserved_bytes": self.peak_reserved,
+            "admitted": self.counts["admitted"],
+            "queued": self.counts["queued"],
+            "rejected": self.counts["rejected"],
+        }
+
+
+admission = MemoryAdmission(MEMORY_BUDGET_BYTES)
+
+stage_stats = {}
+
+
+@contextmanager
+def memory_stage(name: str):
+    """
+    Record the peak traced allocation of a pipeline stage when MEMORY_PROFILING is on.
+
+    tracemalloc's peak is process-wide, so concurrent requests inflate each
+    other's numbers; profile with one request at a time for exact figures.
+    Pillow allocates pixel buffers outside the Python allocator, so these
+    cover the bytes/str copies (base64, encoded buffers), not decoded canvases.
+    """
+    if not MEMORY_PROFILING:
+        yield
+        return
+    start, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        current, peak = tracemalloc.get_traced_memory()
+        stats = stage_stats.setdefault(name, {"calls": 0, "max_peak_bytes": 0, "last_peak_bytes": 0,
+                                              "last_retained_bytes": 0, "last_ms": 0.0})
+        stats["calls"] += 1
+        stats["last_peak_bytes"] = peak - start
+        stats["max_peak_bytes"] = max(stats["max_peak_bytes"], peak - start)
+        stats["last_retained_bytes"] = current - start
+        stats["last_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        logger.debug(f"Memory stage {name}: peak +{peak - start} bytes, retained +{current - start} bytes")
+
+
+def memory_stats() -> dict:
+    stats = {"admission": admission.stats(), "profiling": MEMORY_PROFILING}
+    if MEMORY_PROFILING:
+        current, _ = tracemalloc.get_traced_memory()
+        stats["traced_bytes"] = current
+        stats["stages"] = stage_stats
+    return stats
@@ -0,0 +1,178 @@
+import os
+import json
+import time
+from collections import deque
+from typing import List, Optional, Tuple
+from dotenv import load_dotenv
+import logging
+
+# Load environment variables from .env file
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Fastest first; a tripped tier degrades to the one before it
+TIER_ORDER = ["draft", "standard", "premium"]
+
+# Products with LoRA weights need a LoRA-capable model, and fal-ai/flux-lora is the only one
+# by default, so every tier shares one breaker: while it is open LoRA generations fail fast
+# instead of degrading. Point a tier's lora_model elsewhere (QUALITY_TIERS_FILE) to give them a fallback.
+DEFAULT_QUALITY_TIERS = {
+    "draft": {
+        "model": "fal-ai/flux/schnell",
+        "lora_model": "fal-ai/flux-lora",
+        "num_inference_steps": 4,
+        "lora_num_inference_steps": 12,
+        "guidance_scale": 3.5,
+    },
+    "standard": {
+        "model": "fal-ai/flux/dev",
+        "lora_model": "fal-ai/flux-lora",
+        "num_inference_steps": 28,
+        "lora_num_inference_steps": 28,
+        "guidance_scale": 3.5,
+    },
+    "premium": {
+        "model": "fal-ai/flux-pro/v1.1",
+        "lora_model": "fal-ai/flux-lora",
+        "num_inference_steps": 40,
+        "lora_num_inference_steps": 40,
+        "guidance_scale": 3.5,
+    },
+}
+
+# JSON file with the same shape as DEFAULT_QUALITY_TIERS; tiers it defines replace the defaults
+QUALITY_TIERS_FILE = os.getenv("QUALITY_TIERS_FILE")
+
+BREAKER_WINDOW = int(os.getenv("BREAKER_WINDOW", "20"))
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "5"))
+BREAKER_ERROR_RATE = float(os.getenv("BREAKER_ERROR_RATE", "0.5"))
+# Calls slower than this count as failures
+BREAKER_SLOW_CALL_SECONDS = float(os.getenv("BREAKER_SLOW_CALL_SECONDS", "60"))
+BREAKER_COOLDOWN_SECONDS = float(os.getenv("BREAKER_COOLDOWN_SECONDS", "30"))
+
+
+def load_quality_tiers() -> dict:
+    tiers = {name: dict(config) for name, config in DEFAULT_QUALITY_TIERS.items()}
+    if QUALITY_TIERS_FILE:
+        with open(QUALITY_TIERS_FILE) as f:
+            overrides = json.load(f)
+        for name, config in overrides.items():
+            if name not in TIER_ORDER:
+                raise ValueError(f"Unknown quality tier '{name}' in {QUALITY_TIERS_FILE}")
+            tiers[name].update(config)
+    return tiers
+
+
+QUALITY_TIERS = load_quality_tiers()
+
+
+class CircuitBreaker:
+    """
+    Closed -> open when the recent error (or slow call) rate is too high.
+
+    After the cooldown a single probe call is let through (half-open); its
+    outcome closes the breaker again or restarts the cooldown.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.outcomes = deque(maxlen=BREAKER_WINDOW)
+        self.state = "closed"
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.trips = 0
+
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open" and time.monotonic() - self.opened_at >= BREAKER_COOLDOWN_SECONDS:
+            self.state = "half_open"
+            self.probe_in_flight = False
+        if self.state == "half_open" and not self.probe_in_flight:
+            self.probe_in_flight = True
+            return True
+        return False
+
+    def record(self, success: bool, latency: float):
+        failed = not success or latency > BREAKER_SLOW_CALL_SECONDS
+        if self.state == "half_open":
+            self.probe_in_flight = False
+            if failed:
+                self._trip()
+            else:
+                self.state = "closed"
+                self.outcomes.clear()
+            return
+
+        self.outcomes.append(failed)
+        if len(self.outcomes) >= BREAKER_MIN_CALLS:
+            if sum(self.outcomes) / len(self.outcomes) >= BREAKER_ERROR_RATE:
+                self._trip()
+
+    def release(self):
+        """Give up a half-open probe slot without recording an outcome"""
+        if self.state == "half_open":
+            self.probe_in_flight = False
+
+    def _trip(self):
+        logger.warning(f"Circuit breaker for {self.name} opened")
+        self.state = "open"
+        self.opened_at = time.monotonic()
+        self.trips += 1
+        self.outcomes.clear()
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "recent_failures": sum(self.outcomes),
+            "recent_calls": len(self.outcomes),
+            "trips": self.trips,
+        }
+
+
+breakers = {}
+
+
+def breaker_for(model: str) -> CircuitBreaker:
+    if model not in breakers:
+        breakers[model] = CircuitBreaker(model)
+    return breakers[model]
+
+
+def tier_settings(tier: str, has_loras: bool) -> Tuple[str, int, float]:
+    """(model, num_inference_steps, guidance_scale) for a tier"""
+    config = QUALITY_TIERS[tier]
+    if has_loras:
+        return config["lora_model"], config["lora_num_inference_steps"], config["guidance_scale"]
+    return config["model"], config["num_inference_steps"], config["guidance_scale"]
+
+
+def fallback_tiers(tier: str) -> List[str]:
+    """The requested tier followed by every faster tier, slowest first"""
+    if tier not in QUALITY_TIERS:
+        raise ValueError(f"Unknown quality tier '{tier}'. Use one of: {', '.join(TIER_ORDER)}")
+    return TIER_ORDER[:TIER_ORDER.index(tier) + 1][::-1]
+
+
+def route(requested_tier: Optional[str], has_loras: bool, default_model: str,
+          default_steps: int, default_guidance: float) -> Optional[Tuple[str, str, int, float]]:
+    """
+    Pick (tier, model, steps, guidance) for a generation.
+
+    Without an explicit tier the product's own model and the request's steps
+    stand in for "standard". Tiers whose breaker is open are skipped in
+    favor of the next faster one. Returns None when every candidate is open.
+    """
+    for tier in fallback_tiers(requested_tier or "standard"):
+        if requested_tier is None and tier == "standard":
+            model, steps, guidance = default_model, default_steps, default_guidance
+        else:
+            model, steps, guidance = tier_settings(tier, has_loras)
+        if breaker_for(model).allow():
+            return tier, model, steps, guidance
+    return None
+
+
+def router_stats() -> dict:
+    return {model: breaker.stats() for model, breaker in breakers.items()}
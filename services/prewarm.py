@@ -0,0 +1,189 @@
+import os
+import asyncio
+import dataclasses
+import math
+import time
+from collections import Counter, OrderedDict, deque
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Dict, List, Optional
+from dotenv import load_dotenv
+from services.theme_index import normalize_theme, theme_index
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Speculative generation spends upstream quota on requests nobody has made yet, so it's opt-in
+PREWARM_ENABLED = os.getenv("PREWARM_ENABLED", "false").lower() in ("1", "true", "yes")
+# How many of the hottest request profiles to keep warm
+PREWARM_TOP_K = int(os.getenv("PREWARM_TOP_K", "5"))
+# Decayed request count a profile needs before it's worth warming
+PREWARM_MIN_SCORE = float(os.getenv("PREWARM_MIN_SCORE", "3"))
+# Requests count half as much after this long
+PREWARM_HALF_LIFE_SECONDS = float(os.getenv("PREWARM_HALF_LIFE_SECONDS", "3600"))
+# Warm only after this long with no requests in flight
+PREWARM_IDLE_SECONDS = float(os.getenv("PREWARM_IDLE_SECONDS", "30"))
+PREWARM_INTERVAL_SECONDS = float(os.getenv("PREWARM_INTERVAL_SECONDS", "15"))
+# Upstream calls (prompt, background, text properties) the warmer may make per rolling hour
+PREWARM_MAX_CALLS_PER_HOUR = int(os.getenv("PREWARM_MAX_CALLS_PER_HOUR", "30"))
+# Warmed backgrounds held at once; the coldest is dropped to make room
+PREWARM_MAX_ENTRIES = int(os.getenv("PREWARM_MAX_ENTRIES", "20"))
+PREWARM_MAX_TRACKED = 1000
+
+
+class _Profile:
+    __slots__ = ("score", "updated_at", "ad_request")
+
+    def __init__(self, ad_request):
+        self.score = 0.0
+        self.updated_at = time.monotonic()
+        self.ad_request = ad_request
+
+    def decayed(self, now: float) -> float:
+        return self.score * math.exp(-(now - self.updated_at) * math.log(2) / PREWARM_HALF_LIFE_SECONDS)
+
+
+class Prewarmer:
+    """
+    Pre-generates the upstream results hot requests will need, while the server is idle.
+
+    Every banner request is recorded under its profile: the theme plus the
+    settings that decide whether a background can be reused (see
+    background_cache_key). When nothing has been in flight for
+    PREWARM_IDLE_SECONDS, the warmer takes the top-K profiles by decayed
+    frequency, asks the missing callback which of their inputs (prompt,
+    background, text properties) a request would still have to generate,
+    and runs the warm callback for those alone. Work stops as soon as a
+    request arrives, and stays within PREWARM_MAX_CALLS_PER_HOUR, one call
+    per missing input.
+    """
+
+    def __init__(self):
+        self._profiles: Dict[tuple, _Profile] = {}
+        # (theme, background key) -> when it was warmed, oldest first
+        self._pool: "OrderedDict[tuple, float]" = OrderedDict()
+        self._calls = deque()
+        self.in_flight = 0
+        self.last_busy = time.monotonic()
+        self.counts = Counter()
+
+    def record(self, ad_request, background_key: str):
+        """Count a request towards its profile's popularity"""
+        if not ad_request.reuse_similar_theme or not normalize_theme(ad_request.theme):
+            # These never read the theme index, so warming for them would be wasted
+            return
+        key = (normalize_theme(ad_request.theme), background_key)
+        now = time.monotonic()
+        profile = self._profiles.get(key)
+        if profile is None:
+            if len(self._profiles) >= PREWARM_MAX_TRACKED:
+                coldest = min(self._profiles, key=lambda k: self._profiles[k].decayed(now))
+                del self._profiles[coldest]
+            profile = self._profiles[key] = _Profile(ad_request)
+        profile.score = profile.decayed(now) + 1
+        profile.updated_at = now
+        # The latest request stands in for the profile, so the warm text matches what's being asked for
+        profile.ad_request = dataclasses.replace(ad_request)
+
+    def served(self, theme: str, background_key: str):
+        """A request reused a background; count it if the warmer made it"""
+        if (normalize_theme(theme), background_key) in self._pool:
+            self.counts["served"] += 1
+
+    @contextmanager
+    def busy(self):
+        """Mark a client request in flight; the warmer stays out of the way until it's done"""
+        self.in_flight += 1
+        self.last_busy = time.monotonic()
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self.last_busy = time.monotonic()
+
+    def idle(self) -> bool:
+        return self.in_flight == 0 and time.monotonic() - self.last_busy >= PREWARM_IDLE_SECONDS
+
+    def _calls_left(self) -> int:
+        cutoff = time.monotonic() - 3600
+        while self._calls and self._calls[0] < cutoff:
+            self._calls.popleft()
+        return PREWARM_MAX_CALLS_PER_HOUR - len(self._calls)
+
+    def candidates(self, missing: Callable[[object], List[str]]):
+        """(key, profile, missing inputs) for the hottest profiles above PREWARM_MIN_SCORE that lack any"""
+        now = time.monotonic()
+        ranked = sorted(self._profiles.items(), key=lambda item: item[1].decayed(now), reverse=True)
+        hot = [(key, profile) for key, profile in ranked[:PREWARM_TOP_K]
+               if profile.decayed(now) >= PREWARM_MIN_SCORE]
+        found = [(key, profile, missing(profile.ad_request)) for key, profile in hot]
+        return [(key, profile, inputs) for key, profile, inputs in found if inputs]
+
+    def _admit(self, key: tuple):
+        """Add a warmed entry to the pool, dropping the coldest ones past PREWARM_MAX_ENTRIES"""
+        # The theme index evicts on its own too; forget what it already dropped
+        for gone in [k for k in self._pool if not theme_index.has_background(*k)]:
+            del self._pool[gone]
+        now = time.monotonic()
+        self._pool[key] = now
+        while len(self._pool) > PREWARM_MAX_ENTRIES:
+            # Never the entry just paid for
+            coldest = min((k for k in self._pool if k != key),
+                          key=lambda k: self._profiles[k].decayed(now) if k in self._profiles else -1)
+            del self._pool[coldest]
+            theme_index.discard_background(*coldest)
+            self.counts["evicted"] += 1
+
+    async def warm_once(self, session, warm: Callable[[object, object, List[str]], Awaitable[None]],
+                        missing: Callable[[object], List[str]]) -> int:
+        """Warm as many candidates as idleness and budget allow; returns how many were warmed"""
+        warmed = 0
+        for key, profile, inputs in self.candidates(missing):
+            if not self.idle():
+                self.counts["yielded_to_traffic"] += 1
+                break
+            if self._calls_left() < len(inputs):
+                self.counts["over_budget"] += 1
+                break
+            now = time.monotonic()
+            self._calls.extend([now] * len(inputs))
+            try:
+                await warm(session, profile.ad_request, inputs)
+            except Exception as e:
+                self.counts["failed"] += 1
+                print(f"Prewarming theme '{profile.ad_request.theme}' failed: {str(e)}")
+                continue
+            if "background" in inputs:
+                self._admit(key)
+            self.counts["warmed"] += 1
+            warmed += 1
+            print(f"Prewarmed {', '.join(inputs)} for theme '{profile.ad_request.theme}' "
+                  f"({profile.ad_request.image_size})")
+        return warmed
+
+    async def run(self, session, warm: Callable[[object, object, List[str]], Awaitable[None]],
+                  missing: Callable[[object], List[str]]):
+        while True:
+            await asyncio.sleep(PREWARM_INTERVAL_SECONDS)
+            if self.idle():
+                await self.warm_once(session, warm, missing)
+
+    def start(self, session, warm: Callable[[object, object, List[str]], Awaitable[None]],
+              missing: Callable[[object], List[str]]) -> Optional[asyncio.Task]:
+        if not PREWARM_ENABLED:
+            return None
+        return asyncio.ensure_future(self.run(session, warm, missing))
+
+    def stats(self) -> dict:
+        return {
+            "enabled": PREWARM_ENABLED,
+            "tracked_profiles": len(self._profiles),
+            "warm_entries": len(self._pool),
+            "in_flight": self.in_flight,
+            "calls_last_hour": PREWARM_MAX_CALLS_PER_HOUR - self._calls_left(),
+            "max_calls_per_hour": PREWARM_MAX_CALLS_PER_HOUR,
+            **{name: self.counts[name] for name in
+               ("warmed", "served", "evicted", "failed", "over_budget", "yielded_to_traffic")},
+        }
+
+
+prewarmer = Prewarmer()
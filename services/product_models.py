@@ -0,0 +1,113 @@
+import os
+import json
+import threading
+import time
+from typing import Dict, Optional
+from dotenv import load_dotenv
+import logging
+
+# Load environment variables from .env file
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# The registry shipped with the repo, found wherever the server is started from
+DEFAULT_PRODUCT_MODELS_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                           "product_models.json")
+# JSON object of product name -> {"base_model": ..., "loras": [{"path": ..., "scale": ...}] or null}
+PRODUCT_MODELS_FILE = os.getenv("PRODUCT_MODELS_FILE") or DEFAULT_PRODUCT_MODELS_FILE
+# How often the file's mtime is checked; edits take effect within this many seconds
+PRODUCT_MODELS_RELOAD_SECONDS = float(os.getenv("PRODUCT_MODELS_RELOAD_SECONDS", "5"))
+
+# Products without an entry
+DEFAULT_PRODUCT_MODEL = {
+    "base_model": "fal-ai/flux-lora",
+    "loras": None
+}
+
+
+def validate_product_models(data) -> Dict[str, dict]:
+    if not isinstance(data, dict):
+        raise ValueError("Product models must be a JSON object keyed by product name")
+    for product, config in data.items():
+        if not isinstance(config, dict) or not isinstance(config.get("base_model"), str):
+            raise ValueError(f"Product '{product}' needs a base_model string")
+        loras = config.get("loras")
+        if loras is None:
+            continue
+        if not isinstance(loras, list) or not all(isinstance(lora, dict) and isinstance(lora.get("path"), str)
+                                                  for lora in loras):
+            raise ValueError(f"Product '{product}' loras must be null or a list of objects with a path")
+    return {product: {"base_model": config["base_model"], "loras": config.get("loras") or None}
+            for product, config in data.items()}
+
+
+class ProductModels:
+    """
+    The product -> model/LoRA registry, reloaded when its file changes.
+
+    A file that fails to parse or validate is logged and ignored; the last
+    good registry stays in use, so a bad edit can't take generation down.
+    A required file (one set through PRODUCT_MODELS_FILE) that doesn't exist
+    at startup raises instead, since every product would silently fall back
+    to the default model.
+    """
+
+    def __init__(self, path: str = PRODUCT_MODELS_FILE, reload_seconds: float = PRODUCT_MODELS_RELOAD_SECONDS,
+                 required: bool = bool(os.getenv("PRODUCT_MODELS_FILE"))):
+        if required and not os.path.exists(path):
+            raise FileNotFoundError(f"Product models file {path} (PRODUCT_MODELS_FILE) does not exist")
+        self.path = path
+        self.reload_seconds = reload_seconds
+        self._models: Dict[str, dict] = {}
+        self._mtime: Optional[float] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.loaded_at: Optional[float] = None
+        self.reloads = 0
+        self.last_error: Optional[str] = None
+        self._check()
+
+    def _check(self):
+        self._checked_at = time.monotonic()
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            if self._mtime is None and self.last_error is None:
+                self.last_error = f"{self.path} not found"
+                logger.warning(f"Product models file {self.path} not found; every product uses the default model")
+            return
+        if mtime == self._mtime:
+            return
+        self._mtime = mtime
+        try:
+            with open(self.path) as f:
+                models = validate_product_models(json.load(f))
+        except (OSError, ValueError) as e:
+            self.last_error = str(e)
+            logger.error(f"Ignoring invalid product models file {self.path}: {str(e)}")
+            return
+        self._models = models
+        self.loaded_at = time.time()
+        self.reloads += 1
+        self.last_error = None
+        logger.info(f"Loaded {len(models)} product models from {self.path}")
+
+    def get(self, product_name: str) -> dict:
+        if time.monotonic() - self._checked_at >= self.reload_seconds:
+            with self._lock:
+                if time.monotonic() - self._checked_at >= self.reload_seconds:
+                    self._check()
+        return self._models.get(product_name, DEFAULT_PRODUCT_MODEL)
+
+    def stats(self) -> dict:
+        return {
+            "path": self.path,
+            "products": len(self._models),
+            "loaded_at": self.loaded_at,
+            "reloads": self.reloads,
+            "last_error": self.last_error,
+        }
+
+
+product_models = ProductModels()
@@ -0,0 +1,196 @@
+import io
+import os
+import math
+from typing import List, Tuple
+import numpy as np
+from PIL import Image
+from services.text_generation_service import text_layer
+from services.text_layout import MIN_FONT_SIZE
+from services.text_placement_service import analyze_text_properties
+from services.response_service import ImagePart
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Pixel sizes for the FAL size names, plus the wide strip background/service.py targets
+RENDITION_SIZES = {
+    "landscape_4_3": (1024, 768),
+    "landscape_16_9": (1024, 576),
+    "square_hd": (1024, 1024),
+    "square": (512, 512),
+    "portrait_4_3": (768, 1024),
+    "portrait_16_9": (576, 1024),
+    "strip_2100x600": (2100, 600),
+}
+
+# Largest rendition side a request may ask for; each rendition is decoded and rendered in full
+RENDITION_MAX_SIDE = int(os.getenv("RENDITION_MAX_SIDE", "4096"))
+# Most renditions one banner may ask for
+MAX_RENDITIONS = 10
+
+SALIENCY_MAX_SIDE = 256
+# Small pull towards the center so flat images are cropped symmetrically
+CENTER_BIAS = 0.05
+
+
+def parse_rendition_size(name: str) -> Tuple[int, int]:
+    """Accept a known size name or an explicit WIDTHxHEIGHT"""
+    if name in RENDITION_SIZES:
+        return RENDITION_SIZES[name]
+    try:
+        width, height = (int(part) for part in name.lower().split("x"))
+    except ValueError:
+        raise ValueError(f"Unknown rendition size '{name}'")
+    if width <= 0 or height <= 0:
+        raise ValueError(f"Invalid rendition size '{name}'")
+    if width > RENDITION_MAX_SIDE or height > RENDITION_MAX_SIDE:
+        raise ValueError(f"Rendition size '{name}' is larger than {RENDITION_MAX_SIDE}px per side")
+    return width, height
+
+
+def validate_renditions(sizes) -> None:
+    """Reject a renditions list before any work is spent on it; raises ValueError"""
+    if sizes is None:
+        return
+    if not isinstance(sizes, list) or not all(isinstance(name, str) for name in sizes):
+        raise ValueError("'renditions' must be a list of size names")
+    if len(sizes) > MAX_RENDITIONS:
+        raise ValueError(f"At most {MAX_RENDITIONS} renditions can be requested")
+    for name in sizes:
+        parse_rendition_size(name)
+
+
+def saliency_map(image: Image.Image) -> np.ndarray:
+    """Edge strength plus distance from the mean color, on a downscaled copy"""
+    small = image.convert("RGB")
+    small.thumbnail((SALIENCY_MAX_SIDE, SALIENCY_MAX_SIDE), Image.BILINEAR)
+    rgb = np.asarray(small, dtype=np.float32)
+    gray = rgb.mean(axis=2)
+
+    edges = np.zeros_like(gray)
+    edges[:, 1:] += np.abs(np.diff(gray, axis=1))
+    edges[1:, :] += np.abs(np.diff(gray, axis=0))
+    color_distance = np.linalg.norm(rgb - rgb.reshape(-1, 3).mean(axis=0), axis=2)
+
+    saliency = edges / (edges.max() or 1.0) + color_distance / (color_distance.max() or 1.0)
+    return saliency
+
+
+def _best_window(profile: np.ndarray, window: int) -> int:
+    """Start index of the window with the largest summed saliency along one axis"""
+    if window >= len(profile):
+        return 0
+    cumulative = np.concatenate(([0.0], np.cumsum(profile)))
+    sums = cumulative[window:] - cumulative[:-window]
+    starts = np.arange(len(sums))
+    center = (len(profile) - window) / 2
+    distance = np.abs(starts - center) / max(len(profile), 1)
+    # Subtracted rather than scaled in, so it still decides between windows that all sum to zero
+    scores = sums - CENTER_BIAS * distance * (sums.max() or 1.0)
+    return int(np.argmax(scores))
+
+
+def saliency_crop_box(source_size: Tuple[int, int], target_size: Tuple[int, int],
+                      saliency: np.ndarray) -> Tuple[int, int, int, int]:
+    """Largest crop of the target aspect ratio that keeps the most salient content"""
+    width, height = source_size
+    target_ratio = target_size[0] / target_size[1]
+    scale_x = saliency.shape[1] / width
+    scale_y = saliency.shape[0] / height
+
+    if width / height > target_ratio:
+        crop_width = round(height * target_ratio)
+        start = _best_window(saliency.sum(axis=0), max(1, round(crop_width * scale_x)))
+        left = min(round(start / scale_x), width - crop_width)
+        return left, 0, left + crop_width, height
+    crop_height = round(width / target_ratio)
+    start = _best_window(saliency.sum(axis=1), max(1, round(crop_height * scale_y)))
+    top = min(round(start / scale_y), height - crop_height)
+    return 0, top, width, top + crop_height
+
+
+def _open_for_size(image_bytes: bytes, crop_box, target_size):
+    """
+    Decode the background, letting JPEG draft mode skip detail we'd discard anyway.
+
+    Returns the decoded image and the crop box rescaled to the decoded size.
+    """
+    image = Image.open(io.BytesIO(image_bytes))
+    full_width, full_height = image.size
+    if image.format == "JPEG":
+        crop_width = crop_box[2] - crop_box[0]
+        crop_height = crop_box[3] - crop_box[1]
+        scale = max(target_size[0] / crop_width, target_size[1] / crop_height)
+        if scale < 1:
+            image.draft("RGB", (math.ceil(full_width * scale), math.ceil(full_height * scale)))
+    image = image.convert("RGB")
+    factor_x = image.width / full_width
+    factor_y = image.height / full_height
+    box = (
+        round(crop_box[0] * factor_x), round(crop_box[1] * factor_y),
+        round(crop_box[2] * factor_x), round(crop_box[3] * factor_y),
+    )
+    return image, box
+
+
+def _resize(image: Image.Image, box, target_size) -> Image.Image:
+    cropped = image.crop(box)
+    # Integer reduce first is much cheaper than a large-ratio Lanczos pass
+    factor = min(cropped.width // target_size[0], cropped.height // target_size[1])
+    if factor >= 2:
+        cropped = cropped.reduce(factor)
+    if cropped.size != target_size:
+        cropped = cropped.resize(target_size, Image.LANCZOS)
+    return cropped
+
+
+def _properties_for_size(properties: dict, source_size, target_size) -> dict:
+    """Scale the font size with the canvas; the fit engine shrinks it further if needed"""
+    scale = min(target_size) / min(source_size)
+    adjusted = dict(properties)
+    adjusted['size'] = max(MIN_FONT_SIZE, round(int(properties['size']) * scale))
+    return adjusted
+
+
+def render_renditions(background_bytes: bytes, text: str, properties: dict, sizes: List[str],
+                      mode: str = "llm") -> List[dict]:
+    """
+    Produce every requested aspect ratio from one generated background.
+
+    Each rendition is cropped around the salient content, resampled and gets
+    its own text layout. With mode "local" the placement is re-analyzed for
+    every crop; otherwise the original properties are scaled to the new size.
+    """
+    with Image.open(io.BytesIO(background_bytes)) as probe:
+        source_size = probe.size
+        saliency = saliency_map(probe)
+
+    renditions = []
+    for name in sizes:
+        try:
+            target_size = parse_rendition_size(name)
+            crop_box = saliency_crop_box(source_size, target_size, saliency)
+            image, box = _open_for_size(background_bytes, crop_box, target_size)
+            rendition = _resize(image, box, target_size)
+            del image
+
+            if mode == "local":
+                rendition_properties = analyze_text_properties(rendition, text)
+            else:
+                rendition_properties = _properties_for_size(properties, source_size, target_size)
+            text_layer(text, rendition_properties, target_size).paste_onto(rendition)
+
+            buffered = io.BytesIO()
+            rendition.save(buffered, format="PNG")
+            renditions.append({
+                "size": name,
+                "width": target_size[0],
+                "height": target_size[1],
+                "crop_box": list(crop_box),
+                "text_overlay_properties": rendition_properties,
+                "image": ImagePart(buffered.getvalue(), "image/png"),
+            })
+        except Exception as e:
+            logger.error(f"Error rendering {name} rendition: {str(e)}")
+            renditions.append({"size": name, "error": str(e)})
+    return renditions
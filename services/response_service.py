@@ -0,0 +1,116 @@
+import base64
+import json
+import uuid
+from typing import List, Tuple
+from starlette.responses import JSONResponse, StreamingResponse
+
+MULTIPART_MIXED = "multipart/mixed"
+
+
+class ImagePart:
+    """Encoded image bytes carried through a result until the response is serialized"""
+
+    __slots__ = ("data", "content_type")
+
+    def __init__(self, data: bytes, content_type: str):
+        self.data = data
+        self.content_type = content_type
+
+
+def _accept_quality(accept: str, media_type: str) -> Tuple[float, int]:
+    """(q, specificity) of the most specific Accept range matching media_type; specificity 0 is */*"""
+    best, best_specificity = 0.0, -1
+    main_type = media_type.split("/")[0]
+    for entry in accept.split(","):
+        params = [part.strip() for part in entry.split(";")]
+        range_ = params[0].lower()
+        if range_ == media_type:
+            specificity = 2
+        elif range_ == f"{main_type}/*":
+            specificity = 1
+        elif range_ == "*/*":
+            specificity = 0
+        else:
+            continue
+        quality = 1.0
+        for param in params[1:]:
+            if param.lower().startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        if specificity > best_specificity:
+            best, best_specificity = quality, specificity
+    return best, best_specificity
+
+
+def wants_multipart(accept: str) -> bool:
+    """True when the client named multipart/mixed (or multipart/*) and prefers it over JSON"""
+    if not accept:
+        return False
+    multipart_q, specificity = _accept_quality(accept, MULTIPART_MIXED)
+    json_q, _ = _accept_quality(accept, "application/json")
+    return specificity > 0 and multipart_q > 0 and multipart_q >= json_q
+
+
+def _replace_parts(value, convert):
+    if isinstance(value, ImagePart):
+        return convert(value)
+    if isinstance(value, dict):
+        return {key: _replace_parts(item, convert) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_replace_parts(item, convert) for item in value]
+    return value
+
+
+def json_response(content, status_code: int = 200) -> JSONResponse:
+    """The classic response: every image inlined as a base64 string"""
+    return JSONResponse(
+        _replace_parts(content, lambda part: base64.b64encode(part.data).decode()),
+        status_code=status_code
+    )
+
+
+def multipart_response(content, status_code: int = 200) -> StreamingResponse:
+    """
+    A multipart/mixed body: the JSON metadata first, then each image raw.
+
+    Images in the metadata are replaced by {"part", "content_type", "length"}
+    references to the Content-ID of the part holding their bytes. The image
+    buffers are written out as they are, never base64-encoded or copied.
+    """
+    parts: List[Tuple[str, ImagePart]] = []
+
+    def reference(part: ImagePart) -> dict:
+        part_id = f"image-{len(parts)}"
+        parts.append((part_id, part))
+        return {"part": part_id, "content_type": part.content_type, "length": len(part.data)}
+
+    metadata = json.dumps(_replace_parts(content, reference)).encode()
+    boundary = uuid.uuid4().hex
+
+    chunks = [
+        f"--{boundary}\r\nContent-Type: application/json\r\nContent-ID: <metadata>\r\n"
+        f"Content-Length: {len(metadata)}\r\n\r\n".encode(),
+        metadata,
+    ]
+    for part_id, part in parts:
+        chunks.append(
+            f"\r\n--{boundary}\r\nContent-Type: {part.content_type}\r\nContent-ID: <{part_id}>\r\n"
+            f"Content-Length: {len(part.data)}\r\n\r\n".encode()
+        )
+        chunks.append(part.data)
+    chunks.append(f"\r\n--{boundary}--\r\n".encode())
+
+    return StreamingResponse(
+        iter(chunks),
+        status_code=status_code,
+        media_type=f'{MULTIPART_MIXED}; boundary="{boundary}"',
+        headers={"Content-Length": str(sum(len(chunk) for chunk in chunks))},
+    )
+
+
+def negotiated_response(accept: str, content, status_code: int = 200):
+    if wants_multipart(accept):
+        return multipart_response(content, status_code)
+    return json_response(content, status_code)
@@ -0,0 +1,325 @@
+import re
+import json
+from collections import Counter, defaultdict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from PIL import ImageColor
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Per record type: replies valid first time, valid after local cleanup, fixed by the repair call, failed
+structured_stats: Dict[str, Counter] = defaultdict(Counter)
+
+
+class StructuredOutputError(ValueError):
+    """An LLM reply that isn't JSON or doesn't match its record's schema"""
+
+    def __init__(self, errors: List[str]):
+        super().__init__("; ".join(errors))
+        self.errors = errors
+
+
+class Field:
+    """One value of a record: its JSON schema, and how a near-miss value is coerced"""
+
+    def schema(self) -> dict:
+        raise NotImplementedError
+
+    def coerce(self, value, path: str, errors: List[str]):
+        raise NotImplementedError
+
+
+class Text(Field):
+    def schema(self) -> dict:
+        return {"type": "string"}
+
+    def coerce(self, value, path, errors):
+        if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+            errors.append(f"{path} must be a string")
+            return None
+        return str(value).strip()
+
+
+class Integer(Field):
+    """An integer, clamped into [minimum, maximum]; '48px' and 47.6 are read as 48"""
+
+    def __init__(self, minimum: Optional[int] = None, maximum: Optional[int] = None):
+        self.minimum = minimum
+        self.maximum = maximum
+
+    def schema(self) -> dict:
+        return {"type": "integer"}
+
+    def coerce(self, value, path, errors):
+        if isinstance(value, str):
+            try:
+                value = float(value.strip().lower().removesuffix("px"))
+            except ValueError:
+                pass
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or value != value:
+            errors.append(f"{path} must be an integer")
+            return None
+        value = round(value)
+        if self.minimum is not None:
+            value = max(self.minimum, value)
+        if self.maximum is not None:
+            value = min(self.maximum, value)
+        return value
+
+
+class Choice(Field):
+    """One of a fixed set of lower-case options; 'Top_Center' matches 'center top'"""
+
+    def __init__(self, options):
+        self.options = list(options)
+
+    def schema(self) -> dict:
+        return {"type": "string", "enum": self.options}
+
+    def coerce(self, value, path, errors):
+        if isinstance(value, str):
+            words = re.sub(r"[\s_-]+", " ", value).strip().lower().split(" ")
+            for candidate in (" ".join(words), " ".join(reversed(words))):
+                if candidate in self.options:
+                    return candidate
+        errors.append(f"{path} must be one of {', '.join(self.options)}")
+        return None
+
+
+class Color(Field):
+    """A color Pillow can draw; hex without its '#' is accepted"""
+
+    def schema(self) -> dict:
+        return {"type": "string", "description": "hex color, #RRGGBB or #RRGGBBAA"}
+
+    def coerce(self, value, path, errors):
+        if isinstance(value, str):
+            value = value.strip()
+            if re.fullmatch(r"[0-9a-fA-F]{3,4}|[0-9a-fA-F]{6}|[0-9a-fA-F]{8}", value):
+                value = "#" + value
+            try:
+                ImageColor.getrgb(value)
+                return value
+            except ValueError:
+                pass
+        errors.append(f"{path} must be a hex color")
+        return None
+
+
+class ListOf(Field):
+    def __init__(self, item: Field, length: Optional[int] = None):
+        self.item = item
+        self.length = length
+
+    def schema(self) -> dict:
+        return {"type": "array", "items": self.item.schema()}
+
+    def coerce(self, value, path, errors):
+        if isinstance(value, tuple):
+            value = list(value)
+        elif self.length and isinstance(value, (int, float)) and not isinstance(value, bool):
+            # A shadow offset of 3 means [3, 3]
+            value = [value] * self.length
+        if not isinstance(value, list):
+            errors.append(f"{path} must be a list")
+            return None
+        if self.length is not None and len(value) != self.length:
+            errors.append(f"{path} must have exactly {self.length} items")
+            return None
+        return [self.item.coerce(item, f"{path}[{i}]", errors) for i, item in enumerate(value)]
+
+
+class Nested(Field):
+    def __init__(self, record: type):
+        self.record = record
+
+    def schema(self) -> dict:
+        return self.record.json_schema()
+
+    def coerce(self, value, path, errors):
+        if not isinstance(value, dict):
+            errors.append(f"{path} must be an object")
+            return None
+        return self.record._coerce(value, path, errors)
+
+
+class Nullable(Field):
+    """May be null or missing, e.g. an effect the model didn't use"""
+
+    def __init__(self, field: Field):
+        self.field = field
+
+    def schema(self) -> dict:
+        return {"anyOf": [self.field.schema(), {"type": "null"}]}
+
+    def coerce(self, value, path, errors):
+        return None if value is None else self.field.coerce(value, path, errors)
+
+
+class Freeform(Field):
+    """
+    Any JSON value but null, kept as is. Its schema isn't strict-mode valid, so a
+    record using it is parsed and repaired but never sent as response_format
+    """
+
+    def schema(self) -> dict:
+        return {}
+
+    def coerce(self, value, path, errors):
+        if value is None:
+            errors.append(f"{path} must not be null")
+        return value
+
+
+class Record:
+    """
+    A typed LLM reply. Subclasses list their FIELDS and set
+    __slots__ = tuple(FIELDS); json_schema() is the strict schema sent as
+    response_format, and from_dict() validates a parsed reply into an
+    instance. Extra keys are dropped and near misses (numbers as strings,
+    placement word order, colors without '#') are coerced instead of
+    failing.
+    """
+
+    __slots__ = ()
+    FIELDS: Dict[str, Field] = {}
+
+    def __init__(self, **values):
+        for name in self.FIELDS:
+            setattr(self, name, values.get(name))
+
+    @classmethod
+    def json_schema(cls) -> dict:
+        return {
+            "type": "object",
+            "properties": {name: field.schema() for name, field in cls.FIELDS.items()},
+            # Strict mode wants every key listed; optional ones are nullable instead
+            "required": list(cls.FIELDS),
+            "additionalProperties": False,
+        }
+
+    @classmethod
+    def _coerce(cls, data: dict, path: str, errors: List[str]) -> "Record":
+        values = {}
+        for name, field in cls.FIELDS.items():
+            if name not in data and not isinstance(field, Nullable):
+                errors.append(f"{path}.{name} is missing")
+                continue
+            values[name] = field.coerce(data.get(name), f"{path}.{name}", errors)
+        return cls(**values)
+
+    @classmethod
+    def from_dict(cls, data) -> "Record":
+        errors = []
+        if not isinstance(data, dict):
+            raise StructuredOutputError(["the reply must be a JSON object"])
+        record = cls._coerce(data, "$", errors)
+        if errors:
+            raise StructuredOutputError(errors)
+        return record
+
+    def to_dict(self) -> dict:
+        """Plain JSON data, without the keys that are null"""
+        def plain(value):
+            if isinstance(value, Record):
+                return value.to_dict()
+            if isinstance(value, list):
+                return [plain(item) for item in value]
+            return value
+
+        return {name: plain(getattr(self, name)) for name in self.FIELDS if getattr(self, name) is not None}
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+
+def response_format(record: type) -> dict:
+    """The chat completions / runs response_format constraining output to the record's schema"""
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": record.__name__, "strict": True, "schema": record.json_schema()},
+    }
+
+
+def _clean_json(content: str) -> str:
+    """Strip code fences and prose around the object, and trailing commas"""
+    content = re.sub(r"^```(?:json)?|```$", "", content.strip()).strip()
+    start, end = content.find("{"), content.rfind("}")
+    if start == -1 or end < start:
+        raise StructuredOutputError(["the reply contains no JSON object"])
+    return re.sub(r",\s*([}\]])", r"\1", content[start:end + 1])
+
+
+def parse_structured(record: type, content: Optional[str]) -> Record:
+    """Validate a reply into the record, after a free local cleanup if it isn't plain JSON"""
+    if not content:
+        raise StructuredOutputError(["the reply was empty"])
+    try:
+        data = json.loads(content)
+    except ValueError:
+        try:
+            data = json.loads(_clean_json(content))
+        except ValueError as e:
+            raise StructuredOutputError([f"the reply is not valid JSON ({str(e)})"])
+        structured_stats[record.__name__]["cleaned"] += 1
+    return record.from_dict(data)
+
+
+def repair_messages(content: Optional[str], error: StructuredOutputError) -> List[dict]:
+    """Follow-up turn asking the model to fix its own reply"""
+    return [
+        {"role": "assistant", "content": content or ""},
+        {"role": "user", "content": "That reply doesn't match the required JSON schema: "
+                                    f"{'; '.join(error.errors)}. Reply with the corrected JSON only."},
+    ]
+
+
+def _first_attempt(record: type, content: Optional[str]):
+    try:
+        result = parse_structured(record, content)
+    except StructuredOutputError as e:
+        logger.warning(f"{record.__name__} reply failed validation, repairing once: {str(e)}")
+        return None, e
+    structured_stats[record.__name__]["valid"] += 1
+    return result, None
+
+
+def _repaired(record: type, content: Optional[str]) -> Record:
+    try:
+        result = parse_structured(record, content)
+    except StructuredOutputError:
+        structured_stats[record.__name__]["failed"] += 1
+        raise
+    structured_stats[record.__name__]["repaired"] += 1
+    return result
+
+
+def complete_structured(record: type, messages: List[dict], send: Callable[[List[dict]], str],
+                        content: Optional[str] = None) -> Record:
+    """
+    send(messages) and validate the reply into record, with one repair round trip.
+
+    Pass content when the first reply was already obtained some other way
+    (an Assistants run); send is then only used for the repair.
+    """
+    if content is None:
+        content = send(messages)
+    result, error = _first_attempt(record, content)
+    if result is not None:
+        return result
+    return _repaired(record, send(messages + repair_messages(content, error)))
+
+
+async def acomplete_structured(record: type, messages: List[dict],
+                               send: Callable[[List[dict]], Awaitable[str]]) -> Record:
+    """complete_structured for an async send"""
+    content = await send(messages)
+    result, error = _first_attempt(record, content)
+    if result is not None:
+        return result
+    return _repaired(record, await send(messages + repair_messages(content, error)))
+
+
+def structured_output_stats() -> Dict[str, Dict[str, Any]]:
+    return {name: {outcome: counts[outcome] for outcome in ("valid", "cleaned", "repaired", "failed")}
+            for name, counts in structured_stats.items()}
@@ -1,12 +1,21 @@
 import openai
-from PIL import Image, ImageDraw, ImageFont, ImageFilter
+from PIL import Image, ImageColor, ImageDraw, ImageFilter
 import io
+import math
 import base64
-import json
 import os
 from dotenv import load_dotenv
-from typing import Tuple
 import logging
+import asyncio
+from collections import Counter, OrderedDict
+from services.fonts import load_font
+from services.text_layout import EDGE_MARGIN, MAX_FONT_SIZE, MIN_FONT_SIZE, calculate_position, fit_text, text_align
+from services.upstream import post_json
+from services.text_placement_service import analyze_text_properties
+from services.structured_output import acomplete_structured, response_format
+from services.text_properties import TextProperties
+from services.prewarm import PREWARM_ENABLED
+from services.text_layer_cache import TextLayer, font_fingerprint, normalize_properties, text_layer_cache
 
 # Load environment variables from .env file
 load_dotenv()
@@ -17,7 +26,17 @@ openai.api_key = os.getenv("OPENAI_API_KEY")
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-async def generate_text_properties(session, image_description, text_content):
+# Chat model for text properties; it must support json_schema response_format
+TEXT_PROPERTIES_MODEL = os.getenv("TEXT_PROPERTIES_MODEL", "gpt-4o-mini")
+TEXT_PROPERTIES_RESPONSE_FORMAT = response_format(TextProperties)
+
+# LLM text properties per (image description, text); 0 disables the cache. Only on by default
+# with prewarming, which fills it; otherwise it would just give exact repeats identical styling
+TEXT_PROPERTIES_CACHE_SIZE = int(os.getenv("TEXT_PROPERTIES_CACHE_SIZE", "512" if PREWARM_ENABLED else "0"))
+_text_properties_cache: "OrderedDict[tuple, TextProperties]" = OrderedDict()
+text_properties_stats = Counter()
+
+async def generate_text_properties(session, image_description, text_content) -> TextProperties:
     if not openai.api_key:
         raise ValueError("OpenAI API key is not set. Please check your .env file.")
 
@@ -29,9 +48,12 @@ async def generate_text_properties(session, image_description, text_content):
     Use only the following options for placement:
     center, center top, center bottom, left, right, left top, left bottom, right top, right bottom
 
-    The size should be a number between 12 and 120 pixels.
+    The size should be a number between {MIN_FONT_SIZE} and {MAX_FONT_SIZE} pixels.
 
-    Respond in the following JSON format:
+    Effects are optional; set the ones that don't suit the image to null. A shadow "blur"
+    of 0 gives a hard shadow and up to 20 a soft one; "glow" adds a soft outer glow.
+
+    For example:
     {{
     "placement": "center",
     "size": 48,
@@ -44,8 +66,10 @@ async def generate_text_properties(session, image_description, text_content):
         }},
         "shadow": {{
             "color": "#00000080",
-            "offset": [2, 2]
+            "offset": [2, 2],
+            "blur": 4
         }},
+        "glow": null,
         "gradient": {{
             "colors": ["#FF0000", "#00FF00", "#0000FF"],
             "direction": "horizontal"
@@ -53,133 +77,191 @@ async def generate_text_properties(session, image_description, text_content):
         }}
     }}"""
 
-    try:
-        response = await session.post(
+    async def send(messages):
+        status, response_json = await post_json(
+            session,
+            "openai",
             "https://api.openai.com/v1/chat/completions",
             headers={
                 "Authorization": f"Bearer {openai.api_key}",
                 "Content-Type": "application/json"
             },
-            json={
-                "model": "gpt-4",  # Make sure this is the correct model name
-                "messages": [{"role": "user", "content": prompt}],
+            json_body={
+                "model": TEXT_PROPERTIES_MODEL,
+                "messages": messages,
+                "response_format": TEXT_PROPERTIES_RESPONSE_FORMAT,
             },
+            hedge=True,
         )
-        response.raise_for_status()
-        response_json = await response.json()
+        if status >= 400:
+            raise ValueError(f"OpenAI API returned status {status}: {response_json}")
         logger.debug(f"API Response: {response_json}")
 
         if 'choices' not in response_json or len(response_json['choices']) == 0:
             raise ValueError("Unexpected API response format")
 
-        content = response_json['choices'][0]['message']['content']
+        content = response_json['choices'][0]['message'].get('content')
         logger.debug(f"Content: {content}")
+        return content
 
-        properties = json.loads(content)
-
-        # Ensure shadow offset is a list
-        if 'effects' in properties and 'shadow' in properties['effects']:
-            properties['effects']['shadow']['offset'] = list(properties['effects']['shadow']['offset'])
-
+    try:
+        properties = await acomplete_structured(TextProperties, [{"role": "user", "content": prompt}], send)
         logger.debug(f"Parsed properties: {properties}")
         return properties
-    except json.JSONDecodeError as e:
-        logger.error(f"JSON decode error: {e}")
-        logger.error(f"Content that failed to decode: {content}")
-        raise
     except Exception as e:
         logger.error(f"Error in generate_text_properties: {str(e)}")
         raise
 
-def create_text_image(text, properties, image_size):
+async def cached_text_properties(session, image_description, text_content):
+    """
+    generate_text_properties, remembered per (description, text).
+
+    The same background prompt and text get the same styling, whether the
+    request came from a client or from the prewarmer.
+    """
+    key = (image_description, text_content)
+    properties = _text_properties_cache.get(key)
+    if properties is not None:
+        _text_properties_cache.move_to_end(key)
+        text_properties_stats["hits"] += 1
+    else:
+        text_properties_stats["misses"] += 1
+        properties = await generate_text_properties(session, image_description, text_content)
+        if TEXT_PROPERTIES_CACHE_SIZE:
+            _text_properties_cache[key] = properties
+            while len(_text_properties_cache) > TEXT_PROPERTIES_CACHE_SIZE:
+                _text_properties_cache.popitem(last=False)
+    # A fresh dict per call, so callers may adjust theirs; the cached record stays as generated
+    return properties.to_dict()
+
+def has_cached_text_properties(image_description, text_content) -> bool:
+    return (image_description, text_content) in _text_properties_cache
+
+def text_properties_cache_stats():
+    return {"entries": len(_text_properties_cache), "max_entries": TEXT_PROPERTIES_CACHE_SIZE,
+            "hits": text_properties_stats["hits"],
+            "misses": text_properties_stats["misses"]}
+
+def render_text_layer(text, properties, image_size):
+    """The transparent RGBA text layer as a PIL image, ready to paste"""
     image = Image.new('RGBA', image_size, (255, 255, 255, 0))
     draw = ImageDraw.Draw(image)
 
-    font_size = properties['size']
-
-    # Expanded font options
-    font_paths = {
-        'arial': "arial.ttf",
-        'arial bold': "arialbd.ttf",
-        'times': "times.ttf",
-        'times new roman': "times.ttf",
-        'verdana': "verdana.ttf",
-        'comic': "comic.ttf",
-        'impact': "impact.ttf",
-        'georgia': "georgia.ttf",
-    }
-
-    try:
-        font_name = properties['font'].lower()
-        font = ImageFont.truetype(font_paths.get(font_name, "arial.ttf"), font_size)
-    except IOError:
-        logger.warning(f"Font {properties['font']} not found. Using default font.")
-        try:
-            # Try to use a default TrueType font
-            font = ImageFont.truetype("arial.ttf", font_size)
-        except IOError:
-            # If that fails, use the default bitmap font
-            font = ImageFont.load_default()
-            logger.warning("Default TrueType font not found. Using bitmap font.")
-
-    bbox = draw.textbbox((0, 0), text, font=font)
+    # Wrap onto multiple lines and shrink until the text fits inside the canvas margins
+    font_size, lines = fit_text(
+        text,
+        properties['font'],
+        image_size[0] - 2 * EDGE_MARGIN,
+        image_size[1] - 2 * EDGE_MARGIN,
+        int(properties['size'])
+    )
+    text = "\n".join(lines)
+    font = load_font(properties['font'], font_size)
+
+    bbox = draw.textbbox((0, 0), text, font=font, align=text_align(properties['placement']))
     text_width = bbox[2] - bbox[0]
     text_height = bbox[3] - bbox[1]
 
-    position = calculate_position(properties['placement'], image_size, text_width, text_height)
+    x, y = calculate_position(properties['placement'], image_size, text_width, text_height)
+    # That is where the ink box goes; the draw origin sits above and left of it by the font's bearings
+    position = (x - bbox[0], y - bbox[1])
 
     # Apply text effects
     if 'effects' in properties:
+        if 'glow' in properties['effects']:
+            draw_glow_text(image, draw, position, text, font, properties)
         if 'outline' in properties['effects']:
             draw_outline_text(draw, position, text, font, properties)
         if 'shadow' in properties['effects']:
-            draw_shadow_text(draw, position, text, font, properties)
+            if properties['effects']['shadow'].get('blur'):
+                draw_soft_shadow_text(image, draw, position, text, font, properties)
+            else:
+                draw_shadow_text(draw, position, text, font, properties)
         if 'gradient' in properties['effects']:
             draw_gradient_text(draw, position, text, font, properties)
     else:
-        draw.text(position, text, font=font, fill=properties['color'])
+        draw.text(position, text, font=font, fill=properties['color'], align=text_align(properties['placement']))
+
+    return image
+
+def text_layer(text, properties, image_size) -> TextLayer:
+    """The text layer cropped to its pixels, rasterized once per (text, properties, canvas, font file)"""
+    font = load_font(properties['font'], int(properties['size']))
+    key = (text, normalize_properties(properties), tuple(image_size), font_fingerprint(font))
+    return text_layer_cache.get_or_render(
+        key, lambda: TextLayer.from_canvas(render_text_layer(text, properties, image_size))
+    )
 
+def create_text_image(text, properties, image_size):
+    image = text_layer(text, properties, image_size).to_canvas()
     buffered = io.BytesIO()
     image.save(buffered, format="PNG")
     return base64.b64encode(buffered.getvalue()).decode()
 
-def calculate_position(placement, image_size, text_width, text_height) -> Tuple[int, int]:
-    positions = {
-        'center': ((image_size[0] - text_width) // 2, (image_size[1] - text_height) // 2),
-        'center top': ((image_size[0] - text_width) // 2, 10),
-        'center bottom': ((image_size[0] - text_width) // 2, image_size[1] - text_height - 10),
-        'left': (10, (image_size[1] - text_height) // 2),
-        'right': (image_size[0] - text_width - 10, (image_size[1] - text_height) // 2),
-        'left top': (10, 10),
-        'left bottom': (10, image_size[1] - text_height - 10),
-        'right top': (image_size[0] - text_width - 10, 10),
-        'right bottom': (image_size[0] - text_width - 10, image_size[1] - text_height - 10),
-    }
-
-    # Convert placement to lowercase and replace underscore with space
-    normalized_placement = placement.lower().replace('_', ' ')
-
-    if normalized_placement in positions:
-        return positions[normalized_placement]
-    else:
-        # Default to center if an invalid placement is provided
-        logger.warning(f"Invalid placement '{placement}'. Defaulting to center.")
-        return positions['center']
-
 def draw_outline_text(draw, position, text, font, properties):
     outline_color = properties['effects']['outline']['color']
     outline_width = properties['effects']['outline']['width']
     for offset_x in range(-outline_width, outline_width + 1):
         for offset_y in range(-outline_width, outline_width + 1):
-            draw.text((position[0] + offset_x, position[1] + offset_y), text, font=font, fill=outline_color)
-    draw.text(position, text, font=font, fill=properties['color'])
+            draw.text((position[0] + offset_x, position[1] + offset_y), text, font=font, fill=outline_color,
+                      align=text_align(properties['placement']))
+    draw.text(position, text, font=font, fill=properties['color'], align=text_align(properties['placement']))
 
 def draw_shadow_text(draw, position, text, font, properties):
     shadow_color = properties['effects']['shadow']['color']
     shadow_offset = tuple(properties['effects']['shadow']['offset'])  # Convert list to tuple
     shadow_position = (position[0] + shadow_offset[0], position[1] + shadow_offset[1])
-    draw.text(shadow_position, text, font=font, fill=shadow_color)
-    draw.text(position, text, font=font, fill=properties['color'])
+    draw.text(shadow_position, text, font=font, fill=shadow_color, align=text_align(properties['placement']))
+    draw.text(position, text, font=font, fill=properties['color'], align=text_align(properties['placement']))
+
+def _composite_blurred_text(image, position, text, font, color, radius, spread=0, align='left'):
+    """
+    Blur a tinted copy of the text and composite it onto the layer.
+
+    Only the text's bounding box, padded by three blur radii, is drawn and
+    blurred, so the cost follows the text's area rather than the canvas.
+    GaussianBlur itself runs as separable horizontal and vertical passes.
+    """
+    radius = max(0.0, float(radius))
+    spread = max(0, int(spread))
+    pad = math.ceil(radius * 3) + spread
+    left, top, right, bottom = ImageDraw.Draw(image).textbbox(position, text, font=font, stroke_width=spread,
+                                                                 align=align)
+    box = (
+        max(0, left - pad), max(0, top - pad),
+        min(image.width, right + pad), min(image.height, bottom + pad),
+    )
+    if box[0] >= box[2] or box[1] >= box[3]:
+        return
+
+    mask = Image.new('L', (box[2] - box[0], box[3] - box[1]), 0)
+    ImageDraw.Draw(mask).text(
+        (position[0] - box[0], position[1] - box[1]), text, font=font, fill=255, stroke_width=spread, stroke_fill=255,
+        align=align
+    )
+    if radius:
+        mask = mask.filter(ImageFilter.GaussianBlur(radius))
+
+    rgba = ImageColor.getcolor(color, 'RGBA')
+    if rgba[3] < 255:
+        mask = mask.point(lambda value: value * rgba[3] // 255)
+    tint = Image.new('RGBA', mask.size, rgba[:3] + (255,))
+    tint.putalpha(mask)
+    image.alpha_composite(tint, dest=box[:2])
+
+def draw_soft_shadow_text(image, draw, position, text, font, properties):
+    shadow = properties['effects']['shadow']
+    offset = tuple(shadow.get('offset', (0, 0)))
+    shadow_position = (position[0] + offset[0], position[1] + offset[1])
+    _composite_blurred_text(image, shadow_position, text, font, shadow['color'], shadow['blur'],
+                            align=text_align(properties['placement']))
+    draw.text(position, text, font=font, fill=properties['color'], align=text_align(properties['placement']))
+
+def draw_glow_text(image, draw, position, text, font, properties):
+    glow = properties['effects']['glow']
+    _composite_blurred_text(image, position, text, font, glow['color'], glow.get('radius', 8), glow.get('spread', 0),
+                            align=text_align(properties['placement']))
+    draw.text(position, text, font=font, fill=properties['color'], align=text_align(properties['placement']))
 
 def draw_gradient_text(draw, position, text, font, properties):
     gradient_colors = properties['effects']['gradient']['colors']
@@ -187,7 +269,8 @@ def draw_gradient_text(draw, position, text, font, properties):
 
     text_layer = Image.new('RGBA', draw.im.size, (255, 255, 255, 0))
     text_draw = ImageDraw.Draw(text_layer)
-    text_draw.text(position, text, font=font, fill=(255, 255, 255, 255))
+    text_draw.text(position, text, font=font, fill=(255, 255, 255, 255),
+                   align=text_align(properties['placement']))
 
     gradient = Image.new('RGBA', draw.im.size, (255, 255, 255, 0))
     gradient_draw = ImageDraw.Draw(gradient)
@@ -204,18 +287,38 @@ def draw_gradient_text(draw, position, text, font, properties):
             gradient_draw.rectangle([x, 0, gradient.width, gradient.height], fill=color)
 
     gradient_text = Image.composite(gradient, Image.new('RGBA', draw.im.size, (255, 255, 255, 0)), text_layer)
-    draw.im.paste(gradient_text, (0, 0), gradient_text)
-
-async def generate_text_overlay(session, image_description, text_content, image_size):
-    try:
-        properties = await generate_text_properties(session, image_description, text_content)
-        print(f"Generated text properties: {properties}")
-    except Exception as e:
-        print(f"Error generating text properties: {str(e)}")
-        raise
+    # draw.im is the core image, so paste the core of the layer over the full box
+    draw.im.paste(gradient_text.im, (0, 0) + gradient_text.size, gradient_text.im)
+
+async def generate_text_overlay(session, image_description, text_content, image_size, mode="llm", image=None,
+                                as_image=False, properties=None):
+    """
+    Returns (text layer, properties). The layer is a base64 PNG, or with
+    as_image a cached TextLayer to paste_onto the background, which skips
+    the encode/decode round trip and full-canvas copies entirely.
+
+    Pass properties that were already resolved to only render them.
+    """
+    if properties is None:
+        try:
+            if mode == "local":
+                if image is None:
+                    raise ValueError("Local text properties need the decoded background image")
+                # Analyze the actual pixels instead of asking the LLM
+                properties = await asyncio.to_thread(analyze_text_properties, image, text_content)
+            else:
+                properties = await cached_text_properties(session, image_description, text_content)
+            print(f"Generated text properties: {properties}")
+        except Exception as e:
+            print(f"Error generating text properties: {str(e)}")
+            raise
 
     try:
-        text_image = create_text_image(text_content, properties, image_size)
+        # Rasterizing takes tens of milliseconds; keep it off the event loop
+        if as_image:
+            text_image = await asyncio.to_thread(text_layer, text_content, properties, image_size)
+        else:
+            text_image = await asyncio.to_thread(create_text_image, text_content, properties, image_size)
         print("Text image created successfully")
         return text_image, properties
     except Exception as e:
@@ -0,0 +1,194 @@
+import os
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from functools import lru_cache
+from typing import Callable, Dict, Optional, Tuple
+import PIL
+from PIL import Image
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+TEXT_LAYER_CACHE_MAX_BYTES = int(os.getenv("TEXT_LAYER_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+
+class TextLayer:
+    """
+    A rendered text layer cropped to its visible pixels, and where it goes.
+
+    Shared between banners through the cache, so it must be treated as
+    read-only: paste it, don't draw on it.
+    """
+
+    __slots__ = ("image", "offset", "canvas_size")
+
+    def __init__(self, image: Optional[Image.Image], offset: Tuple[int, int], canvas_size: Tuple[int, int]):
+        self.image = image
+        self.offset = offset
+        self.canvas_size = canvas_size
+
+    @classmethod
+    def from_canvas(cls, canvas: Image.Image) -> "TextLayer":
+        bbox = canvas.getbbox()
+        if bbox is None:
+            return cls(None, (0, 0), canvas.size)
+        return cls(canvas.crop(bbox), bbox[:2], canvas.size)
+
+    @property
+    def nbytes(self) -> int:
+        return self.image.width * self.image.height * 4 if self.image is not None else 0
+
+    def paste_onto(self, canvas: Image.Image):
+        """Composite onto a canvas of canvas_size; only the text's box is touched"""
+        if self.image is not None:
+            canvas.paste(self.image, self.offset, self.image)
+
+    def to_canvas(self) -> Image.Image:
+        """The full-size transparent layer, identical to rendering without the crop"""
+        canvas = Image.new('RGBA', self.canvas_size, (255, 255, 255, 0))
+        if self.image is not None:
+            canvas.paste(self.image, self.offset)
+        return canvas
+
+
+@lru_cache(maxsize=64)
+def _file_digest(path: str, mtime: float, size: int) -> str:
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def font_fingerprint(font) -> str:
+    """Identify the font file a loaded font came from, so edits to the file invalidate cached layers"""
+    path = getattr(font, "path", None)
+    if isinstance(path, (str, os.PathLike)) and os.path.exists(path):
+        stat = os.stat(path)
+        return _file_digest(os.path.abspath(path), stat.st_mtime, stat.st_size)
+    # Pillow's bundled font (or a bitmap fallback) only changes with Pillow itself
+    return f"pillow-default-{PIL.__version__}"
+
+
+def normalize_properties(properties: dict) -> str:
+    """Canonical JSON for text properties, so cosmetic differences share one cache entry"""
+    def normalize(value, key=None):
+        if isinstance(value, dict):
+            return {k: normalize(v, k) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [normalize(item, key) for item in value]
+        if isinstance(value, str):
+            # Only where rendering already ignores case; e.g. gradient direction doesn't
+            if value.startswith("#"):
+                return value.upper()
+            if key in ("font", "placement"):
+                return value.strip().lower()
+            return value
+        if key == "size":
+            return int(value)
+        return value
+
+    return json.dumps(normalize(properties), sort_keys=True)
+
+
+class TextLayerCache:
+    """
+    Byte-budgeted LRU of rendered text layers.
+
+    Renders run in worker threads, so get_or_render keeps a map of the
+    ones in flight: identical requests arriving while a layer is being
+    rasterized wait for that render instead of starting their own.
+    """
+
+    def __init__(self, max_bytes: int = TEXT_LAYER_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[tuple, TextLayer]" = OrderedDict()
+        self._in_flight: Dict[tuple, Future] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def get(self, key: tuple) -> Optional[TextLayer]:
+        with self._lock:
+            layer = self._entries.get(key)
+            if layer is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return layer
+
+    def get_or_render(self, key: tuple, render: Callable[[], TextLayer]) -> TextLayer:
+        """The cached layer for key, rendering it once however many threads ask at the same time"""
+        with self._lock:
+            layer = self._entries.get(key)
+            if layer is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return layer
+            pending = self._in_flight.get(key)
+            owner = pending is None
+            if owner:
+                pending = self._in_flight[key] = Future()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+        if not owner:
+            return pending.result()
+
+        try:
+            layer = render()
+        except BaseException as e:
+            with self._lock:
+                del self._in_flight[key]
+            # Waiters see the same error; the next request tries again
+            pending.set_exception(e)
+            raise
+        self.put(key, layer)
+        with self._lock:
+            del self._in_flight[key]
+        pending.set_result(layer)
+        return layer
+
+    def put(self, key: tuple, layer: TextLayer):
+        if layer.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous.nbytes
+            self._entries[key] = layer
+            self._bytes += layer.nbytes
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._in_flight),
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            "evictions": self.evictions,
+        }
+
+
+text_layer_cache = TextLayerCache()
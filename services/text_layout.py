@@ -0,0 +1,178 @@
+from functools import lru_cache
+from typing import List, Tuple
+import logging
+from services.fonts import load_font
+
+logger = logging.getLogger(__name__)
+
+# Distance kept between the text and the canvas edge
+EDGE_MARGIN = 10
+# Font sizes text properties may ask for, whether from the LLM or the local analyzer
+MIN_FONT_SIZE = 12
+MAX_FONT_SIZE = 120
+# Pillow's default gap between lines of multiline text
+LINE_SPACING = 4
+# Per-size word width memo; cleared rather than evicted once it grows past this
+WORD_CACHE_LIMIT = 4096
+
+PLACEMENTS = [
+    'center', 'center top', 'center bottom',
+    'left', 'right',
+    'left top', 'left bottom',
+    'right top', 'right bottom',
+]
+
+def calculate_position(placement, image_size, text_width, text_height) -> Tuple[int, int]:
+    positions = {
+        'center': ((image_size[0] - text_width) // 2, (image_size[1] - text_height) // 2),
+        'center top': ((image_size[0] - text_width) // 2, EDGE_MARGIN),
+        'center bottom': ((image_size[0] - text_width) // 2, image_size[1] - text_height - EDGE_MARGIN),
+        'left': (EDGE_MARGIN, (image_size[1] - text_height) // 2),
+        'right': (image_size[0] - text_width - EDGE_MARGIN, (image_size[1] - text_height) // 2),
+        'left top': (EDGE_MARGIN, EDGE_MARGIN),
+        'left bottom': (EDGE_MARGIN, image_size[1] - text_height - EDGE_MARGIN),
+        'right top': (image_size[0] - text_width - EDGE_MARGIN, EDGE_MARGIN),
+        'right bottom': (image_size[0] - text_width - EDGE_MARGIN, image_size[1] - text_height - EDGE_MARGIN),
+    }
+
+    # Convert placement to lowercase and replace underscore with space
+    normalized_placement = placement.lower().replace('_', ' ')
+
+    if normalized_placement not in positions:
+        # Default to center if an invalid placement is provided
+        logger.warning(f"Invalid placement '{placement}'. Defaulting to center.")
+        normalized_placement = 'center'
+
+    # Text larger than the canvas is pinned to the top-left instead of going negative
+    x, y = positions[normalized_placement]
+    return max(0, x), max(0, y)
+
+
+def text_align(placement) -> str:
+    """Line alignment of wrapped text, toward the side its block is anchored to"""
+    normalized_placement = placement.lower().replace('_', ' ')
+    if normalized_placement.startswith('left'):
+        return 'left'
+    if normalized_placement.startswith('right'):
+        return 'right'
+    return 'center'
+
+
+class GlyphMetrics:
+    """
+    Advance and kerning tables for one (font, size).
+
+    Each glyph and each character pair is measured with the font once;
+    after that, measuring a line is only dictionary lookups.
+    """
+
+    __slots__ = ("font", "advances", "kerning", "words", "line_advance", "line_height")
+
+    def __init__(self, font_name: str, font_size: int):
+        self.font = load_font(font_name, font_size)
+        self.advances = {}
+        self.kerning = {}
+        self.words = {}
+        # Same line pitch ImageDraw uses when drawing text containing newlines
+        glyph_bottom = self.font.getbbox("A")[3]
+        self.line_advance = glyph_bottom + LINE_SPACING
+        self.line_height = max(glyph_bottom, self.font.getbbox("Ágjpqy")[3])
+
+    def advance(self, char: str) -> float:
+        width = self.advances.get(char)
+        if width is None:
+            width = self.advances[char] = self.font.getlength(char)
+        return width
+
+    def kern(self, left: str, right: str) -> float:
+        pair = left + right
+        adjustment = self.kerning.get(pair)
+        if adjustment is None:
+            adjustment = self.kerning[pair] = (
+                self.font.getlength(pair) - self.advance(left) - self.advance(right)
+            )
+        return adjustment
+
+    def measure(self, text: str) -> float:
+        width = self.words.get(text)
+        if width is not None:
+            return width
+        width = 0.0
+        previous = None
+        for char in text:
+            width += self.advance(char)
+            if previous is not None:
+                width += self.kern(previous, char)
+            previous = char
+        if len(self.words) >= WORD_CACHE_LIMIT:
+            self.words.clear()
+        self.words[text] = width
+        return width
+
+    def block_height(self, line_count: int) -> float:
+        return (line_count - 1) * self.line_advance + self.line_height
+
+
+@lru_cache(maxsize=512)
+def glyph_metrics(font_name: str, font_size: int) -> GlyphMetrics:
+    return GlyphMetrics(font_name.lower(), font_size)
+
+
+def wrap_text(text: str, metrics: GlyphMetrics, max_width: float) -> Tuple[List[str], float]:
+    """Greedy word wrap; returns the lines and the widest line's width"""
+    lines = []
+    widest = 0.0
+    space = metrics.advance(" ")
+    for paragraph in text.split("\n"):
+        current = []
+        current_width = 0.0
+        for word in paragraph.split():
+            word_width = metrics.measure(word)
+            if current:
+                candidate = (current_width + metrics.kern(current[-1][-1], " ")
+                             + space + metrics.kern(" ", word[0]) + word_width)
+                if candidate <= max_width:
+                    current.append(word)
+                    current_width = candidate
+                    continue
+                lines.append(" ".join(current))
+                widest = max(widest, current_width)
+            current = [word]
+            current_width = word_width
+        lines.append(" ".join(current))
+        widest = max(widest, current_width)
+    return lines, widest
+
+
+def fit_text(text: str, font_name: str, box_width: int, box_height: int,
+             max_size: int, min_size: int = MIN_FONT_SIZE) -> Tuple[int, List[str]]:
+    """
+    Largest font size (up to max_size) at which the wrapped text fits the box.
+
+    Binary searches the size; every probe wraps with cached glyph metrics
+    instead of rendering or calling textbbox. Falls back to min_size when
+    nothing fits.
+    """
+    max_size = max(int(max_size), min_size)
+
+    def layout(size):
+        metrics = glyph_metrics(font_name, size)
+        lines, widest = wrap_text(text, metrics, box_width)
+        fits = widest <= box_width and metrics.block_height(len(lines)) <= box_height
+        return fits, lines
+
+    fits, lines = layout(max_size)
+    if fits:
+        return max_size, lines
+
+    best_size, best_lines = min_size, layout(min_size)[1]
+    low, high = min_size + 1, max_size - 1
+    while low <= high:
+        mid = (low + high) // 2
+        fits, lines = layout(mid)
+        if fits:
+            best_size, best_lines = mid, lines
+            low = mid + 1
+        else:
+            high = mid - 1
+    return best_size, best_lines
@@ -0,0 +1,173 @@
+import numpy as np
+from PIL import Image
+from services.text_layout import (
+    EDGE_MARGIN, MAX_FONT_SIZE, MIN_FONT_SIZE, PLACEMENTS, calculate_position, fit_text, glyph_metrics, wrap_text
+)
+import logging
+
+logger = logging.getLogger(__name__)
+
+# The analysis runs on a downscaled copy; placement doesn't need full resolution
+ANALYSIS_MAX_SIDE = 256
+FONT_SIZE_STEP = 4
+DEFAULT_FONT = "impact"
+# A box counts as low-detail when its mean edge strength stays under this
+# fraction of the image's 75th percentile edge strength
+DETAIL_TOLERANCE = 0.6
+# Size used on busy images where no anchor has a calm area
+FALLBACK_FONT_SIZE = 48
+# WCAG contrast ratio below which the text also gets an outline
+OUTLINE_CONTRAST = 7.0
+
+
+def _integral(values: np.ndarray) -> np.ndarray:
+    """Summed-area table padded with a zero row/column so box sums need no bounds checks"""
+    table = np.zeros((values.shape[0] + 1, values.shape[1] + 1), dtype=np.float64)
+    np.cumsum(np.cumsum(values, axis=0), axis=1, out=table[1:, 1:])
+    return table
+
+
+def _box_mean(table: np.ndarray, x0: int, y0: int, x1: int, y1: int) -> float:
+    area = max((x1 - x0) * (y1 - y0), 1)
+    return (table[y1, x1] - table[y0, x1] - table[y1, x0] + table[y0, x0]) / area
+
+
+def _relative_luminance(rgb: np.ndarray) -> np.ndarray:
+    srgb = rgb / 255.0
+    linear = np.where(srgb <= 0.03928, srgb / 12.92, ((srgb + 0.055) / 1.055) ** 2.4)
+    return linear @ np.array([0.2126, 0.7152, 0.0722])
+
+
+def _contrast_ratio(l1: float, l2: float) -> float:
+    lighter, darker = max(l1, l2), min(l1, l2)
+    return (lighter + 0.05) / (darker + 0.05)
+
+
+class _ImageMaps:
+    """Downscaled edge/variance and luminance maps with their integral images"""
+
+    def __init__(self, image: Image.Image):
+        self.size = image.size
+        small = image.convert("RGB")
+        scale = ANALYSIS_MAX_SIDE / max(small.size)
+        if scale < 1:
+            small = small.resize(
+                (max(1, round(small.width * scale)), max(1, round(small.height * scale))),
+                Image.BILINEAR,
+            )
+        self.scale_x = small.width / image.width
+        self.scale_y = small.height / image.height
+
+        rgb = np.asarray(small, dtype=np.float64)
+        gray = rgb @ np.array([0.299, 0.587, 0.114])
+
+        # Edge map: absolute horizontal + vertical gradients
+        edges = np.zeros_like(gray)
+        edges[:, 1:] += np.abs(np.diff(gray, axis=1))
+        edges[1:, :] += np.abs(np.diff(gray, axis=0))
+
+        self.edges = _integral(edges)
+        self.gray = _integral(gray)
+        self.gray_sq = _integral(gray * gray)
+        self.luminance = _integral(_relative_luminance(rgb))
+        self.detail_limit = max(float(np.percentile(edges, 75)) * DETAIL_TOLERANCE, 1.0)
+
+    def _scaled_box(self, x, y, width, height):
+        x0 = int(max(0, x) * self.scale_x)
+        y0 = int(max(0, y) * self.scale_y)
+        x1 = int(np.ceil(min(self.size[0], x + width) * self.scale_x))
+        y1 = int(np.ceil(min(self.size[1], y + height) * self.scale_y))
+        return x0, y0, max(x1, x0 + 1), max(y1, y0 + 1)
+
+    def detail(self, x, y, width, height) -> float:
+        """Mean edge strength plus local standard deviation inside a full-resolution box"""
+        box = self._scaled_box(x, y, width, height)
+        mean = _box_mean(self.gray, *box)
+        variance = max(_box_mean(self.gray_sq, *box) - mean * mean, 0.0)
+        return _box_mean(self.edges, *box) + 0.1 * variance ** 0.5
+
+    def luminance_of(self, x, y, width, height) -> float:
+        return _box_mean(self.luminance, *self._scaled_box(x, y, width, height))
+
+
+def _wrapped_size(text_content, font_name, font_size, max_width):
+    """Width and height of the text block as render_text_layer wraps it at this size"""
+    metrics = glyph_metrics(font_name, font_size)
+    lines, widest = wrap_text(text_content, metrics, max_width)
+    return int(np.ceil(widest)), int(np.ceil(metrics.block_height(len(lines))))
+
+
+def find_text_region(image: Image.Image, text_content: str, font_name: str = DEFAULT_FONT):
+    """
+    Pick the anchor whose low-detail area fits the largest text.
+
+    Returns ((placement, font_size, (x, y, width, height), detail_score), maps).
+    """
+    maps = _ImageMaps(image)
+    max_width = image.width - 2 * EDGE_MARGIN
+    max_height = image.height - 2 * EDGE_MARGIN
+    # Candidates are sized like the renderer lays them out: wrapped inside the canvas margins
+    top_size, _ = fit_text(text_content, font_name, max_width, max_height, MAX_FONT_SIZE)
+    boxes = [
+        (font_size, _wrapped_size(text_content, font_name, font_size, max_width))
+        for font_size in range(top_size, MIN_FONT_SIZE - 1, -FONT_SIZE_STEP)
+    ]
+
+    best = None
+    fallback = None
+    for placement in PLACEMENTS:
+        fallback_checked = False
+        for font_size, (text_width, text_height) in boxes:
+            x, y = calculate_position(placement, image.size, text_width, text_height)
+            score = maps.detail(x, y, text_width, text_height)
+            if not fallback_checked and font_size <= FALLBACK_FONT_SIZE:
+                fallback_checked = True
+                if fallback is None or score < fallback[3]:
+                    fallback = (placement, font_size, (x, y, text_width, text_height), score)
+            if score <= maps.detail_limit:
+                candidate = (placement, font_size, (x, y, text_width, text_height), score)
+                if best is None or (font_size, -score) > (best[1], -best[3]):
+                    best = candidate
+                # Sizes are tried largest first, so this anchor is done
+                break
+
+    if best is None:
+        # Nothing is calm enough; use the quietest spot found and rely on the outline
+        best = fallback or ('center', MIN_FONT_SIZE, (0, 0) + image.size, 0.0)
+    return best, maps
+
+
+def analyze_text_properties(image: Image.Image, text_content: str, font_name: str = DEFAULT_FONT) -> dict:
+    """
+    Local replacement for generate_text_properties that inspects the background pixels.
+
+    Produces the same properties schema the LLM returns, so create_text_image
+    can consume either.
+    """
+    (placement, font_size, box, score), maps = find_text_region(image, text_content, font_name)
+    region_luminance = maps.luminance_of(*box)
+
+    white_contrast = _contrast_ratio(1.0, region_luminance)
+    black_contrast = _contrast_ratio(0.0, region_luminance)
+    if white_contrast >= black_contrast:
+        color, outline_color, contrast = "#FFFFFF", "#000000", white_contrast
+    else:
+        color, outline_color, contrast = "#000000", "#FFFFFF", black_contrast
+
+    properties = {
+        "placement": placement,
+        "size": font_size,
+        "color": color,
+        "font": font_name,
+        "effects": {},
+    }
+    if contrast < OUTLINE_CONTRAST or score > maps.detail_limit:
+        properties["effects"]["outline"] = {
+            "color": outline_color,
+            "width": max(1, font_size // 24),
+        }
+    if not properties["effects"]:
+        del properties["effects"]
+
+    logger.debug(f"Local text properties: {properties} (detail {score:.2f}, contrast {contrast:.2f})")
+    return properties
@@ -0,0 +1,57 @@
+from services.fonts import FONT_PATHS
+from services.text_layout import MAX_FONT_SIZE, MIN_FONT_SIZE, PLACEMENTS
+from services.structured_output import Choice, Color, Integer, ListOf, Nested, Nullable, Record
+
+
+class Outline(Record):
+    FIELDS = {"color": Color(), "width": Integer(0, 10)}
+    __slots__ = tuple(FIELDS)
+
+
+class Shadow(Record):
+    FIELDS = {"color": Color(), "offset": ListOf(Integer(-50, 50), length=2), "blur": Integer(0, 20)}
+    __slots__ = tuple(FIELDS)
+
+
+class Glow(Record):
+    FIELDS = {"color": Color(), "radius": Integer(0, 40), "spread": Integer(0, 10)}
+    __slots__ = tuple(FIELDS)
+
+
+class Gradient(Record):
+    FIELDS = {"colors": ListOf(Color()), "direction": Choice(["horizontal", "vertical"])}
+    __slots__ = tuple(FIELDS)
+
+
+class Effects(Record):
+    FIELDS = {
+        "outline": Nullable(Nested(Outline)),
+        "shadow": Nullable(Nested(Shadow)),
+        "glow": Nullable(Nested(Glow)),
+        "gradient": Nullable(Nested(Gradient)),
+    }
+    __slots__ = tuple(FIELDS)
+
+
+class TextProperties(Record):
+    """How the overlay text is drawn; to_dict() is what render_text_layer reads"""
+
+    FIELDS = {
+        "placement": Choice(PLACEMENTS),
+        "size": Integer(MIN_FONT_SIZE, MAX_FONT_SIZE),
+        "color": Color(),
+        "font": Choice(sorted(FONT_PATHS)),
+        "effects": Nullable(Nested(Effects)),
+    }
+    __slots__ = tuple(FIELDS)
+
+    def to_dict(self) -> dict:
+        properties = super().to_dict()
+        gradient = properties.get("effects", {}).get("gradient")
+        if gradient is not None and not gradient["colors"]:
+            # Nothing to draw the text with
+            del properties["effects"]["gradient"]
+        if not properties.get("effects"):
+            # An empty effects dict would make render_text_layer skip the plain text too
+            properties.pop("effects", None)
+        return properties
@@ -0,0 +1,229 @@
+import os
+import re
+import time
+import zlib
+from collections import Counter, OrderedDict
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Shingle Jaccard a theme needs to reuse another's prompt; lower values merge distinct themes
+THEME_MATCH_THRESHOLD = float(os.getenv("THEME_MATCH_THRESHOLD", "0.8"))
+THEME_INDEX_MAX_ENTRIES = int(os.getenv("THEME_INDEX_MAX_ENTRIES", "100000"))
+# How many background references are kept for reuse; the images themselves live in the
+# FAL image disk cache and count against IMAGE_CACHE_MAX_BYTES, not process memory
+THEME_BACKGROUND_CACHE_SIZE = int(os.getenv("THEME_BACKGROUND_CACHE_SIZE", "256"))
+
+# 32 bands of 3 rows: themes at Jaccard 0.6 collide in at least one band ~99.9% of the time
+NUM_BANDS = 32
+ROWS_PER_BAND = 3
+NUM_PERMUTATIONS = NUM_BANDS * ROWS_PER_BAND
+SHINGLE_SIZE = 3
+# Only the candidates sharing the most bands are scored exactly
+MAX_SCORED_CANDIDATES = 16
+# Bands shared by hundreds of themes carry little signal and dominate lookup cost
+MAX_BUCKET_SCAN = 256
+
+# Universal hashing modulo a 31-bit prime keeps every product inside uint64
+_PRIME = np.uint64((1 << 31) - 1)
+_rng = np.random.default_rng(1729)
+_PERM_A = _rng.integers(1, (1 << 31) - 1, size=(NUM_PERMUTATIONS, 1), dtype=np.uint64)
+_PERM_B = _rng.integers(0, (1 << 31) - 1, size=(NUM_PERMUTATIONS, 1), dtype=np.uint64)
+
+_NON_WORD = re.compile(r"[^a-z0-9]+")
+
+
+def normalize_theme(theme: str) -> str:
+    """Lowercase, strip punctuation and collapse whitespace"""
+    return " ".join(_NON_WORD.sub(" ", theme.lower()).split())
+
+
+def shingle(normalized: str) -> frozenset:
+    """Character n-grams taken per word, so word order and spacing don't matter"""
+    shingles = set()
+    for word in normalized.split():
+        padded = f" {word} "
+        if len(padded) <= SHINGLE_SIZE:
+            shingles.add(padded)
+            continue
+        for i in range(len(padded) - SHINGLE_SIZE + 1):
+            shingles.add(padded[i:i + SHINGLE_SIZE])
+    return frozenset(shingles)
+
+
+def minhash(shingles: frozenset) -> List[int]:
+    hashes = np.fromiter((zlib.crc32(s.encode()) for s in shingles), dtype=np.uint64, count=len(shingles))
+    hashes %= _PRIME
+    return ((_PERM_A * hashes + _PERM_B) % _PRIME).min(axis=1).tolist()
+
+
+def jaccard(a: frozenset, b: frozenset) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class ThemeEntry:
+    __slots__ = ("theme", "normalized", "shingles", "band_keys", "prompt", "created_at")
+
+    def __init__(self, theme, normalized, shingles, band_keys, prompt):
+        self.theme = theme
+        self.normalized = normalized
+        self.shingles = shingles
+        self.band_keys = band_keys
+        self.prompt = prompt
+        self.created_at = time.time()
+
+
+class ThemeIndex:
+    """
+    Approximate nearest-theme lookup over normalized theme strings.
+
+    MinHash signatures are split into LSH bands so a lookup only compares the
+    query against themes sharing at least one band, then ranks those
+    candidates by exact shingle Jaccard similarity.
+    """
+
+    def __init__(self, threshold: float = THEME_MATCH_THRESHOLD, max_entries: int = THEME_INDEX_MAX_ENTRIES,
+                 background_cache_size: int = THEME_BACKGROUND_CACHE_SIZE):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.background_cache_size = background_cache_size
+        self._entries: "OrderedDict[str, ThemeEntry]" = OrderedDict()
+        self._bands: Dict[Tuple[int, Tuple[int, ...]], set] = {}
+        # (normalized theme, background key) -> image cache key of the stored generate_image result;
+        # the bytes stay in the disk cache, so each entry here is a short string
+        self._backgrounds: "OrderedDict[Tuple[str, str], str]" = OrderedDict()
+        self.lookups = 0
+        self.matches = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _band_keys(signature: List[int]):
+        return [
+            (band, tuple(signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND]))
+            for band in range(NUM_BANDS)
+        ]
+
+    def add(self, theme: str, prompt: str, background_key: Optional[str] = None, background_ref: Optional[str] = None):
+        """Record the prompt (and optionally the image cache key of the background) generated for a theme"""
+        normalized = normalize_theme(theme)
+        if not normalized:
+            return
+        entry = self._entries.get(normalized)
+        if entry is None:
+            shingles = shingle(normalized)
+            band_keys = self._band_keys(minhash(shingles))
+            entry = ThemeEntry(theme, normalized, shingles, band_keys, prompt)
+            self._entries[normalized] = entry
+            for key in band_keys:
+                self._bands.setdefault(key, set()).add(normalized)
+            if len(self._entries) > self.max_entries:
+                self._evict(next(iter(self._entries)))
+        else:
+            entry.prompt = prompt
+            self._entries.move_to_end(normalized)
+
+        if background_key is not None and background_ref is not None:
+            self._backgrounds[(normalized, background_key)] = background_ref
+            self._backgrounds.move_to_end((normalized, background_key))
+            while len(self._backgrounds) > self.background_cache_size:
+                self._backgrounds.popitem(last=False)
+
+    def has_background(self, theme: str, background_key: str) -> bool:
+        return (normalize_theme(theme), background_key) in self._backgrounds
+
+    def background_ref(self, theme: str, background_key: str) -> Optional[str]:
+        """The image cache key stored for exactly this theme, without touching recency"""
+        return self._backgrounds.get((normalize_theme(theme), background_key))
+
+    def discard_background(self, theme: str, background_key: str):
+        self._backgrounds.pop((normalize_theme(theme), background_key), None)
+
+    def _evict(self, normalized: str):
+        entry = self._entries.pop(normalized)
+        for key in entry.band_keys:
+            bucket = self._bands.get(key)
+            if bucket is not None:
+                bucket.discard(normalized)
+                if not bucket:
+                    del self._bands[key]
+        for background_key in [k for k in self._backgrounds if k[0] == normalized]:
+            del self._backgrounds[background_key]
+
+    def _best_match(self, normalized: str) -> Tuple[Optional[ThemeEntry], float]:
+        entry = self._entries.get(normalized)
+        if entry is not None:
+            return entry, 1.0
+        shingles = shingle(normalized)
+        # Shared band count is a cheap similarity estimate for ranking candidates
+        band_hits = Counter()
+        for key in self._band_keys(minhash(shingles)):
+            bucket = self._bands.get(key)
+            if bucket and len(bucket) <= MAX_BUCKET_SCAN:
+                band_hits.update(bucket)
+        best, best_score = None, 0.0
+        for candidate, _ in band_hits.most_common(MAX_SCORED_CANDIDATES):
+            score = jaccard(shingles, self._entries[candidate].shingles)
+            if score > best_score:
+                best, best_score = self._entries[candidate], score
+        return best, best_score
+
+    def lookup(self, theme: str, background_key: Optional[str] = None) -> Optional[dict]:
+        """
+        Find the most similar previously seen theme.
+
+        Returns a dict with the matched theme, its similarity, the cached prompt
+        and, when one was stored under the same background key, the image cache
+        key of the background (background_ref). Returns None when nothing clears
+        the threshold.
+        """
+        self.lookups += 1
+        normalized = normalize_theme(theme)
+        if not normalized:
+            return None
+
+        best, best_score = self._best_match(normalized)
+        if best is None or best_score < self.threshold:
+            return None
+
+        self.matches += 1
+        self._entries.move_to_end(best.normalized)
+        background_ref = None
+        if background_key is not None:
+            background_ref = self._backgrounds.get((best.normalized, background_key))
+            if background_ref is not None:
+                self._backgrounds.move_to_end((best.normalized, background_key))
+        return {
+            "matched_theme": best.theme,
+            "similarity": round(best_score, 4),
+            "prompt": best.prompt,
+            "background_ref": background_ref,
+        }
+
+    def prompt_for(self, theme: str) -> Optional[str]:
+        """The prompt lookup() would reuse for a theme, without counting a lookup or touching recency"""
+        normalized = normalize_theme(theme)
+        if not normalized:
+            return None
+        best, best_score = self._best_match(normalized)
+        if best is None or best_score < self.threshold:
+            return None
+        return best.prompt
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "cached_backgrounds": len(self._backgrounds),
+            "lookups": self.lookups,
+            "matches": self.matches,
+            "threshold": self.threshold,
+        }
+
+
+theme_index = ThemeIndex()
@@ -0,0 +1,161 @@
+import os
+import asyncio
+import hashlib
+import tempfile
+from typing import Dict, Tuple
+from dotenv import load_dotenv
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Uploads larger than this are rejected
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+# Uploads stay in memory up to this size and only spill to a temp file beyond it
+UPLOAD_SPOOL_BYTES = int(os.getenv("UPLOAD_SPOOL_BYTES", str(8 * 1024 * 1024)))
+# Plain form fields are small; cap them so they can't be used to buffer a file
+MAX_FIELD_BYTES = 64 * 1024
+# Allowance for multipart boundaries, headers and form fields around the file
+MULTIPART_OVERHEAD_BYTES = 256 * 1024
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class MalformedUpload(ValueError):
+    pass
+
+
+class SpooledUpload:
+    """An uploaded file held in memory (or a temp file past the threshold), hashed as it arrived"""
+
+    __slots__ = ("filename", "content_type", "file", "size", "_hasher")
+
+    def __init__(self, filename: str, content_type: str, spool_bytes: int):
+        self.filename = filename
+        self.content_type = content_type
+        self.file = tempfile.SpooledTemporaryFile(max_size=spool_bytes)
+        self.size = 0
+        self._hasher = hashlib.sha256()
+
+    @property
+    def sha256(self) -> str:
+        return self._hasher.hexdigest()
+
+    @property
+    def in_memory(self) -> bool:
+        return not self.file._rolled
+
+    def close(self):
+        self.file.close()
+
+
+async def read_multipart_upload(request, max_bytes: int = MAX_UPLOAD_BYTES,
+                                spool_bytes: int = UPLOAD_SPOOL_BYTES) -> Tuple[Dict[str, str], Dict[str, SpooledUpload]]:
+    """
+    Stream a multipart/form-data body into form fields and spooled uploads.
+
+    Files are hashed while they stream in, and nothing is written to disk
+    unless a file outgrows spool_bytes. Each file is capped at max_bytes and
+    the whole body, however many parts it has, at max_bytes plus the
+    multipart overhead; requests are rejected with UploadTooLarge as soon as
+    the Content-Length or the streamed bytes pass a cap, without buffering
+    the rest.
+    """
+    max_body_bytes = max_bytes + MULTIPART_OVERHEAD_BYTES
+    content_length = request.headers.get("content-length")
+    if content_length is not None:
+        if not content_length.isdigit():
+            raise MalformedUpload("Invalid Content-Length header")
+        if int(content_length) > max_body_bytes:
+            raise UploadTooLarge(f"Upload exceeds the {max_bytes} byte limit")
+
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise ValueError("Expected a multipart/form-data request")
+
+    fields: Dict[str, str] = {}
+    uploads: Dict[str, SpooledUpload] = {}
+    pending_writes = []
+    part = {}
+    body_bytes = 0
+
+    def on_part_begin():
+        part.clear()
+        part.update(headers={}, header_field=b"", header_value=b"", name=None, upload=None, data=bytearray())
+
+    def on_header_field(data, start, end):
+        part["header_field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        part["header_value"] += data[start:end]
+
+    def on_header_end():
+        part["headers"][part["header_field"].lower()] = part["header_value"]
+        part["header_field"] = b""
+        part["header_value"] = b""
+
+    def on_headers_finished():
+        _, options = parse_options_header(part["headers"].get(b"content-disposition", b""))
+        part["name"] = options.get(b"name", b"").decode()
+        if b"filename" in options:
+            upload = SpooledUpload(
+                options[b"filename"].decode(),
+                part["headers"].get(b"content-type", b"application/octet-stream").decode(),
+                spool_bytes,
+            )
+            uploads[part["name"]] = upload
+            part["upload"] = upload
+
+    def on_part_data(data, start, end):
+        chunk = data[start:end]
+        upload = part["upload"]
+        if upload is None:
+            part["data"] += chunk
+            if len(part["data"]) > MAX_FIELD_BYTES:
+                raise UploadTooLarge(f"Form field '{part['name']}' is too large")
+            return
+        upload.size += len(chunk)
+        if upload.size > max_bytes:
+            raise UploadTooLarge(f"Upload exceeds the {max_bytes} byte limit")
+        upload._hasher.update(chunk)
+        pending_writes.append((upload, bytes(chunk)))
+
+    def on_part_end():
+        if part["upload"] is None:
+            fields[part["name"]] = part["data"].decode()
+
+    parser = MultipartParser(params[b"boundary"], {
+        "on_part_begin": on_part_begin,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+    })
+
+    try:
+        async for chunk in request.stream():
+            # Chunked bodies carry no Content-Length, and many parts can each stay under their own cap
+            body_bytes += len(chunk)
+            if body_bytes > max_body_bytes:
+                raise UploadTooLarge(f"Upload exceeds the {max_bytes} byte limit")
+            parser.write(chunk)
+            for upload, data in pending_writes:
+                if upload.in_memory:
+                    upload.file.write(data)
+                else:
+                    # Past the spool threshold the write hits disk; keep it off the event loop
+                    await asyncio.to_thread(upload.file.write, data)
+            pending_writes.clear()
+        parser.finalize()
+    except BaseException:
+        for upload in uploads.values():
+            upload.close()
+        raise
+
+    for upload in uploads.values():
+        upload.file.seek(0)
+    return fields, uploads
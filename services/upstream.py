@@ -0,0 +1,198 @@
+import os
+import asyncio
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional, Tuple
+import aiohttp
+from dotenv import load_dotenv
+from services.cassette import cassette
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Per-upstream (connect, read) timeouts in seconds
+UPSTREAM_TIMEOUTS = {
+    "fal": (
+        float(os.getenv("FAL_CONNECT_TIMEOUT", "5")),
+        float(os.getenv("FAL_READ_TIMEOUT", "120")),
+    ),
+    "openai": (
+        float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5")),
+        float(os.getenv("OPENAI_READ_TIMEOUT", "60")),
+    ),
+}
+# Budget applied when the client doesn't send X-Deadline-Ms; 0 means none
+DEFAULT_DEADLINE_MS = int(os.getenv("REQUEST_DEADLINE_MS", "0"))
+# Fire a duplicate request once an upstream call runs past its observed p95
+HEDGING_ENABLED = os.getenv("UPSTREAM_HEDGING", "false").lower() in ("1", "true", "yes")
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+LATENCY_WINDOW = 200
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Deadline:
+    __slots__ = ("expires_at",)
+
+    def __init__(self, budget_ms: float):
+        self.expires_at = time.monotonic() + budget_ms / 1000
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+
+current_deadline: ContextVar[Optional[Deadline]] = ContextVar("current_deadline", default=None)
+
+
+@contextmanager
+def deadline_scope(budget_ms: Optional[float]):
+    """
+    Set the request deadline for everything started inside the block.
+
+    Tasks and threadpool calls copy the context when created, so stages
+    spawned from here see the same deadline.
+    """
+    token = current_deadline.set(Deadline(budget_ms) if budget_ms else None)
+    try:
+        yield current_deadline.get()
+    finally:
+        current_deadline.reset(token)
+
+
+def parse_deadline_header(value: Optional[str]) -> Optional[float]:
+    if value is None:
+        return DEFAULT_DEADLINE_MS or None
+    try:
+        budget_ms = float(value)
+    except ValueError:
+        raise ValueError(f"Invalid X-Deadline-Ms header: {value}")
+    if budget_ms <= 0:
+        raise ValueError("X-Deadline-Ms must be positive")
+    return budget_ms
+
+
+def remaining_budget() -> Optional[float]:
+    """Seconds left before the current deadline, or None when there isn't one"""
+    deadline = current_deadline.get()
+    if deadline is None:
+        return None
+    remaining = deadline.remaining()
+    if remaining <= 0:
+        raise DeadlineExceeded("Request deadline exceeded")
+    return remaining
+
+
+def check_deadline():
+    remaining_budget()
+
+
+class LatencyTracker:
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.samples = deque(maxlen=window)
+
+    def record(self, seconds: float):
+        self.samples.append(seconds)
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+latency_trackers = {name: LatencyTracker() for name in UPSTREAM_TIMEOUTS}
+hedge_stats = {"fired": 0, "won": 0}
+
+
+def _client_timeout(upstream: str) -> aiohttp.ClientTimeout:
+    connect, read = UPSTREAM_TIMEOUTS[upstream]
+    remaining = remaining_budget()
+    total = read if remaining is None else min(read, remaining)
+    return aiohttp.ClientTimeout(total=total, sock_connect=min(connect, total))
+
+
+async def _post_once(session, upstream, url, headers, json_body) -> Tuple[int, dict]:
+    started = time.monotonic()
+    async with session.post(url, headers=headers, json=json_body, timeout=_client_timeout(upstream)) as response:
+        body = await response.json(content_type=None)
+        latency_trackers[upstream].record(time.monotonic() - started)
+        return response.status, body
+
+
+async def _hedged(session, upstream, url, headers, json_body, hedge_after: float):
+    primary = asyncio.ensure_future(_post_once(session, upstream, url, headers, json_body))
+    done, _ = await asyncio.wait({primary}, timeout=hedge_after)
+    if done:
+        return primary.result()
+
+    hedge_stats["fired"] += 1
+    backup = asyncio.ensure_future(_post_once(session, upstream, url, headers, json_body))
+    pending = {primary, backup}
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is backup:
+                        hedge_stats["won"] += 1
+                    return task.result()
+        # Both attempts failed; surface the primary's error
+        return primary.result()
+    finally:
+        for task in (primary, backup):
+            if not task.done():
+                task.cancel()
+
+
+async def post_json(session: aiohttp.ClientSession, upstream: str, url: str, headers: dict,
+                    json_body: dict, hedge: bool = False) -> Tuple[int, dict]:
+    """
+    POST to an upstream and decode the JSON reply, returning (status, body).
+
+    Applies the upstream's connect/read timeouts, capped by whatever remains of
+    the request deadline. Only calls passing hedge=True are ever duplicated by
+    hedging; a backup request is billed again and runs outside any slot the
+    caller holds, so paid generations never opt in. Timeouts surface as DeadlineExceeded when the request
+    deadline is what ran out, and as asyncio.TimeoutError otherwise. With
+    UPSTREAM_CASSETTE_MODE set, the exchange is recorded or replayed.
+    """
+    if cassette.enabled:
+        status, body = await cassette.call_async(
+            f"{upstream}.post", {"url": url, "json": json_body},
+            lambda: _post_json(session, upstream, url, headers, json_body, hedge)
+        )
+        return status, body
+    return await _post_json(session, upstream, url, headers, json_body, hedge)
+
+
+async def _post_json(session, upstream, url, headers, json_body, hedge) -> Tuple[int, dict]:
+    try:
+        if hedge and HEDGING_ENABLED and len(latency_trackers[upstream].samples) >= HEDGE_MIN_SAMPLES:
+            hedge_after = latency_trackers[upstream].percentile(0.95)
+            remaining = remaining_budget()
+            if remaining is None or hedge_after < remaining:
+                return await _hedged(session, upstream, url, headers, json_body, hedge_after)
+        return await _post_once(session, upstream, url, headers, json_body)
+    except asyncio.TimeoutError:
+        deadline = current_deadline.get()
+        if deadline is not None and deadline.remaining() <= 0:
+            raise DeadlineExceeded(f"Request deadline exceeded waiting for {upstream}")
+        raise
+
+
+def upstream_stats() -> dict:
+    stats = {}
+    for name, tracker in latency_trackers.items():
+        p50 = tracker.percentile(0.5)
+        p95 = tracker.percentile(0.95)
+        stats[name] = {
+            "samples": len(tracker.samples),
+            "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+        }
+    stats["hedges"] = dict(hedge_stats)
+    return stats
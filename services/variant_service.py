@@ -0,0 +1,114 @@
+import os
+import asyncio
+import hashlib
+import io
+from collections import Counter
+from typing import Dict, Optional, Tuple
+from PIL import Image
+from dotenv import load_dotenv
+from services.disk_cache import DiskLRUCache
+from services.memory_budget import BANNER_BYTES_PER_PIXEL, admission
+
+# Load environment variables from .env file
+load_dotenv()
+
+VARIANT_CACHE_DIR = os.getenv("VARIANT_CACHE_DIR", "variant_cache")
+VARIANT_CACHE_MAX_BYTES = int(os.getenv("VARIANT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+variant_cache = DiskLRUCache(VARIANT_CACHE_DIR, VARIANT_CACHE_MAX_BYTES, suffix=".img")
+
+VARIANT_FORMATS = {
+    "jpeg": ("JPEG", "image/jpeg"),
+    "webp": ("WEBP", "image/webp"),
+    "png": ("PNG", "image/png"),
+}
+MIN_VARIANT_WIDTH = 16
+DEFAULT_QUALITY = 80
+
+variant_stats = Counter()
+_in_flight: Dict[str, asyncio.Task] = {}
+
+
+def variant_key(content_sha256: str, width: Optional[int], image_format: str, quality: int) -> str:
+    """Variants of identical content are identical, whichever banner they came from"""
+    return hashlib.sha256(f"{content_sha256}|{width}|{image_format}|{quality}".encode()).hexdigest()
+
+
+def validate_variant(width: Optional[int], image_format: str, quality: int):
+    if image_format not in VARIANT_FORMATS:
+        raise ValueError(f"Unsupported format '{image_format}'; use one of {', '.join(VARIANT_FORMATS)}")
+    if width is not None and width < MIN_VARIANT_WIDTH:
+        raise ValueError(f"width must be at least {MIN_VARIANT_WIDTH}")
+    if not 1 <= quality <= 100:
+        raise ValueError("quality must be between 1 and 100")
+
+
+def render_variant(path: str, width: Optional[int], image_format: str, quality: int) -> bytes:
+    """
+    Downscale a stored banner to width (never up) and encode it.
+
+    JPEG sources are decoded at a reduced DCT scale via draft(), and other
+    sources are shrunk by an integer factor with reduce() before the final
+    Lanczos pass, so a thumbnail never resamples the full-size canvas.
+    """
+    pil_format, _ = VARIANT_FORMATS[image_format]
+    with Image.open(path) as image:
+        target_width = min(width or image.width, image.width)
+        target_size = (target_width, max(1, round(image.height * target_width / image.width)))
+        image.draft("RGB", target_size)
+        image.load()
+        factor = min(image.width // target_size[0], image.height // target_size[1]) // 2
+        if factor > 1:
+            image = image.reduce(factor)
+        if image.size != target_size:
+            image = image.resize(target_size, Image.LANCZOS)
+        if pil_format == "JPEG":
+            image = image.convert("RGB")
+
+        buffered = io.BytesIO()
+        options = {"optimize": True} if pil_format == "PNG" else {"quality": quality}
+        image.save(buffered, format=pil_format, **options)
+    return buffered.getvalue()
+
+
+async def get_variant(banner: dict, width: Optional[int], image_format: str,
+                      quality: int = DEFAULT_QUALITY) -> Tuple[bytes, str, str]:
+    """
+    (data, content_type, key) for a variant of a catalog banner.
+
+    Served from the disk cache when present; otherwise rendered once, with
+    identical concurrent requests waiting on the same render.
+    """
+    validate_variant(width, image_format, quality)
+    _, content_type = VARIANT_FORMATS[image_format]
+    if width is not None and banner.get("width"):
+        # Widths past the original all produce the original size; share their entry
+        width = min(width, banner["width"])
+    key = variant_key(banner["content_sha256"] or banner["path"], width, image_format, quality)
+
+    data = await asyncio.to_thread(variant_cache.get, key)
+    if data is not None:
+        variant_stats["cache_hits"] += 1
+        return data, content_type, key
+
+    task = _in_flight.get(key)
+    if task is None:
+        variant_stats["rendered"] += 1
+        task = asyncio.ensure_future(_render_and_store(key, banner, width, image_format, quality))
+        _in_flight[key] = task
+        task.add_done_callback(lambda _: _in_flight.pop(key, None))
+    else:
+        variant_stats["coalesced"] += 1
+    # Shielded so one client going away doesn't cancel the render others wait on
+    return await asyncio.shield(task), content_type, key
+
+
+async def _render_and_store(key: str, banner: dict, width: Optional[int], image_format: str, quality: int) -> bytes:
+    source_pixels = (banner.get("width") or 1024) * (banner.get("height") or 1024)
+    async with admission.reserve(source_pixels * BANNER_BYTES_PER_PIXEL):
+        data = await asyncio.to_thread(render_variant, banner["path"], width, image_format, quality)
+    await asyncio.to_thread(variant_cache.put, key, data)
+    return data
+
+
+def variant_cache_stats() -> dict:
+    return {**variant_cache.stats(), **variant_stats, "in_flight": len(_in_flight)}
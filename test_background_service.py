@@ -0,0 +1,123 @@
+import io
+import json
+import os
+from types import SimpleNamespace
+
+# background.service builds its OpenAI client at import time; no request is made in these tests
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+from background import prompt_schema as schema, service
+from services.disk_cache import DiskLRUCache
+
+SUMMARY = {
+    "colors": ["#112233"],
+    "typography": {"headline": "Inter Bold"},
+    "visual_elements": "soft gradients",
+    "layout_principles": "generous margins",
+}
+
+
+def _prompt_set_reply():
+    def texts(record):
+        return {name: "x" for name in record.FIELDS}
+    prompt = {
+        "background": {
+            "main_premise": "a calm gradient",
+            "composition": texts(schema.Composition),
+            "style": {"colors": texts(schema.StyleColors), "texture": "x", "lighting": "x", "mood": "x"},
+            "technical": texts(schema.Technical),
+        },
+        "text_specifications": {
+            "content": texts(schema.TextContent),
+            "typography": texts(schema.Typography),
+            "colors": texts(schema.TextColors),
+            "layout": texts(schema.TextLayout),
+        },
+    }
+    reply = json.dumps({"prompts": [prompt]})
+    assert schema.PromptSet.from_dict(json.loads(reply))
+    return reply
+
+
+class _FakeCassette:
+    """Stands in for the OpenAI side: every created object is an id, every run streams canned text"""
+
+    def __init__(self, analysis):
+        self.analysis = analysis
+        self.calls = []
+
+    def call(self, kind, request, factory, encode=None, decode=None):
+        self.calls.append(kind)
+        if kind == "openai.chat":
+            return _prompt_set_reply()
+        return SimpleNamespace(id=kind)
+
+    def stream(self, kind, request, handler, run):
+        self.calls.append(f"{kind}:{request['stage']}")
+        text = self.analysis if request["stage"] == "analysis" else _prompt_set_reply()
+        handler.on_text_delta(SimpleNamespace(value=text), None)
+
+
+def _setup(monkeypatch, tmp_path, analysis):
+    # _split_prompt_response writes its debug files to the working directory
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(service, "guidelines_cache", DiskLRUCache(str(tmp_path / "cache"), 1024 * 1024, ".json"))
+    fake = _FakeCassette(analysis)
+    monkeypatch.setattr(service, "cassette", fake)
+    return fake
+
+
+def test_hash_is_the_same_for_a_path_and_a_file_object(tmp_path):
+    path = tmp_path / "guidelines.pdf"
+    path.write_bytes(b"%PDF brand guidelines" * 100000)
+    file = io.BytesIO(path.read_bytes())
+
+    assert service.guidelines_sha256(str(path)) == service.guidelines_sha256(file)
+    # Left rewound for the upload that may follow
+    assert file.tell() == 0
+    assert service.guidelines_sha256(io.BytesIO(b"other guidelines")) != service.guidelines_sha256(file)
+
+
+def test_repeated_guidelines_skip_the_assistant(monkeypatch, tmp_path):
+    fake = _setup(monkeypatch, tmp_path, json.dumps(SUMMARY))
+    guidelines = io.BytesIO(b"brand guidelines")
+
+    first, _ = service.generate_background_prompts(guidelines, "company", "event")
+    assert "openai.run:analysis" in fake.calls
+    assert service._cached_summary(service.guidelines_sha256(guidelines)) == SUMMARY
+
+    fake.calls.clear()
+    second, _ = service.generate_background_prompts(io.BytesIO(b"brand guidelines"), "company", "event")
+    # One chat completion from the cached summary: no upload, thread or run
+    assert fake.calls == ["openai.chat"]
+    assert second == first
+
+
+def test_changed_guidelines_miss_the_cache(monkeypatch, tmp_path):
+    fake = _setup(monkeypatch, tmp_path, json.dumps(SUMMARY))
+    service.generate_background_prompts(io.BytesIO(b"brand guidelines v1"), "company", "event")
+
+    fake.calls.clear()
+    service.generate_background_prompts(io.BytesIO(b"brand guidelines v2"), "company", "event")
+    assert "openai.file" in fake.calls
+    assert "openai.run:analysis" in fake.calls
+
+
+def test_analysis_that_is_not_json_is_not_cached(monkeypatch, tmp_path):
+    fake = _setup(monkeypatch, tmp_path, "I could not read the attached file.")
+    guidelines = io.BytesIO(b"brand guidelines")
+
+    prompts, _ = service.generate_background_prompts(guidelines, "company", "event")
+    assert len(prompts) == 1
+    assert service._cached_summary(service.guidelines_sha256(guidelines)) is None
+    # One repair was tried, and its reply didn't match either
+    assert fake.calls.count("openai.chat") == 1
+
+
+def test_fenced_analysis_is_cleaned_before_caching(monkeypatch, tmp_path):
+    fake = _setup(monkeypatch, tmp_path, "Here is the summary:\n```json\n" + json.dumps(SUMMARY)[:-1] + ",}\n```")
+    guidelines = io.BytesIO(b"brand guidelines")
+
+    service.generate_background_prompts(guidelines, "company", "event")
+    assert service._cached_summary(service.guidelines_sha256(guidelines)) == SUMMARY
+    # Cleaned locally, without a repair call
+    assert fake.calls.count("openai.chat") == 0
@@ -0,0 +1,88 @@
+from types import SimpleNamespace
+import pytest
+from services import banner_catalog as catalog_module
+from services.banner_catalog import BannerCatalog
+
+
+def _catalog(monkeypatch, tmp_path, timestamps):
+    """A fresh catalog whose saves are stamped with the given created_at values, in order"""
+    clock = iter(timestamps)
+    monkeypatch.setattr(catalog_module, "time", SimpleNamespace(time=lambda: next(clock)))
+    return BannerCatalog(str(tmp_path / "catalog.db"), str(tmp_path / "banners"))
+
+
+def _save(catalog, product="Nike", theme="summer"):
+    return catalog.save(b"png", product, theme=theme)["id"]
+
+
+def _walk(catalog, limit, **filters):
+    ids, cursor, pages = [], None, 0
+    while True:
+        page = catalog.query(limit=limit, cursor=cursor, **filters)
+        ids += [banner["id"] for banner in page["banners"]]
+        pages += 1
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return ids, pages
+
+
+def test_pages_cover_every_banner_once_newest_first(monkeypatch, tmp_path):
+    # Three banners share a timestamp, so the id breaks the tie
+    catalog = _catalog(monkeypatch, tmp_path, [100.0, 200.0, 200.0, 200.0, 300.0])
+    saved = [_save(catalog) for _ in range(5)]
+
+    ids, pages = _walk(catalog, limit=2)
+    assert ids == [saved[4], saved[3], saved[2], saved[1], saved[0]]
+    assert pages == 3
+
+
+def test_cursor_at_the_last_row_has_no_next_page(monkeypatch, tmp_path):
+    catalog = _catalog(monkeypatch, tmp_path, [100.0, 200.0, 300.0, 400.0])
+    for _ in range(4):
+        _save(catalog)
+
+    first = catalog.query(limit=2)
+    second = catalog.query(limit=2, cursor=first["next_cursor"])
+    assert len(second["banners"]) == 2
+    # Exactly full: no cursor pointing at an empty page
+    assert second["next_cursor"] is None
+    assert catalog.query(limit=4)["next_cursor"] is None
+
+
+def test_cursor_inside_a_tie_resumes_after_it(monkeypatch, tmp_path):
+    catalog = _catalog(monkeypatch, tmp_path, [200.0, 200.0, 200.0])
+    saved = [_save(catalog) for _ in range(3)]
+
+    first = catalog.query(limit=1)
+    assert first["next_cursor"] == f"{200.0!r}:{saved[2]}"
+    second = catalog.query(limit=1, cursor=first["next_cursor"])
+    assert [banner["id"] for banner in second["banners"]] == [saved[1]]
+
+
+def test_new_banners_do_not_shift_later_pages(monkeypatch, tmp_path):
+    catalog = _catalog(monkeypatch, tmp_path, [100.0, 200.0, 300.0, 400.0])
+    saved = [_save(catalog) for _ in range(3)]
+
+    first = catalog.query(limit=2)
+    _save(catalog)
+    second = catalog.query(limit=2, cursor=first["next_cursor"])
+    assert [banner["id"] for banner in second["banners"]] == [saved[0]]
+
+
+def test_filters_combine_with_the_cursor(monkeypatch, tmp_path):
+    catalog = _catalog(monkeypatch, tmp_path, [100.0, 200.0, 300.0, 400.0, 500.0])
+    nike_summer = [_save(catalog, "Nike", "summer"), _save(catalog, "Nike", "summer")]
+    nike_winter = _save(catalog, "Nike", "winter")
+    _save(catalog, "Adidas", "summer")
+    nike_summer.append(_save(catalog, "Nike", "summer"))
+
+    ids, _ = _walk(catalog, limit=1, product_name="nike", theme="SUMMER")
+    assert ids == nike_summer[::-1]
+    ids, _ = _walk(catalog, limit=1, product_name="Nike", since=200.0, until=500.0)
+    assert ids == [nike_winter, nike_summer[1]]
+
+
+def test_invalid_cursor_is_rejected(monkeypatch, tmp_path):
+    catalog = _catalog(monkeypatch, tmp_path, [])
+    with pytest.raises(ValueError):
+        catalog.query(cursor="not-a-cursor")
@@ -0,0 +1,56 @@
+import asyncio
+from services.batch_scheduler import BatchPlan, PriorityLimiter
+
+
+def test_priority_limiter_serves_the_lowest_priority_first():
+    async def scenario():
+        limiter = PriorityLimiter(1)
+        order = []
+
+        async def call(priority):
+            await limiter.acquire(priority)
+            order.append(priority)
+            await asyncio.sleep(0.01)
+            limiter.release()
+
+        first = asyncio.create_task(call(5))
+        await asyncio.sleep(0)
+        rest = [asyncio.create_task(call(priority)) for priority in (3, 1, 2)]
+        await asyncio.gather(first, *rest)
+        assert order == [5, 1, 2, 3]
+        assert limiter.available == 1
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_passes_its_slot_on():
+    async def scenario():
+        limiter = PriorityLimiter(1)
+        await limiter.acquire(0)
+        cancelled = asyncio.create_task(limiter.acquire(1))
+        waiting = asyncio.create_task(limiter.acquire(2))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        limiter.release()
+        await asyncio.gather(cancelled, return_exceptions=True)
+        await asyncio.wait_for(waiting, timeout=1)
+        limiter.release()
+        assert limiter.available == 1
+    asyncio.run(scenario())
+
+
+def test_plan_runs_shared_work_once():
+    async def scenario():
+        plan = BatchPlan({"openai": 2})
+        calls = []
+
+        async def prompt():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "prompt"
+
+        results = await asyncio.gather(*(plan.run("prompt", "summer", "openai", index, prompt)
+                                         for index in range(3)))
+        assert results == ["prompt"] * 3
+        assert len(calls) == 1
+        assert plan.summary() == {"prompt": {"computed": 1, "deduplicated": 2}}
+    asyncio.run(scenario())
@@ -0,0 +1,107 @@
+import asyncio
+import json
+import os
+import threading
+import time
+
+# background.service builds its OpenAI client at import time; no request is made in these tests
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+import bulk_generate
+
+
+def _concurrency_probe():
+    lock = threading.Lock()
+    state = {"running": 0, "peak": 0}
+
+    def enter():
+        with lock:
+            state["running"] += 1
+            state["peak"] = max(state["peak"], state["running"])
+        time.sleep(0.05)
+        with lock:
+            state["running"] -= 1
+    return state, enter
+
+
+def test_background_items_respect_the_upstream_limits(monkeypatch, tmp_path):
+    openai, enter_openai = _concurrency_probe()
+    fal, enter_fal = _concurrency_probe()
+
+    def prompts(guidelines_file, company_context, event_context):
+        enter_openai()
+        return [{"prompt": company_context}], [{}]
+
+    def images(image_prompts, text_specs):
+        enter_fal()
+        return [{"background_prompt": image_prompts[0], "image": {"images": [{"url": "https://fal/x.png"}]}}]
+
+    monkeypatch.setattr(bulk_generate, "generate_background_prompts", prompts)
+    monkeypatch.setattr(bulk_generate, "generate_background_images", images)
+    items = [(f"bg{i}", {"guidelines_file": "g.pdf", "company_context": f"c{i}", "event_context": "e"})
+             for i in range(4)]
+
+    progress = asyncio.run(bulk_generate.run(items, {}, str(tmp_path), 4, None, {"openai": 1, "fal": 1}))
+    assert progress.counts["ok"] == 4
+    assert openai["peak"] == 1
+    assert fal["peak"] == 1
+
+
+def test_resume_reruns_partial_and_failed_items(monkeypatch, tmp_path):
+    with open(tmp_path / bulk_generate.MANIFEST_NAME, "w") as f:
+        for item_id, status in (("a", "ok"), ("b", "partial"), ("c", "error")):
+            f.write(json.dumps({"id": item_id, "status": status}) + "\n")
+    ran = []
+
+    async def run_item(session, plan, index, item_id, item, defaults, output_dir, item_timeout, previous=None):
+        ran.append(item_id)
+        return {"id": item_id, "status": "ok"}
+    monkeypatch.setattr(bulk_generate, "run_item", run_item)
+
+    items = [(item_id, {}) for item_id in ("a", "b", "c", "d")]
+    asyncio.run(bulk_generate.run(items, {}, str(tmp_path), 2, None, {"openai": 1, "fal": 1}))
+    assert sorted(ran) == ["b", "c", "d"]
+
+
+def test_partial_item_regenerates_only_its_failed_banner_types(monkeypatch, tmp_path):
+    with open(tmp_path / bulk_generate.MANIFEST_NAME, "w") as f:
+        f.write(json.dumps({"id": "a", "kind": "ad", "status": "partial", "banners": [
+            {"banner_type": "default", "banner_id": 1, "path": "a_default.png", "renditions": []},
+            {"banner_type": "wide", "error": "FAL API returned status 500"},
+        ]}) + "\n")
+    requested = []
+
+    async def generate_campaign_item(session, plan, index, defaults, item):
+        requested.append(item["banner_types"])
+        return {"index": index, "status": "ok", "banners": [
+            {"banner_id": 2, "saved_image_path": "a_wide.png"} for _ in item["banner_types"]
+        ]}
+    monkeypatch.setattr(bulk_generate, "generate_campaign_item", generate_campaign_item)
+
+    items = [("a", {"product_name": "Nike", "theme": "summer", "banner_types": ["default", "wide"]})]
+    asyncio.run(bulk_generate.run(items, {}, str(tmp_path), 1, None, {"openai": 1, "fal": 1}))
+    assert requested == [["wide"]]
+
+    entry = bulk_generate.load_manifest(str(tmp_path / bulk_generate.MANIFEST_NAME))["a"]
+    assert entry["status"] == "ok"
+    assert [(banner["banner_type"], banner["banner_id"]) for banner in entry["banners"]] == [
+        ("default", 1), ("wide", 2)
+    ]
+
+
+def test_retry_that_fails_again_stays_partial(monkeypatch, tmp_path):
+    with open(tmp_path / bulk_generate.MANIFEST_NAME, "w") as f:
+        f.write(json.dumps({"id": "a", "kind": "ad", "status": "partial", "banners": [
+            {"banner_type": "default", "banner_id": 1, "path": "a_default.png", "renditions": []},
+            {"banner_type": "wide", "error": "FAL API returned status 500"},
+        ]}) + "\n")
+
+    async def generate_campaign_item(session, plan, index, defaults, item):
+        return {"index": index, "status": "error", "banners": [{"error": "still failing"}]}
+    monkeypatch.setattr(bulk_generate, "generate_campaign_item", generate_campaign_item)
+
+    items = [("a", {"product_name": "Nike", "theme": "summer", "banner_types": ["default", "wide"]})]
+    asyncio.run(bulk_generate.run(items, {}, str(tmp_path), 1, None, {"openai": 1, "fal": 1}))
+    entry = bulk_generate.load_manifest(str(tmp_path / bulk_generate.MANIFEST_NAME))["a"]
+    assert entry["status"] == "partial"
+    assert entry["banners"][0]["banner_id"] == 1
+    assert entry["banners"][1] == {"banner_type": "wide", "error": "still failing"}
@@ -0,0 +1,30 @@
+import asyncio
+import pytest
+from services.cancellation import gather_or_cancel
+
+
+def test_gather_or_cancel_cancels_siblings_on_first_failure():
+    cancelled = []
+
+    async def slow(name):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(name)
+            raise
+
+    async def failing():
+        await asyncio.sleep(0.01)
+        raise TimeoutError("out of budget")
+
+    with pytest.raises(TimeoutError):
+        asyncio.run(gather_or_cancel(slow("a"), failing(), slow("b")))
+    assert sorted(cancelled) == ["a", "b"]
+
+
+def test_gather_or_cancel_returns_results_in_order():
+    async def value(delay, result):
+        await asyncio.sleep(delay)
+        return result
+
+    assert asyncio.run(gather_or_cancel(value(0.02, 1), value(0, 2))) == [1, 2]
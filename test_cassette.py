@@ -0,0 +1,99 @@
+import asyncio
+import gzip
+from types import SimpleNamespace
+import pytest
+from services import upstream
+from services.cassette import Cassette, CassetteMiss
+
+
+def _recorder(tmp_path):
+    return Cassette("record", str(tmp_path / "cassette.jsonl.gz"))
+
+
+def _player(tmp_path, timing="none"):
+    return Cassette("replay", str(tmp_path / "cassette.jsonl.gz"), timing=timing)
+
+
+class _Handler:
+    def __init__(self):
+        self.events = []
+
+    def on_text_created(self, text):
+        self.events.append("created")
+
+    def on_text_delta(self, delta, snapshot):
+        self.events.append(delta.value)
+
+    def on_message_done(self, message):
+        self.events.append("done")
+
+
+def test_calls_replay_in_recorded_order_then_cycle(tmp_path):
+    recorder = _recorder(tmp_path)
+    for reply in ("first", "second"):
+        assert recorder.call("openai.chat", {"prompt": "hi"}, lambda: reply) == reply
+    recorder.call("openai.file", {"guidelines": "sha"}, lambda: SimpleNamespace(id="file-1"),
+                  encode=lambda obj: {"id": obj.id})
+
+    player = _player(tmp_path)
+
+    def offline():
+        raise AssertionError("replay must not call upstream")
+    assert [player.call("openai.chat", {"prompt": "hi"}, offline) for _ in range(3)] == ["first", "second", "first"]
+    uploaded = player.call("openai.file", {"guidelines": "sha"}, offline, decode=lambda data: SimpleNamespace(**data))
+    assert uploaded.id == "file-1"
+    assert player.stats()["replayed"] == 4
+
+
+def test_streams_replay_their_text_events(tmp_path):
+    recorder = _recorder(tmp_path)
+    live = _Handler()
+
+    def run():
+        live.on_text_created(None)
+        for value in ('{"a"', ": 1}"):
+            live.on_text_delta(SimpleNamespace(value=value), None)
+        live.on_message_done(None)
+    recorder.stream("openai.run", {"stage": "analysis"}, live, run)
+
+    replayed = _Handler()
+    _player(tmp_path).stream("openai.run", {"stage": "analysis"}, replayed, lambda: None)
+    assert replayed.events == live.events == ["created", '{"a"', ": 1}", "done"]
+
+
+def test_post_json_is_recorded_without_headers(monkeypatch, tmp_path):
+    async def post(session, name, url, headers, json_body, hedge):
+        return 200, {"images": ["ok"]}
+    monkeypatch.setattr(upstream, "_post_json", post)
+
+    monkeypatch.setattr(upstream, "cassette", _recorder(tmp_path))
+    headers = {"Authorization": "Key secret-fal-key"}
+    recorded = asyncio.run(upstream.post_json(None, "fal", "https://fal.run/model", headers, {"prompt": "shoe"}))
+    with gzip.open(tmp_path / "cassette.jsonl.gz", "rt") as f:
+        assert "secret-fal-key" not in f.read()
+
+    monkeypatch.setattr(upstream, "cassette", _player(tmp_path))
+    monkeypatch.setattr(upstream, "_post_json", None)
+    # A different key still matches: credentials are not part of the request identity
+    replayed = asyncio.run(upstream.post_json(None, "fal", "https://fal.run/model", {}, {"prompt": "shoe"}))
+    assert replayed == recorded == (200, {"images": ["ok"]})
+
+
+def test_replay_miss_raises_instead_of_going_upstream(tmp_path):
+    _recorder(tmp_path).call("openai.chat", {"prompt": "hi"}, lambda: "reply")
+    player = _player(tmp_path)
+    calls = []
+
+    with pytest.raises(CassetteMiss):
+        player.call("openai.chat", {"prompt": "something else"}, lambda: calls.append(1))
+    with pytest.raises(CassetteMiss):
+        asyncio.run(player.call_async("fal.post", {"url": "x"}, lambda: calls.append(1)))
+    assert calls == []
+    assert player.stats()["misses"] == 2
+
+
+def test_invalid_settings_are_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        Cassette("replay-ish", str(tmp_path / "c.gz"))
+    with pytest.raises(ValueError):
+        Cassette("off", str(tmp_path / "c.gz"), timing="fast")
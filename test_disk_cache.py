@@ -0,0 +1,59 @@
+import os
+import time
+from services.disk_cache import STALE_TEMP_SECONDS, DiskLRUCache
+
+
+def test_evicts_least_recently_used_past_budget(tmp_path):
+    cache = DiskLRUCache(str(tmp_path), max_bytes=10)
+    cache.put("a", b"aaaa")
+    cache.put("b", b"bbbb")
+    assert cache.get("a") == b"aaaa"
+    cache.put("c", b"cccc")
+    assert "b" not in cache
+    assert cache.get("a") == b"aaaa"
+    assert cache.get("c") == b"cccc"
+    assert cache.stats()["bytes"] == 8
+    assert cache.stats()["evictions"] == 1
+    assert not os.path.exists(tmp_path / "b.bin")
+
+
+def test_entry_larger_than_budget_is_not_stored(tmp_path):
+    cache = DiskLRUCache(str(tmp_path), max_bytes=4)
+    cache.put("big", b"12345")
+    assert cache.get("big") is None
+    assert os.listdir(tmp_path) == []
+
+
+def test_restart_rebuilds_recency_from_mtimes(tmp_path):
+    cache = DiskLRUCache(str(tmp_path), max_bytes=100)
+    cache.put("old", b"1111")
+    cache.put("new", b"2222")
+    now = time.time()
+    os.utime(tmp_path / "old.bin", (now - 100, now - 100))
+    os.utime(tmp_path / "new.bin", (now, now))
+
+    reopened = DiskLRUCache(str(tmp_path), max_bytes=6)
+    assert "old" not in reopened
+    assert reopened.get("new") == b"2222"
+
+
+def test_startup_scan_only_removes_stale_temp_files(tmp_path):
+    stale = tmp_path / ".tmpstale"
+    stale.write_bytes(b"x")
+    old = time.time() - STALE_TEMP_SECONDS - 60
+    os.utime(stale, (old, old))
+    # Another process's write in progress
+    fresh = tmp_path / ".tmpfresh"
+    fresh.write_bytes(b"y")
+
+    DiskLRUCache(str(tmp_path), max_bytes=100)
+    assert not stale.exists()
+    assert fresh.exists()
+
+
+def test_entry_removed_by_another_process_is_a_miss(tmp_path):
+    cache = DiskLRUCache(str(tmp_path), max_bytes=100)
+    cache.put("k", b"data")
+    os.remove(tmp_path / "k.bin")
+    assert cache.get("k") is None
+    assert cache.stats()["bytes"] == 0
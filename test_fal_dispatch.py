@@ -0,0 +1,60 @@
+import asyncio
+from services.fal_dispatch import AffinityDispatcher, affinity_key
+
+
+async def _run(dispatcher, key, order, hold=0.01):
+    async with dispatcher.slot(key):
+        order.append(key)
+        await asyncio.sleep(hold)
+
+
+def test_affinity_key_ignores_lora_order():
+    first = affinity_key("fal-ai/flux-lora", [{"path": "b"}, {"path": "a"}])
+    assert first == affinity_key("fal-ai/flux-lora", [{"path": "a"}, {"path": "b"}])
+    assert affinity_key("fal-ai/flux/dev", None) == ("fal-ai/flux/dev", ())
+
+
+def test_queued_work_with_the_running_adapter_goes_first():
+    async def scenario():
+        dispatcher = AffinityDispatcher(concurrency=1, window_ms=10000)
+        order = []
+        tasks = [asyncio.create_task(_run(dispatcher, "a", order))]
+        await asyncio.sleep(0)
+        for key in ("b", "a", "b", "a"):
+            tasks.append(asyncio.create_task(_run(dispatcher, key, order)))
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+        assert order == ["a", "a", "a", "b", "b"]
+        assert dispatcher.stats()["adapter_switches"] == 1
+    asyncio.run(scenario())
+
+
+def test_oldest_waiter_is_not_starved_past_the_window():
+    async def scenario():
+        dispatcher = AffinityDispatcher(concurrency=1, window_ms=0)
+        order = []
+        tasks = [asyncio.create_task(_run(dispatcher, "a", order))]
+        await asyncio.sleep(0)
+        for key in ("b", "a"):
+            tasks.append(asyncio.create_task(_run(dispatcher, key, order)))
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+        assert order == ["a", "b", "a"]
+        assert dispatcher.stats()["starvation_overrides"] == 1
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_does_not_take_a_slot():
+    async def scenario():
+        dispatcher = AffinityDispatcher(concurrency=1, window_ms=10000)
+        order = []
+        running = asyncio.create_task(_run(dispatcher, "a", order, hold=0.05))
+        await asyncio.sleep(0)
+        cancelled = asyncio.create_task(_run(dispatcher, "b", order))
+        waiting = asyncio.create_task(_run(dispatcher, "c", order))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.gather(running, waiting, cancelled, return_exceptions=True)
+        assert order == ["a", "c"]
+        assert dispatcher.active == 0
+    asyncio.run(scenario())
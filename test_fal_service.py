@@ -0,0 +1,139 @@
+import asyncio
+import base64
+from services import fal_service, model_router, upstream
+from services.disk_cache import DiskLRUCache
+from services.fal_dispatch import AffinityDispatcher
+
+PNG_BASE64 = base64.b64encode(b"\x89PNG fake image bytes").decode()
+
+
+def _fal_success(calls):
+    async def post_json(session, upstream, url, headers, json_body, hedge=False):
+        calls.append(url)
+        return 200, {"images": [{"url": f"data:image/png;base64,{PNG_BASE64}", "content_type": "image/png"}],
+                     "seed": json_body.get("seed")}
+    return post_json
+
+
+def test_cache_write_failure_keeps_the_generation(monkeypatch):
+    calls = []
+    monkeypatch.setattr(fal_service, "post_json", _fal_success(calls))
+
+    def full_disk(key, data):
+        raise OSError(28, "No space left on device")
+    monkeypatch.setattr(fal_service.image_cache, "put", full_disk)
+
+    result = asyncio.run(fal_service.generate_image(None, "Nike", "a red shoe", seed=1234))
+    assert "error" not in result
+    assert result["images"][0]["content"] == PNG_BASE64
+    assert len(calls) == 1
+    # Nothing was stored, so there is nothing for the theme index to point at
+    assert "cache_key" not in result
+
+
+def test_stored_generation_is_readable_by_its_cache_key(monkeypatch, tmp_path):
+    monkeypatch.setattr(fal_service, "post_json", _fal_success([]))
+    monkeypatch.setattr(fal_service, "image_cache", DiskLRUCache(str(tmp_path), 1024 * 1024, suffix=".img"))
+
+    result = asyncio.run(fal_service.generate_image(None, "Nike", "a red shoe", seed=1234))
+    stored = fal_service.cached_image(result["cache_key"])
+    assert stored["images"][0]["content"] == PNG_BASE64
+    assert stored["cache_key"] == result["cache_key"]
+    assert fal_service.cached_image("evicted") is None
+
+
+def _half_open_breaker(monkeypatch, model):
+    monkeypatch.setattr(model_router, "breakers", {})
+    monkeypatch.setattr(model_router, "BREAKER_COOLDOWN_SECONDS", 0)
+    breaker = model_router.breaker_for(model)
+    for _ in range(model_router.BREAKER_MIN_CALLS):
+        breaker.record(False, 0.1)
+    return breaker
+
+
+def test_cache_hit_releases_the_half_open_probe(monkeypatch):
+    breaker = _half_open_breaker(monkeypatch, "fal-ai/flux-lora")
+    cached = fal_service._pack_result({"images": [{"content": PNG_BASE64, "content_type": "image/png"}]})
+    monkeypatch.setattr(fal_service.image_cache, "get", lambda key: cached)
+
+    result = asyncio.run(fal_service.generate_image(None, "Unlisted Brand", "a red shoe", seed=1234))
+    assert result["images"][0]["content"] == PNG_BASE64
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+
+
+def test_cancelled_generation_releases_the_half_open_probe(monkeypatch):
+    breaker = _half_open_breaker(monkeypatch, "fal-ai/flux-lora")
+
+    async def hanging(session, upstream, url, headers, json_body, hedge=False):
+        await asyncio.sleep(60)
+    monkeypatch.setattr(fal_service, "post_json", hanging)
+
+    async def cancel_midway():
+        task = asyncio.create_task(fal_service.generate_image(None, "Unlisted Brand", "a red shoe"))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    asyncio.run(cancel_midway())
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+
+
+class _CountingSession:
+    """Fake aiohttp session that tracks how many FAL requests are open at once"""
+
+    def __init__(self):
+        self.open = 0
+        self.peak = 0
+        self.posts = 0
+
+    def post(self, url, headers, json, timeout):
+        return _SlowResponse(self)
+
+
+class _SlowResponse:
+    status = 200
+
+    def __init__(self, session):
+        self.session = session
+
+    async def __aenter__(self):
+        self.session.open += 1
+        self.session.posts += 1
+        self.session.peak = max(self.session.peak, self.session.open)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.session.open -= 1
+
+    async def json(self, content_type=None):
+        # Far slower than the recorded p95, so every call is a hedging candidate
+        await asyncio.sleep(0.05)
+        return {"images": [{"url": f"data:image/png;base64,{PNG_BASE64}", "content_type": "image/png"}]}
+
+
+def test_hedging_never_duplicates_generations_past_the_dispatch_limit(monkeypatch):
+    monkeypatch.setattr(model_router, "breakers", {})
+    monkeypatch.setattr(upstream, "HEDGING_ENABLED", True)
+    tracker = upstream.LatencyTracker()
+    for _ in range(upstream.HEDGE_MIN_SAMPLES):
+        tracker.record(0.001)
+    monkeypatch.setitem(upstream.latency_trackers, "fal", tracker)
+    monkeypatch.setattr(fal_service, "fal_dispatcher", AffinityDispatcher(concurrency=2))
+    fired = upstream.hedge_stats["fired"]
+    session = _CountingSession()
+
+    async def generate_many():
+        return await asyncio.gather(*(
+            fal_service.generate_image(session, "Unlisted Brand", f"a red shoe {i}") for i in range(6)
+        ))
+
+    results = asyncio.run(generate_many())
+    assert all("error" not in result for result in results)
+    assert session.peak == 2
+    assert session.posts == 6
+    assert upstream.hedge_stats["fired"] == fired
@@ -0,0 +1,137 @@
+import asyncio
+import os
+import pytest
+from starlette.requests import Request
+from services.idempotency import IdempotencyKeyReused, IdempotencyStore
+
+# background.service builds its OpenAI client at import time; no request is made in these tests
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+import main
+
+
+def _counting(calls, result=({"ok": True}, 200), delay=0.01):
+    async def factory():
+        calls.append(1)
+        await asyncio.sleep(delay)
+        return result
+    return factory
+
+
+def test_concurrent_duplicates_share_one_run():
+    async def scenario():
+        store = IdempotencyStore()
+        calls = []
+        first, second = await asyncio.gather(
+            store.run("generate-ad", "key", "fp", _counting(calls)),
+            store.run("generate-ad", "key", "fp", _counting(calls)),
+        )
+        assert first == ({"ok": True}, 200, False)
+        assert second == ({"ok": True}, 200, True)
+        assert len(calls) == 1
+        assert store.stats()["attached"] == 1
+    asyncio.run(scenario())
+
+
+def test_later_duplicate_is_replayed():
+    async def scenario():
+        store = IdempotencyStore()
+        calls = []
+        await store.run("generate-ad", "key", "fp", _counting(calls))
+        assert await store.run("generate-ad", "key", "fp", _counting(calls)) == ({"ok": True}, 200, True)
+        assert len(calls) == 1
+    asyncio.run(scenario())
+
+
+def test_key_reused_with_a_different_body_is_rejected():
+    async def scenario():
+        store = IdempotencyStore()
+        await store.run("generate-ad", "key", "fp", _counting([]))
+        with pytest.raises(IdempotencyKeyReused):
+            await store.run("generate-ad", "key", "other", _counting([]))
+    asyncio.run(scenario())
+
+
+def test_server_errors_are_not_stored():
+    async def scenario():
+        store = IdempotencyStore()
+        calls = []
+        await store.run("generate-ad", "key", "fp", _counting(calls, ({"error": "boom"}, 500)))
+        await asyncio.sleep(0)
+        assert await store.run("generate-ad", "key", "fp", _counting(calls)) == ({"ok": True}, 200, False)
+        assert len(calls) == 2
+    asyncio.run(scenario())
+
+
+def test_expired_results_run_again():
+    async def scenario():
+        store = IdempotencyStore(ttl_seconds=0)
+        calls = []
+        await store.run("generate-ad", "key", "fp", _counting(calls))
+        await store.run("generate-ad", "key", "fp", _counting(calls))
+        assert len(calls) == 2
+    asyncio.run(scenario())
+
+
+def test_least_recently_used_results_are_evicted():
+    async def scenario():
+        store = IdempotencyStore(max_entries=2)
+        calls = []
+        for key in ("a", "b", "c"):
+            await store.run("generate-ad", key, "fp", _counting(calls, delay=0))
+        assert store.stats()["evicted"] == 1
+        await store.run("generate-ad", "a", "fp", _counting(calls, delay=0))
+        assert len(calls) == 4
+    asyncio.run(scenario())
+
+
+class _Upload:
+    sha256 = "guidelines-sha"
+    filename = "guidelines.pdf"
+
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def _background_request(monkeypatch):
+    """A /generate-background call with its own uploads, as the endpoint would parse them"""
+    uploads = {"guidelines_file": _Upload()}
+
+    async def parsed(request):
+        return {"company_context": "shoes", "event_context": "summer"}, uploads
+    monkeypatch.setattr(main, "read_multipart_upload", parsed)
+    scope = {"type": "http", "method": "POST", "path": "/generate-background", "headers": [(b"idempotency-key", b"k")]}
+    return main.generate_banner_api(Request(scope)), uploads
+
+
+def test_attached_and_replayed_background_requests_close_their_uploads(monkeypatch):
+    store = IdempotencyStore()
+    monkeypatch.setattr(main, "idempotency_store", store)
+    runs = []
+
+    async def run_generate_background(uploads, company_context, event_context, deadline_ms):
+        runs.append(uploads)
+        await asyncio.sleep(0.02)
+        for upload in uploads.values():
+            upload.close()
+        return {"banners": []}, 200
+    monkeypatch.setattr(main, "run_generate_background", run_generate_background)
+
+    async def scenario():
+        first, first_uploads = _background_request(monkeypatch)
+        first = asyncio.ensure_future(first)
+        await asyncio.sleep(0)
+        attached, attached_uploads = _background_request(monkeypatch)
+        responses = await asyncio.gather(first, attached)
+        replayed, replayed_uploads = _background_request(monkeypatch)
+        responses.append(await replayed)
+        return responses, [first_uploads, attached_uploads, replayed_uploads]
+
+    responses, uploads = asyncio.run(scenario())
+    assert [response.status_code for response in responses] == [200, 200, 200]
+    assert responses[2].headers["Idempotent-Replayed"] == "true"
+    assert runs == [uploads[0]]
+    assert (store.stats()["attached"], store.stats()["replayed"]) == (1, 1)
+    assert all(upload["guidelines_file"].closed for upload in uploads)
@@ -0,0 +1,115 @@
+import asyncio
+import base64
+import io
+import pytest
+from PIL import Image
+from services import banner_pipeline, memory_budget
+from services.memory_budget import MemoryAdmission, MemoryBudgetExceeded
+
+
+async def _hold(admission, nbytes, order, name, release):
+    async with admission.reserve(nbytes):
+        order.append(name)
+        await release.wait()
+
+
+def test_queued_reservations_are_admitted_in_arrival_order():
+    async def scenario():
+        admission = MemoryAdmission(100)
+        order = []
+        first_done, large_done, small_done = asyncio.Event(), asyncio.Event(), asyncio.Event()
+        first = asyncio.create_task(_hold(admission, 60, order, "first", first_done))
+        await asyncio.sleep(0)
+        large = asyncio.create_task(_hold(admission, 80, order, "large", large_done))
+        await asyncio.sleep(0)
+        # Would fit next to "first", but "large" queued before it
+        small = asyncio.create_task(_hold(admission, 30, order, "small", small_done))
+        await asyncio.sleep(0.01)
+        assert order == ["first"]
+        first_done.set()
+        await asyncio.sleep(0.01)
+        assert order == ["first", "large"]
+        large_done.set()
+        small_done.set()
+        await asyncio.gather(first, large, small)
+        assert order == ["first", "large", "small"]
+        assert admission.reserved == 0
+    asyncio.run(scenario())
+
+
+def test_timed_out_waiter_is_rejected_and_unblocks_the_queue(monkeypatch):
+    monkeypatch.setattr(memory_budget, "MEMORY_ADMISSION_WAIT_SECONDS", 0.05)
+
+    async def scenario():
+        admission = MemoryAdmission(100)
+        order = []
+        first_done, small_done = asyncio.Event(), asyncio.Event()
+        first = asyncio.create_task(_hold(admission, 60, order, "first", first_done))
+        await asyncio.sleep(0)
+        with pytest.raises(MemoryBudgetExceeded):
+            async with admission.reserve(80):
+                pass
+        # The rejected head no longer blocks a reservation that fits
+        small = asyncio.create_task(_hold(admission, 30, order, "small", small_done))
+        await asyncio.sleep(0.01)
+        assert order == ["first", "small"]
+        first_done.set()
+        small_done.set()
+        await asyncio.gather(first, small)
+        assert admission.stats()["rejected"] == 1
+        assert admission.reserved == 0
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def scenario():
+        admission = MemoryAdmission(100)
+        order = []
+        first_done = asyncio.Event()
+        first = asyncio.create_task(_hold(admission, 60, order, "first", first_done))
+        await asyncio.sleep(0)
+        waiting = asyncio.create_task(_hold(admission, 80, order, "waiting", asyncio.Event()))
+        await asyncio.sleep(0.01)
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+        first_done.set()
+        await first
+        assert order == ["first"]
+        assert admission.reserved == 0
+    asyncio.run(scenario())
+
+
+def test_reservation_larger_than_the_budget_is_rejected_up_front():
+    admission = MemoryAdmission(100)
+    with pytest.raises(MemoryBudgetExceeded):
+        admission.check(101)
+
+
+def test_llm_text_properties_are_resolved_before_memory_is_reserved(monkeypatch):
+    buffered = io.BytesIO()
+    Image.new("RGB", (64, 48), (40, 90, 160)).save(buffered, format="JPEG")
+    background = base64.b64encode(buffered.getvalue()).decode()
+    reserved_during_llm = []
+
+    async def prompt(session, theme):
+        return f"a calm background for {theme}"
+
+    async def image(session, **arguments):
+        return {"images": [{"content": background, "content_type": "image/jpeg"}]}
+
+    async def text_properties(session, description, text):
+        reserved_during_llm.append(banner_pipeline.admission.reserved)
+        return {"placement": "center", "size": 24, "color": "#FFFFFF", "font": "arial"}
+
+    monkeypatch.setattr(banner_pipeline, "generate_background_prompt", prompt)
+    monkeypatch.setattr(banner_pipeline, "generate_image", image)
+    monkeypatch.setattr(banner_pipeline, "cached_text_properties", text_properties)
+    monkeypatch.setattr(banner_pipeline.banner_catalog, "save",
+                        lambda image_png, product_name, **fields: {"id": 1, "path": "banner.png"})
+    request = banner_pipeline.AdRequest(product_name="Nike", theme="summer sale", extra_input="",
+                                        promotional_offer="20% off", text_overlay="Summer sale")
+
+    result = asyncio.run(banner_pipeline.generate_banner(None, request, "Nike", "default"))
+    assert "error" not in result
+    assert result["text_overlay_properties"]["size"] == 24
+    assert reserved_during_llm == [0]
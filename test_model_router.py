@@ -0,0 +1,78 @@
+from services import model_router
+from services.model_router import CircuitBreaker
+
+
+def _tripped(name="model"):
+    breaker = CircuitBreaker(name)
+    for _ in range(model_router.BREAKER_MIN_CALLS):
+        breaker.record(False, 0.1)
+    return breaker
+
+
+def test_breaker_opens_after_enough_failures():
+    breaker = CircuitBreaker("model")
+    for _ in range(model_router.BREAKER_MIN_CALLS - 1):
+        breaker.record(False, 0.1)
+    assert breaker.state == "closed"
+    breaker.record(False, 0.1)
+    assert breaker.state == "open"
+    assert breaker.trips == 1
+    assert not breaker.allow()
+
+
+def test_slow_calls_count_as_failures():
+    breaker = CircuitBreaker("model")
+    for _ in range(model_router.BREAKER_MIN_CALLS):
+        breaker.record(True, model_router.BREAKER_SLOW_CALL_SECONDS + 1)
+    assert breaker.state == "open"
+
+
+def test_half_open_lets_one_probe_through(monkeypatch):
+    breaker = _tripped()
+    monkeypatch.setattr(model_router, "BREAKER_COOLDOWN_SECONDS", 0)
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    assert not breaker.allow()
+
+
+def test_successful_probe_closes_the_breaker(monkeypatch):
+    breaker = _tripped()
+    monkeypatch.setattr(model_router, "BREAKER_COOLDOWN_SECONDS", 0)
+    assert breaker.allow()
+    breaker.record(True, 0.1)
+    assert breaker.state == "closed"
+    assert breaker.allow() and breaker.allow()
+
+
+def test_failed_probe_reopens_the_breaker(monkeypatch):
+    breaker = _tripped()
+    monkeypatch.setattr(model_router, "BREAKER_COOLDOWN_SECONDS", 0)
+    assert breaker.allow()
+    breaker.record(False, 0.1)
+    assert breaker.state == "open"
+    assert breaker.trips == 2
+
+
+def test_released_probe_can_be_taken_again(monkeypatch):
+    breaker = _tripped()
+    monkeypatch.setattr(model_router, "BREAKER_COOLDOWN_SECONDS", 0)
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+
+
+def test_route_degrades_past_an_open_tier(monkeypatch):
+    monkeypatch.setattr(model_router, "breakers", {})
+    premium = model_router.QUALITY_TIERS["premium"]["model"]
+    model_router.breakers[premium] = _tripped(premium)
+    tier, model, _, _ = model_router.route("premium", False, "fal-ai/flux-lora", 28, 3.5)
+    assert tier == "standard"
+    assert model == model_router.QUALITY_TIERS["standard"]["model"]
+
+
+def test_route_has_no_fallback_for_loras_by_default(monkeypatch):
+    monkeypatch.setattr(model_router, "breakers", {})
+    lora_model = model_router.QUALITY_TIERS["premium"]["lora_model"]
+    model_router.breakers[lora_model] = _tripped(lora_model)
+    assert model_router.route("premium", True, "fal-ai/flux-lora", 28, 3.5) is None
@@ -0,0 +1,51 @@
+import asyncio
+from dataclasses import dataclass
+from typing import Optional
+from services import prewarm
+from services.prewarm import Prewarmer
+
+
+@dataclass
+class Request:
+    theme: str
+    seed: Optional[int] = None
+    image_size: str = "landscape_4_3"
+    reuse_similar_theme: bool = True
+
+
+def _hot(prewarmer, theme, times=3, **fields):
+    request = Request(theme, **fields)
+    for _ in range(times):
+        prewarmer.record(request, f"key-{theme}")
+
+
+def test_candidates_are_the_hot_profiles_still_missing_something(monkeypatch):
+    monkeypatch.setattr(prewarm, "PREWARM_MIN_SCORE", 2)
+    prewarmer = Prewarmer()
+    _hot(prewarmer, "diwali lights")
+    _hot(prewarmer, "eid feast")
+    _hot(prewarmer, "xmas", times=1)
+    missing = {"diwali lights": ["text_properties"], "eid feast": []}
+
+    candidates = prewarmer.candidates(lambda request: missing.get(request.theme, ["prompt"]))
+    assert [(key[0], inputs) for key, _, inputs in candidates] == [("diwali lights", ["text_properties"])]
+
+
+def test_warm_once_spends_one_call_per_missing_input(monkeypatch):
+    monkeypatch.setattr(prewarm, "PREWARM_MIN_SCORE", 2)
+    monkeypatch.setattr(prewarm, "PREWARM_IDLE_SECONDS", 0)
+    monkeypatch.setattr(prewarm, "PREWARM_MAX_CALLS_PER_HOUR", 3)
+    prewarmer = Prewarmer()
+    _hot(prewarmer, "diwali lights", times=4)
+    _hot(prewarmer, "eid feast")
+    warmed = []
+
+    async def warm(session, request, inputs):
+        warmed.append((request.theme, inputs))
+
+    missing = {"diwali lights": ["prompt", "text_properties"], "eid feast": ["prompt", "text_properties"]}
+    assert asyncio.run(prewarmer.warm_once(None, warm, lambda request: missing[request.theme])) == 1
+    assert warmed == [("diwali lights", ["prompt", "text_properties"])]
+    assert prewarmer.stats()["over_budget"] == 1
+    # Nothing was a background, so nothing entered the pool of warmed backgrounds
+    assert prewarmer.stats()["warm_entries"] == 0
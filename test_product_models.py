@@ -0,0 +1,41 @@
+import json
+import os
+import pytest
+from services import product_models as product_models_module
+from services.product_models import DEFAULT_PRODUCT_MODEL, ProductModels
+
+
+def _write(path, data, mtime):
+    path.write_text(json.dumps(data))
+    os.utime(path, (mtime, mtime))
+
+
+def test_default_file_does_not_depend_on_the_working_directory(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    models = ProductModels(product_models_module.DEFAULT_PRODUCT_MODELS_FILE, required=False)
+    assert models.stats()["products"] > 0
+    assert models.last_error is None
+
+
+def test_missing_required_file_fails_loudly(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        ProductModels(str(tmp_path / "missing.json"), required=True)
+
+
+def test_missing_optional_file_falls_back_to_the_default_model(tmp_path):
+    models = ProductModels(str(tmp_path / "missing.json"), required=False)
+    assert models.get("Nike") == DEFAULT_PRODUCT_MODEL
+
+
+def test_edits_are_reloaded_and_bad_edits_ignored(tmp_path):
+    path = tmp_path / "models.json"
+    _write(path, {"Nike": {"base_model": "fal-ai/flux/dev", "loras": None}}, 1000)
+    models = ProductModels(str(path), reload_seconds=0)
+    assert models.get("Nike")["base_model"] == "fal-ai/flux/dev"
+
+    _write(path, {"Nike": {"base_model": "fal-ai/flux-lora", "loras": [{"path": "nike.safetensors"}]}}, 2000)
+    assert models.get("Nike")["loras"] == [{"path": "nike.safetensors"}]
+
+    _write(path, {"Nike": {"loras": None}}, 3000)
+    assert models.get("Nike")["base_model"] == "fal-ai/flux-lora"
+    assert "base_model" in models.last_error
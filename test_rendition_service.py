@@ -0,0 +1,62 @@
+import io
+import numpy as np
+from PIL import Image
+from services.rendition_service import (
+    _properties_for_size, render_renditions, saliency_crop_box, saliency_map
+)
+from services.text_layout import EDGE_MARGIN, MIN_FONT_SIZE
+
+BACKGROUND = (40, 90, 160)
+
+
+def _background(size=(1024, 768), subject=None):
+    """A flat background, optionally with a bright subject at (left, top, right, bottom)"""
+    image = Image.new("RGB", size, BACKGROUND)
+    if subject is not None:
+        image.paste((250, 220, 30), subject)
+    return image
+
+
+def _png(image):
+    buffered = io.BytesIO()
+    image.save(buffered, format="PNG")
+    return buffered.getvalue()
+
+
+def test_crop_keeps_the_salient_subject():
+    subject = (820, 300, 960, 440)
+    image = _background(subject=subject)
+    left, top, right, bottom = saliency_crop_box(image.size, (512, 512), saliency_map(image))
+    assert (right - left, bottom - top) == (768, 768)
+    assert left <= subject[0] and right >= subject[2]
+
+
+def test_crop_of_a_flat_image_is_centered():
+    image = _background((1024, 1024))
+    left, top, right, bottom = saliency_crop_box(image.size, (1024, 576), saliency_map(image))
+    assert (left, right) == (0, 1024)
+    assert top == (1024 - (bottom - top)) // 2
+
+
+def test_rendition_text_stays_inside_each_target():
+    text = "Celebrate the season with fifty percent off every shoe in store"
+    properties = {"placement": "center bottom", "size": 120, "color": "#FFFFFF", "font": "arial"}
+    renditions = render_renditions(_png(_background()), text, properties,
+                                   ["strip_2100x600", "portrait_16_9", "square"])
+    for rendition in renditions:
+        image = Image.open(io.BytesIO(rendition["image"].data)).convert("RGB")
+        assert image.size == (rendition["width"], rendition["height"])
+        left, top, right, bottom = rendition["crop_box"]
+        assert abs((right - left) / (bottom - top) - image.width / image.height) < 0.01
+        # Everything that isn't background is the overlay text
+        text_pixels = np.argwhere(np.any(np.asarray(image) != BACKGROUND, axis=2))
+        assert text_pixels.size
+        (y0, x0), (y1, x1) = text_pixels.min(axis=0), text_pixels.max(axis=0)
+        assert x0 >= EDGE_MARGIN and x1 < image.width - EDGE_MARGIN
+        assert y0 >= EDGE_MARGIN and y1 < image.height - EDGE_MARGIN
+
+
+def test_scaled_font_size_never_drops_below_the_minimum():
+    properties = {"placement": "center", "size": 48, "color": "#FFFFFF", "font": "arial"}
+    assert _properties_for_size(properties, (1024, 768), (512, 384))["size"] == 24
+    assert _properties_for_size(properties, (1024, 768), (64, 64))["size"] == MIN_FONT_SIZE
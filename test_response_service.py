@@ -0,0 +1,91 @@
+import asyncio
+import base64
+import json
+from services.response_service import (
+    ImagePart, json_response, multipart_response, negotiated_response, wants_multipart
+)
+
+# Binary that contains CRLFs and boundary-like dashes, so it only survives if written raw
+PNG = b"\x89PNG\r\n\x1a\n\r\n--not-a-boundary\x00\xff"
+JPEG = b"\xff\xd8\xff\xe0 jpeg bytes \r\n"
+
+
+def _content():
+    return {
+        "banner_id": 7,
+        "combined_image": ImagePart(PNG, "image/png"),
+        "renditions": [{"size": "square", "image": ImagePart(JPEG, "image/jpeg")}],
+    }
+
+
+def _body(response):
+    async def collect():
+        return b"".join([chunk async for chunk in response.body_iterator])
+    return asyncio.run(collect())
+
+
+def _parts(response, body):
+    """(headers, payload) for each part, split on the boundary from the Content-Type"""
+    boundary = response.media_type.split('boundary="')[1].rstrip('"').encode()
+    assert body.endswith(b"--" + boundary + b"--\r\n")
+    parts = []
+    for raw in body.split(b"--" + boundary)[1:-1]:
+        head, _, payload = raw.lstrip(b"\r\n").partition(b"\r\n\r\n")
+        headers = dict(line.split(": ", 1) for line in head.decode().split("\r\n"))
+        length = int(headers["Content-Length"])
+        assert payload[length:] == b"\r\n"
+        parts.append((headers, payload[:length]))
+    return parts
+
+
+def test_accept_negotiation():
+    assert wants_multipart("multipart/mixed")
+    assert wants_multipart("multipart/*, application/json;q=0.9")
+    assert wants_multipart("application/json;q=0.5, multipart/mixed")
+    assert not wants_multipart("")
+    assert not wants_multipart("*/*")
+    assert not wants_multipart("application/json")
+    assert not wants_multipart("application/json, multipart/mixed;q=0.5")
+    assert not wants_multipart("multipart/mixed;q=0")
+
+
+def test_multipart_body_carries_metadata_then_raw_images():
+    response = multipart_response(_content())
+    body = _body(response)
+    assert int(response.headers["content-length"]) == len(body)
+    parts = _parts(response, body)
+
+    (metadata_headers, metadata), *images = parts
+    assert metadata_headers["Content-Type"] == "application/json"
+    assert metadata_headers["Content-ID"] == "<metadata>"
+    metadata = json.loads(metadata)
+    assert metadata["banner_id"] == 7
+    png_ref = metadata["combined_image"]
+    jpeg_ref = metadata["renditions"][0]["image"]
+    assert png_ref == {"part": "image-0", "content_type": "image/png", "length": len(PNG)}
+    assert jpeg_ref["content_type"] == "image/jpeg"
+
+    by_id = {headers["Content-ID"]: (headers["Content-Type"], data) for headers, data in images}
+    assert by_id[f"<{png_ref['part']}>"] == ("image/png", PNG)
+    assert by_id[f"<{jpeg_ref['part']}>"] == ("image/jpeg", JPEG)
+
+
+def test_result_without_images_is_a_single_part():
+    response = multipart_response({"error": "Deadline exceeded"}, status_code=504)
+    parts = _parts(response, _body(response))
+    assert len(parts) == 1
+    assert json.loads(parts[0][1]) == {"error": "Deadline exceeded"}
+
+
+def test_json_response_inlines_images_as_base64():
+    response = negotiated_response("application/json", _content())
+    assert response.media_type == "application/json"
+    body = json.loads(response.body)
+    assert base64.b64decode(body["combined_image"]) == PNG
+    assert base64.b64decode(body["renditions"][0]["image"]) == JPEG
+    assert json.loads(json_response({"ok": True}).body) == {"ok": True}
+
+
+def test_negotiated_response_keeps_the_status():
+    assert negotiated_response("multipart/mixed", _content(), 207).status_code == 207
+    assert negotiated_response("*/*", _content(), 207).status_code == 207
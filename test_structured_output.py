@@ -0,0 +1,94 @@
+import asyncio
+import pytest
+from services.structured_output import (
+    Record,
+    StructuredOutputError,
+    Text,
+    complete_structured,
+    acomplete_structured,
+    parse_structured,
+)
+from services.text_layout import MAX_FONT_SIZE
+from services.text_properties import TextProperties
+
+VALID = {"placement": "center top", "size": 48, "color": "#FFFFFF", "font": "impact", "effects": None}
+
+
+def test_near_misses_are_coerced():
+    properties = TextProperties.from_dict({
+        "placement": "Top_Center",
+        "size": "47.6px",
+        "color": "ff0000",
+        "font": "IMPACT",
+        "effects": {"shadow": {"color": "#00000080", "offset": 3, "blur": "2"}},
+        "rotation": 15,
+    })
+    assert properties.to_dict() == {
+        "placement": "center top",
+        "size": 48,
+        "color": "#ff0000",
+        "font": "impact",
+        "effects": {"shadow": {"color": "#00000080", "offset": [3, 3], "blur": 2}},
+    }
+
+
+def test_out_of_range_sizes_are_clamped():
+    assert TextProperties.from_dict({**VALID, "size": 999}).size == MAX_FONT_SIZE
+
+
+def test_every_error_is_reported():
+    with pytest.raises(StructuredOutputError) as error:
+        TextProperties.from_dict({"placement": "middle", "size": "big", "color": "#FFFFFF"})
+    assert len(error.value.errors) == 3
+    assert any("$.font is missing" in message for message in error.value.errors)
+
+
+def test_empty_effects_are_dropped():
+    properties = TextProperties.from_dict({**VALID, "effects": {"gradient": {"colors": [], "direction": "vertical"}}})
+    assert "effects" not in properties.to_dict()
+
+
+def test_schema_is_strict():
+    schema = TextProperties.json_schema()
+    assert schema["additionalProperties"] is False
+    assert schema["required"] == list(TextProperties.FIELDS)
+    assert {"type": "null"} in schema["properties"]["effects"]["anyOf"]
+
+
+def test_fenced_reply_is_cleaned_locally():
+    reply = 'Here you go:\n```json\n{"placement": "center", "size": 40, "color": "#000", "font": "impact",}\n```'
+    assert parse_structured(TextProperties, reply).size == 40
+
+
+class Greeting(Record):
+    FIELDS = {"text": Text()}
+    __slots__ = tuple(FIELDS)
+
+
+def test_invalid_reply_is_repaired_once():
+    replies = iter(['{"txt": "hi"}', '{"text": "hi"}'])
+    sent = []
+
+    def send(messages):
+        sent.append(messages)
+        return next(replies)
+
+    assert complete_structured(Greeting, [{"role": "user", "content": "greet"}], send).text == "hi"
+    assert len(sent) == 2
+    repair = sent[1][-1]["content"]
+    assert "$.text is missing" in repair
+
+
+def test_failed_repair_raises():
+    async def send(messages):
+        return "not json"
+
+    with pytest.raises(StructuredOutputError):
+        asyncio.run(acomplete_structured(Greeting, [{"role": "user", "content": "greet"}], send))
+
+
+def test_first_reply_can_come_from_elsewhere():
+    def send(messages):
+        raise AssertionError("a valid reply needs no repair call")
+
+    assert complete_structured(Greeting, [], send, content='{"text": "hi"}').text == "hi"
@@ -0,0 +1,70 @@
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+from services.fonts import load_font
+from services.text_generation_service import _composite_blurred_text, render_text_layer
+
+CANVAS = (400, 200)
+FONT = load_font("arial", 48)
+
+
+def _alpha(image):
+    return np.asarray(image.getchannel("A"), dtype=np.int16)
+
+
+def _text_bbox(position, text="Sale", spread=0):
+    return ImageDraw.Draw(Image.new("RGBA", CANVAS)).textbbox(position, text, font=FONT, stroke_width=spread)
+
+
+def _full_canvas_reference(position, color, radius, spread=0):
+    """The straightforward version: draw and blur a mask the size of the whole canvas"""
+    mask = Image.new("L", CANVAS, 0)
+    ImageDraw.Draw(mask).text(position, "Sale", font=FONT, fill=255, stroke_width=spread, stroke_fill=255)
+    mask = mask.filter(ImageFilter.GaussianBlur(radius))
+    layer = Image.new("RGBA", CANVAS, color + (255,))
+    layer.putalpha(mask)
+    canvas = Image.new("RGBA", CANVAS, (0, 0, 0, 0))
+    canvas.alpha_composite(layer)
+    return canvas
+
+
+def test_bounded_blur_matches_a_full_canvas_blur():
+    image = Image.new("RGBA", CANVAS, (0, 0, 0, 0))
+    _composite_blurred_text(image, (150, 60), "Sale", FONT, "#FF8800", 6, spread=2)
+    reference = _full_canvas_reference((150, 60), (255, 136, 0), 6, spread=2)
+    assert np.abs(_alpha(image) - _alpha(reference)).max() <= 2
+
+
+def test_glow_stays_within_the_padded_text_box():
+    radius, spread = 5, 3
+    image = Image.new("RGBA", CANVAS, (0, 0, 0, 0))
+    _composite_blurred_text(image, (150, 60), "Sale", FONT, "#00FFFF", radius, spread)
+
+    left, top, right, bottom = _text_bbox((150, 60), spread=spread)
+    pad = 3 * radius + spread
+    glow_left, glow_top, glow_right, glow_bottom = image.getbbox()
+    assert glow_left >= left - pad and glow_top >= top - pad
+    assert glow_right <= right + pad and glow_bottom <= bottom + pad
+    # The blur does reach past the text itself
+    assert glow_left < left and glow_right > right
+
+
+def test_translucent_shadow_keeps_its_alpha():
+    properties = {"placement": "center", "size": 48, "color": "#FFFFFF", "font": "arial",
+                  "effects": {"shadow": {"color": "#00000080", "offset": [4, 4], "blur": 3}}}
+    layer = render_text_layer("Sale", properties, CANVAS)
+    pixels = np.asarray(layer)
+    shadow_only = (pixels[..., :3].max(axis=2) == 0) & (pixels[..., 3] > 0)
+    assert shadow_only.any()
+    assert pixels[..., 3][shadow_only].max() <= 128
+
+
+def test_blur_box_is_clipped_at_the_canvas_edge():
+    image = Image.new("RGBA", CANVAS, (0, 0, 0, 0))
+    # Text partly off the canvas, with a pad far larger than the margin left
+    _composite_blurred_text(image, (-20, -10), "Sale", FONT, "#FFFFFF", 20)
+    assert image.size == CANVAS
+    assert image.getbbox()[:2] == (0, 0)
+
+    nothing = Image.new("RGBA", CANVAS, (0, 0, 0, 0))
+    _composite_blurred_text(nothing, (CANVAS[0] + 200, 0), "Sale", FONT, "#FFFFFF", 4)
+    assert nothing.getbbox() is None
@@ -0,0 +1,86 @@
+import asyncio
+import threading
+import time
+from PIL import Image
+from services import text_generation_service
+from services.text_layer_cache import TextLayer, TextLayerCache
+
+
+def _layer():
+    return TextLayer(Image.new("RGBA", (10, 10), (255, 255, 255, 255)), (0, 0), (100, 100))
+
+
+def _in_threads(count, call):
+    results = [None] * count
+    errors = [None] * count
+
+    def run(index):
+        try:
+            results[index] = call()
+        except Exception as e:
+            errors[index] = e
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, errors
+
+
+def test_concurrent_identical_renders_run_once():
+    cache = TextLayerCache()
+    renders = []
+
+    def render():
+        renders.append(1)
+        time.sleep(0.05)
+        return _layer()
+
+    results, errors = _in_threads(8, lambda: cache.get_or_render(("sale",), render))
+    assert errors == [None] * 8
+    assert len(renders) == 1
+    assert all(result is results[0] for result in results)
+    stats = cache.stats()
+    assert (stats["misses"], stats["coalesced"], stats["in_flight"]) == (1, 7, 0)
+    # Finished renders are cached, so later calls are plain hits
+    assert cache.get_or_render(("sale",), render) is results[0]
+    assert cache.stats()["hits"] == 1
+
+
+def test_failed_render_reaches_every_waiter_and_is_retried():
+    cache = TextLayerCache()
+    attempts = []
+
+    def failing():
+        attempts.append(1)
+        time.sleep(0.05)
+        raise OSError("font file vanished")
+
+    _, errors = _in_threads(4, lambda: cache.get_or_render(("sale",), failing))
+    assert len(attempts) == 1
+    assert all(isinstance(error, OSError) for error in errors)
+    assert cache.stats()["in_flight"] == 0
+    assert cache.get_or_render(("sale",), _layer).image is not None
+
+
+def test_text_layer_coalesces_concurrent_threads(monkeypatch):
+    monkeypatch.setattr(text_generation_service, "text_layer_cache", TextLayerCache())
+    original = text_generation_service.render_text_layer
+    renders = []
+
+    def counting(text, properties, image_size):
+        renders.append(text)
+        time.sleep(0.05)
+        return original(text, properties, image_size)
+    monkeypatch.setattr(text_generation_service, "render_text_layer", counting)
+    properties = {"placement": "center", "size": 40, "color": "#ffffff", "font": "arial"}
+
+    async def render_many():
+        return await asyncio.gather(*(
+            asyncio.to_thread(text_generation_service.text_layer, "Summer sale", dict(properties), (400, 300))
+            for _ in range(6)
+        ))
+
+    layers = asyncio.run(render_many())
+    assert renders == ["Summer sale"]
+    assert len({id(layer) for layer in layers}) == 1
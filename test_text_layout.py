@@ -0,0 +1,76 @@
+from PIL import Image, ImageDraw
+from services.fonts import load_font
+from services.text_generation_service import render_text_layer
+from services.text_layout import EDGE_MARGIN, MIN_FONT_SIZE, fit_text, text_align
+
+
+def test_text_align_follows_the_horizontal_anchor():
+    assert text_align("left bottom") == "left"
+    assert text_align("Right_Top") == "right"
+    assert text_align("center top") == "center"
+    assert text_align("center") == "center"
+    # Unknown placements are drawn centered, so their lines are too
+    assert text_align("middle") == "center"
+
+
+def test_fit_text_keeps_the_largest_size_that_fits():
+    size, lines = fit_text("Summer sale", "arial", 2000, 1000, 80)
+    assert size == 80
+    assert lines == ["Summer sale"]
+
+
+def test_fit_text_wraps_and_shrinks_into_the_box():
+    text = "summer sale bonanza fifty percent off everything in store"
+    size, lines = fit_text(text, "arial", 300, 120, 120)
+    assert MIN_FONT_SIZE <= size < 120
+    assert len(lines) > 1
+    assert " ".join(lines) == text
+    draw = ImageDraw.Draw(Image.new("RGBA", (1, 1)))
+    left, top, right, bottom = draw.multiline_textbbox((0, 0), "\n".join(lines), font=load_font("arial", size))
+    assert right - left <= 300
+    assert bottom - top <= 120
+
+
+def test_fit_text_falls_back_to_min_size():
+    size, _ = fit_text("unbreakablewordthatnevereverfits" * 4, "arial", 50, 20, 120)
+    assert size == MIN_FONT_SIZE
+
+
+def _line_edges(layer, rows):
+    """(left, right) of the opaque pixels within each band of rows"""
+    alpha = layer.getchannel("A")
+    edges = []
+    for top, bottom in rows:
+        left, _, right, _ = alpha.crop((0, top, layer.width, bottom)).getbbox()
+        edges.append((left, right))
+    return edges
+
+
+def _render_lines(placement):
+    properties = {"placement": placement, "size": 40, "color": "#000000", "font": "arial"}
+    # Too wide for one line at 40px, so it wraps to a long and a short line
+    layer = render_text_layer("wide wide wide wide wide tiny", properties, (400, 300))
+    alpha = layer.getchannel("A")
+    rows = [y for y in range(layer.height) if alpha.crop((0, y, layer.width, y + 1)).getbbox()]
+    bands, start = [], rows[0]
+    for previous, row in zip(rows, rows[1:]):
+        if row != previous + 1:
+            bands.append((start, previous + 1))
+            start = row
+    bands.append((start, rows[-1] + 1))
+    return layer, _line_edges(layer, bands)
+
+
+def test_right_placement_aligns_wrapped_lines_right():
+    layer, edges = _render_lines("right")
+    assert len(edges) >= 2
+    rights = [right for _, right in edges]
+    assert max(rights) - min(rights) <= 3
+    assert max(rights) >= layer.width - EDGE_MARGIN - 3
+
+
+def test_center_placement_centers_each_wrapped_line():
+    layer, edges = _render_lines("center")
+    assert len(edges) >= 2
+    for left, right in edges:
+        assert abs((left + right) / 2 - layer.width / 2) <= 3
@@ -0,0 +1,54 @@
+import numpy as np
+from PIL import Image
+from services.text_layout import EDGE_MARGIN, MIN_FONT_SIZE
+from services.text_placement_service import FALLBACK_FONT_SIZE, find_text_region
+
+SIZE = (1024, 768)
+LONG_TEXT = ("Celebrate the season with fifty percent off every running shoe, "
+             "jacket and accessory in store this weekend only")
+
+
+def _plain():
+    return Image.new("RGB", SIZE, (40, 90, 160))
+
+
+def _noise(width):
+    """The plain background with random pixels over its left `width` columns"""
+    pixels = np.asarray(_plain()).copy()
+    pixels[:, :width] = np.random.default_rng(0).integers(0, 256, (SIZE[1], width, 3))
+    return Image.fromarray(pixels)
+
+
+def _inside_margins(box):
+    x, y, width, height = box
+    return (x >= EDGE_MARGIN and y >= EDGE_MARGIN
+            and x + width <= SIZE[0] - EDGE_MARGIN and y + height <= SIZE[1] - EDGE_MARGIN)
+
+
+def test_short_text_gets_a_large_single_line():
+    (placement, font_size, box, score), _ = find_text_region(_plain(), "Sale")
+    assert font_size >= 100
+    assert box[2] < SIZE[0] // 2
+    assert _inside_margins(box)
+
+
+def test_long_text_is_sized_by_its_wrapped_block():
+    (placement, font_size, box, score), _ = find_text_region(_plain(), LONG_TEXT)
+    # A single line of this text would only fit at a tiny size
+    assert font_size > 3 * MIN_FONT_SIZE
+    assert box[3] > 2 * font_size
+    assert _inside_margins(box)
+
+
+def test_cluttered_side_is_avoided():
+    (placement, font_size, box, score), maps = find_text_region(_noise(620), "Sale")
+    assert placement.startswith("right")
+    assert box[0] >= 620
+    assert score <= maps.detail_limit
+
+
+def test_busy_background_falls_back_to_a_readable_size():
+    (placement, font_size, box, score), maps = find_text_region(_noise(SIZE[0]), LONG_TEXT)
+    assert score > maps.detail_limit
+    assert MIN_FONT_SIZE < font_size <= FALLBACK_FONT_SIZE
+    assert _inside_margins(box)
@@ -0,0 +1,64 @@
+from services.theme_index import ThemeIndex, jaccard, normalize_theme, shingle
+
+
+def _similarity(a, b):
+    return jaccard(shingle(normalize_theme(a)), shingle(normalize_theme(b)))
+
+
+def test_lookup_matches_at_the_threshold_and_misses_just_below_it():
+    similarity = _similarity("summer sale", "summer sales")
+    at_threshold = ThemeIndex(threshold=similarity)
+    at_threshold.add("summer sale", "beach at dusk", "seed-1", "ref-1")
+
+    match = at_threshold.lookup("summer sales", "seed-1")
+    assert match["matched_theme"] == "summer sale"
+    assert match["prompt"] == "beach at dusk"
+    assert match["background_ref"] == "ref-1"
+
+    above_threshold = ThemeIndex(threshold=similarity + 0.01)
+    above_threshold.add("summer sale", "beach at dusk", "seed-1", "ref-1")
+    assert above_threshold.lookup("summer sales", "seed-1") is None
+    assert above_threshold.stats()["matches"] == 0
+
+
+def test_background_is_only_reused_under_the_same_background_key():
+    index = ThemeIndex()
+    index.add("summer sale", "beach at dusk", "seed-1", "ref-1")
+    assert index.lookup("Summer Sale!", "seed-2")["background_ref"] is None
+
+
+def test_evicting_a_theme_drops_its_backgrounds():
+    index = ThemeIndex(max_entries=2)
+    index.add("summer sale", "beach", "seed-1", "ref-1")
+    index.add("winter sale", "snow", "seed-1", "ref-2")
+    index.add("spring sale", "blossoms", "seed-1", "ref-3")
+
+    assert len(index) == 2
+    assert not index.has_background("summer sale", "seed-1")
+    assert index.background_ref("winter sale", "seed-1") == "ref-2"
+    assert index.stats()["cached_backgrounds"] == 2
+
+
+def test_background_references_are_capped_separately():
+    index = ThemeIndex(background_cache_size=1)
+    index.add("summer sale", "beach", "seed-1", "ref-1")
+    index.add("winter sale", "snow", "seed-1", "ref-2")
+
+    assert index.prompt_for("summer sale") == "beach"
+    assert not index.has_background("summer sale", "seed-1")
+    assert index.has_background("winter sale", "seed-1")
+
+
+def test_prompt_for_touches_neither_recency_nor_stats():
+    index = ThemeIndex(threshold=0.7, max_entries=2)
+    index.add("summer sale", "beach")
+    index.add("winter sale", "snow")
+
+    assert index.prompt_for("summer sales") == "beach"
+    assert index.stats()["lookups"] == 0
+    assert index.stats()["matches"] == 0
+
+    # Still the least recently used, so it is the one evicted
+    index.add("spring sale", "blossoms")
+    assert index.prompt_for("summer sale") is None
+    assert index.prompt_for("winter sale") == "snow"
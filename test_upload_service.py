@@ -0,0 +1,57 @@
+import asyncio
+import pytest
+from services import upload_service
+from services.upload_service import MalformedUpload, UploadTooLarge, read_multipart_upload
+
+BOUNDARY = "testboundary"
+
+
+class FakeRequest:
+    def __init__(self, body: bytes, content_length=None, chunk_size=4096):
+        self.headers = {"content-type": f"multipart/form-data; boundary={BOUNDARY}"}
+        if content_length is not None:
+            self.headers["content-length"] = content_length
+        self._body = body
+        self._chunk_size = chunk_size
+
+    async def stream(self):
+        for offset in range(0, len(self._body), self._chunk_size):
+            yield self._body[offset:offset + self._chunk_size]
+
+
+def _body(*parts):
+    body = b""
+    for name, data, filename in parts:
+        disposition = f'form-data; name="{name}"'
+        if filename:
+            disposition += f'; filename="{filename}"'
+        body += f"--{BOUNDARY}\r\nContent-Disposition: {disposition}\r\n\r\n".encode() + data + b"\r\n"
+    return body + f"--{BOUNDARY}--\r\n".encode()
+
+
+def test_reads_fields_and_files():
+    body = _body(("company_context", b"shoes", None), ("guidelines_file", b"%PDF data", "g.pdf"))
+    fields, uploads = asyncio.run(read_multipart_upload(FakeRequest(body, str(len(body)))))
+    assert fields == {"company_context": "shoes"}
+    assert uploads["guidelines_file"].file.read() == b"%PDF data"
+
+
+def test_non_numeric_content_length_is_malformed():
+    body = _body(("company_context", b"shoes", None))
+    with pytest.raises(MalformedUpload):
+        asyncio.run(read_multipart_upload(FakeRequest(body, "lots")))
+
+
+def test_total_body_is_capped_across_parts(monkeypatch):
+    monkeypatch.setattr(upload_service, "MULTIPART_OVERHEAD_BYTES", 1024)
+    # Every file is under max_bytes, but together they are far over the body cap
+    parts = [(f"file{i}", b"x" * 900, f"f{i}.bin") for i in range(20)]
+    with pytest.raises(UploadTooLarge):
+        asyncio.run(read_multipart_upload(FakeRequest(_body(*parts)), max_bytes=1000))
+
+
+def test_total_body_is_capped_across_fields(monkeypatch):
+    monkeypatch.setattr(upload_service, "MULTIPART_OVERHEAD_BYTES", 1024)
+    parts = [(f"field{i}", b"y" * 900, None) for i in range(20)]
+    with pytest.raises(UploadTooLarge):
+        asyncio.run(read_multipart_upload(FakeRequest(_body(*parts)), max_bytes=1000))
@@ -0,0 +1,106 @@
+import asyncio
+import io
+import os
+import time
+from PIL import Image
+from starlette.requests import Request
+from services import variant_service
+from services.disk_cache import DiskLRUCache
+
+# background.service builds its OpenAI client at import time; no request is made in these tests
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+import main
+
+
+def _banner(tmp_path):
+    path = tmp_path / "banner.png"
+    Image.new("RGB", (640, 480), (40, 90, 160)).save(path)
+    return {"id": 1, "path": str(path), "content_sha256": "sha", "width": 640, "height": 480}
+
+
+def _isolated(monkeypatch, tmp_path):
+    monkeypatch.setattr(variant_service, "variant_cache", DiskLRUCache(str(tmp_path / "variants"), 1024 * 1024))
+    monkeypatch.setattr(variant_service, "variant_stats", variant_service.Counter())
+    renders = []
+    original = variant_service.render_variant
+
+    def counting(*args):
+        renders.append(args)
+        time.sleep(0.05)
+        return original(*args)
+    monkeypatch.setattr(variant_service, "render_variant", counting)
+    return renders
+
+
+def test_concurrent_identical_variants_render_once(monkeypatch, tmp_path):
+    renders = _isolated(monkeypatch, tmp_path)
+    banner = _banner(tmp_path)
+
+    async def fetch_many():
+        return await asyncio.gather(*(variant_service.get_variant(banner, 320, "webp") for _ in range(5)))
+
+    results = asyncio.run(fetch_many())
+    assert len(renders) == 1
+    assert len(set(results)) == 1
+    assert Image.open(io.BytesIO(results[0][0])).size == (320, 240)
+    assert variant_service.variant_stats["coalesced"] == 4
+
+    # Now on disk: a later request is a cache hit
+    asyncio.run(variant_service.get_variant(banner, 320, "webp"))
+    assert len(renders) == 1
+    assert variant_service.variant_stats["cache_hits"] == 1
+
+
+def test_widths_past_the_original_share_one_entry(monkeypatch, tmp_path):
+    renders = _isolated(monkeypatch, tmp_path)
+    banner = _banner(tmp_path)
+    _, _, key = asyncio.run(variant_service.get_variant(banner, 2000, "png"))
+    _, _, same_key = asyncio.run(variant_service.get_variant(banner, 640, "png"))
+    assert key == same_key
+    assert len(renders) == 1
+
+
+def test_a_waiter_going_away_does_not_cancel_the_render(monkeypatch, tmp_path):
+    renders = _isolated(monkeypatch, tmp_path)
+    banner = _banner(tmp_path)
+
+    async def scenario():
+        leaving = asyncio.ensure_future(variant_service.get_variant(banner, 160, "jpeg"))
+        staying = asyncio.ensure_future(variant_service.get_variant(banner, 160, "jpeg"))
+        await asyncio.sleep(0.01)
+        leaving.cancel()
+        return await staying
+
+    data, content_type, _ = asyncio.run(scenario())
+    assert content_type == "image/jpeg"
+    assert data
+    assert len(renders) == 1
+
+
+def _variant_response(monkeypatch, tmp_path, if_none_match=None):
+    _isolated(monkeypatch, tmp_path)
+    banner = _banner(tmp_path)
+    monkeypatch.setattr(main.banner_catalog, "get", lambda banner_id: banner)
+    headers = [(b"if-none-match", if_none_match.encode())] if if_none_match else []
+    request = Request({"type": "http", "method": "GET", "path": "/banners/1/variant", "headers": headers})
+    return asyncio.run(main.banner_variant(request, 1, width=320, format="webp", quality=80))
+
+
+def test_matching_etag_gets_a_304(monkeypatch, tmp_path):
+    first = _variant_response(monkeypatch, tmp_path)
+    assert first.status_code == 200
+    etag = first.headers["etag"]
+    assert first.headers["cache-control"] == "public, max-age=31536000, immutable"
+
+    for validator in (etag, f"W/{etag}", "*"):
+        revalidated = _variant_response(monkeypatch, tmp_path, validator)
+        assert revalidated.status_code == 304
+        assert revalidated.body == b""
+        assert revalidated.headers["etag"] == etag
+
+
+def test_stale_etag_gets_the_variant(monkeypatch, tmp_path):
+    response = _variant_response(monkeypatch, tmp_path, '"some-older-variant"')
+    assert response.status_code == 200
+    assert response.media_type == "image/webp"
+    assert response.body